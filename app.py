@@ -1,41 +1,320 @@
 import copy
-from typing import List, Tuple
+import os
+from array import array
+from functools import cached_property
+from types import MappingProxyType
+from typing import List, Mapping, NamedTuple, Set, Tuple
 from defs import EMPTY, WHITE, is_empty, COLOR_MASK, is_white, is_outside_board, is_black, PIECE_MASK, PAWN, ROOK, BISHOP, KNIGHT, QUEEN, KING, BLACK, CastlingType, BOARD_END, BOARD_START, EN_PASSANT, get_color, is_pawn, is_king
 import sys
+import time
 import json
-from defs import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, EMPTY, SENTINEL, DEFAULT_POSITION, KIWI_PETE, POSITION_3, BOARD_START, BOARD_END, is_empty, COLOR_MASK, is_king, is_white, is_black, algebraic_pairs_to_board_position, EN_PASSANT, Point, DEFAULT_POSITION
-from utils import get_piece_character, get_piece_from_fen_string_char
+import multiprocessing
+import queue
+import random
+import threading
+import traceback
+from defs import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, EMPTY, SENTINEL, DEFAULT_POSITION, KIWI_PETE, POSITION_3, BOARD_START, BOARD_END, is_empty, COLOR_MASK, is_king, is_white, is_black, algebraic_pairs_to_board_position, board_position_to_algebraic_pair, EN_PASSANT, Point, Move, DEFAULT_POSITION
+from defs import MOVE_CAPTURED_MASK, MOVE_PROMOTION_MASK, BOARD_WIDTH, SQUARE_CORDS, SQUARE_MASK, PIECE_CODE_MASK, MOVE_TO_SHIFT, MOVE_PIECE_SHIFT, MOVE_CAPTURED_SHIFT, MOVE_PROMOTION_SHIFT, MOVE_CASTLE, MOVE_EN_PASSANT, MOVE_DOUBLE_PUSH, NULL_MOVE, piece_code, piece_from_code, move_to_algebraic
+from utils import get_piece_character, get_piece_from_fen_string_char, get_fen_string_char
+from transposition import TranspositionTable, SharedTranspositionTable, DEFAULT_HASH_MB, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER
+from polyglot import PolyglotBook, choose_book_move
+from bitbase import Bitbases, BITBASE_DIRECTORY, BITBASE_DRAW, BITBASE_WIN, BITBASE_LOSS
+from zobrist import ZOBRIST_PIECES, ZOBRIST_WHITE_TO_MOVE, ZOBRIST_CASTLING, ZOBRIST_EN_PASSANT, compute_zobrist_key
+
+
+class Undo(NamedTuple):
+    """
+    Everything make_move changes that can't be recovered from the move itself
+    """
+    move: Move
+    captured: int
+    white_king_side_castle: bool
+    white_queen_side_castle: bool
+    black_king_side_castle: bool
+    black_queen_side_castle: bool
+    pawn_double_move: Point | None
+    half_move_clock: int
+    full_move_clock: int
+    white_king_location: Point
+    black_king_location: Point
+    white_total_piece_value: int
+    black_total_piece_value: int
+    last_move: Tuple[Point, Point] | None
+    zobrist_key: int
+    positional_score: int
+
+
+class Settings(NamedTuple):
+    """
+    The engine configuration from settings.json, loaded once and shared by every position
+    """
+    fen: str
+    directions: Mapping[str, Tuple[int, ...]]
+    colors: Mapping[str, int]
+    weights: Mapping[str, int]
+    pst: Tuple[int, ...]
+    rank_2: Tuple[int, ...]
+    rank_7: Tuple[int, ...]
+    coordinates: Tuple[str, ...]
+    pieces: Mapping[str, str]
+
+    # immutable, so copies of a position can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def load_settings(filename: str) -> Settings:
+    with open(filename, encoding="utf-8") as f:
+        return Settings(**{key: freeze(value) for key, value in json.load(f).items()})
+
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.json")
+SETTINGS = load_settings(SETTINGS_FILE)
 
 
 class Chess:
-    def __init__(self, filename):
-        with open(filename) as f:
-            self.__dict__ = json.loads(f.read())
-            self.board = list('         \n' * 2 + ' ' + ''.join([
-                '.' * int(c) if c.isdigit() else c
-                for c in self.fen.split()[0].replace('/', '\n ')
-            ]) + '\n' + '         \n' * 2)
-            self.side = 0 if self.fen.split()[1] == 'w' else 1
-            self.state = [[0] * 12 for i in range(12)]
-            self.to_move = WHITE
-            self.white_king_location: Point = (0, 0)
-            self.black_king_location: Point = (0, 0)
-            self.white_king_side_castle = True
-            self.white_queen_side_castle = True
-            self.black_king_side_castle = True
-            self.black_queen_side_castle = True
-            self.pawn_double_move: Point | None = None
-            # The number of the full moves. It starts at 1, and is incremented after Black's move
-            self.full_move_clock = 1
-            # The number of half moves since the last capture or pawn advance, used for the fifty-move rule
-            self.half_move_clock = 0
-            self.white_total_piece_value = 0
-            self.black_total_piece_value = 0
-            self.last_move: (Point, Point) | None = None
+    def __init__(self, settings: Settings = SETTINGS):
+        self.settings = settings
+        self.state = [[0] * 12 for i in range(12)]
+        self.to_move = WHITE
+        self.white_king_location: Point = (0, 0)
+        self.black_king_location: Point = (0, 0)
+        self.white_king_side_castle = True
+        self.white_queen_side_castle = True
+        self.black_king_side_castle = True
+        self.black_queen_side_castle = True
+        self.pawn_double_move: Point | None = None
+        # The number of the full moves. It starts at 1, and is incremented after Black's move
+        self.full_move_clock = 1
+        # The number of half moves since the last capture or pawn advance, used for the fifty-move rule
+        self.half_move_clock = 0
+        self.white_total_piece_value = 0
+        self.black_total_piece_value = 0
+        self.last_move: (Point, Point) | None = None
+        self.zobrist_key = 0
+        # the zobrist key before every move made, for finding repetitions
+        self.key_history: List[int] = []
+        # piece square score of everything but the kings, white positive
+        self.positional_score = 0
+        # square indexes of every piece, indexed by piece code
+        self.piece_squares: List[Set[int]] = [set() for _ in range(PIECE_CODE_MASK + 1)]
+
+    # the board and side of the 10x12 string engine below, only built when it is used
+    @cached_property
+    def board(self) -> List[str]:
+        return list('         \n' * 2 + ' ' + ''.join([
+            '.' * int(c) if c.isdigit() else c
+            for c in self.settings.fen.split()[0].replace('/', '\n ')
+        ]) + '\n' + '         \n' * 2)
+
+    @cached_property
+    def side(self) -> int:
+        return 0 if self.settings.fen.split()[1] == 'w' else 1
 
     def swap_color(self):
         self.to_move = WHITE if self.to_move == BLACK else BLACK
 
+    def make_move(self, move: Move) -> Undo:
+        """
+        Apply a pseudo-legal move to this position in place.
+        Returns the record unmake_move needs to restore the position.
+        """
+        from_cords = SQUARE_CORDS[move & SQUARE_MASK]
+        to_cords = SQUARE_CORDS[(move >> MOVE_TO_SHIFT) & SQUARE_MASK]
+        from_row, from_col = from_cords
+        to_row, to_col = to_cords
+        state = self.state
+        piece = state[from_row][from_col]
+        captured = state[to_row][to_col]
+        color = piece & COLOR_MASK
+        piece_type = piece & PIECE_MASK
+
+        undo = Undo(move, captured,
+                    self.white_king_side_castle, self.white_queen_side_castle,
+                    self.black_king_side_castle, self.black_queen_side_castle,
+                    self.pawn_double_move, self.half_move_clock, self.full_move_clock,
+                    self.white_king_location, self.black_king_location,
+                    self.white_total_piece_value, self.black_total_piece_value,
+                    self.last_move, self.zobrist_key, self.positional_score)
+
+        key = self.zobrist_key ^ ZOBRIST_WHITE_TO_MOVE
+        if self.pawn_double_move is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.pawn_double_move[1]]
+        from_index = move & SQUARE_MASK
+        to_index = (move >> MOVE_TO_SHIFT) & SQUARE_MASK
+        piece_squares = self.piece_squares
+        key ^= ZOBRIST_PIECES[piece_code(piece)][from_index]
+        positional_score = self.positional_score - PIECE_SQUARE_TABLES[piece_code(piece)][from_index]
+        piece_squares[piece_code(piece)].remove(from_index)
+
+        if captured != EMPTY:
+            key ^= ZOBRIST_PIECES[piece_code(captured)][to_index]
+            positional_score -= PIECE_SQUARE_TABLES[piece_code(captured)][to_index]
+            piece_squares[piece_code(captured)].remove(to_index)
+            if color == WHITE:
+                self.black_total_piece_value -= PIECE_VALUES[captured & PIECE_MASK]
+            else:
+                self.white_total_piece_value -= PIECE_VALUES[captured & PIECE_MASK]
+        elif move & MOVE_EN_PASSANT:
+            # the captured pawn sits beside the moving pawn
+            key ^= ZOBRIST_PIECES[piece_code(state[from_row][to_col])][from_row * BOARD_WIDTH + to_col]
+            positional_score -= PIECE_SQUARE_TABLES[piece_code(state[from_row][to_col])][from_row * BOARD_WIDTH + to_col]
+            piece_squares[piece_code(state[from_row][to_col])].remove(from_row * BOARD_WIDTH + to_col)
+            state[from_row][to_col] = EMPTY
+            if color == WHITE:
+                self.black_total_piece_value -= PIECE_VALUES[PAWN]
+            else:
+                self.white_total_piece_value -= PIECE_VALUES[PAWN]
+
+        state[from_row][from_col] = EMPTY
+        promotion = (move >> MOVE_PROMOTION_SHIFT) & PIECE_MASK
+        if promotion != EMPTY:
+            state[to_row][to_col] = color | promotion
+            key ^= ZOBRIST_PIECES[piece_code(color | promotion)][to_index]
+            positional_score += PIECE_SQUARE_TABLES[piece_code(color | promotion)][to_index]
+            piece_squares[piece_code(color | promotion)].add(to_index)
+            if color == WHITE:
+                self.white_total_piece_value += PIECE_VALUES[promotion] - PIECE_VALUES[PAWN]
+            else:
+                self.black_total_piece_value += PIECE_VALUES[promotion] - PIECE_VALUES[PAWN]
+        else:
+            state[to_row][to_col] = piece
+            key ^= ZOBRIST_PIECES[piece_code(piece)][to_index]
+            positional_score += PIECE_SQUARE_TABLES[piece_code(piece)][to_index]
+            piece_squares[piece_code(piece)].add(to_index)
+
+        if piece_type == KING:
+            if color == WHITE:
+                self.white_king_location = to_cords
+                self.white_king_side_castle = False
+                self.white_queen_side_castle = False
+            else:
+                self.black_king_location = to_cords
+                self.black_king_side_castle = False
+                self.black_queen_side_castle = False
+
+            # bring the rook over to the other side of the king
+            if move & MOVE_CASTLE:
+                rook_keys = ZOBRIST_PIECES[piece_code(color | ROOK)]
+                rook_table = PIECE_SQUARE_TABLES[piece_code(color | ROOK)]
+                rook_squares = piece_squares[piece_code(color | ROOK)]
+                row_index = from_row * BOARD_WIDTH
+                if to_col > from_col:
+                    rook_from, rook_to = row_index + BOARD_END - 1, row_index + BOARD_END - 3
+                else:
+                    rook_from, rook_to = row_index + BOARD_START, row_index + BOARD_START + 3
+                state[from_row][rook_from - row_index] = EMPTY
+                state[from_row][rook_to - row_index] = color | ROOK
+                key ^= rook_keys[rook_from] ^ rook_keys[rook_to]
+                positional_score += rook_table[rook_to] - rook_table[rook_from]
+                rook_squares.remove(rook_from)
+                rook_squares.add(rook_to)
+
+        # a rook leaving or being captured on its starting square takes away castling privileges
+        for cords in (from_cords, to_cords):
+            if cords == (BOARD_END - 1, BOARD_END - 1):
+                self.white_king_side_castle = False
+            elif cords == (BOARD_END - 1, BOARD_START):
+                self.white_queen_side_castle = False
+            elif cords == (BOARD_START, BOARD_START):
+                self.black_queen_side_castle = False
+            elif cords == (BOARD_START, BOARD_END - 1):
+                self.black_king_side_castle = False
+
+        if self.white_king_side_castle != undo.white_king_side_castle:
+            key ^= ZOBRIST_CASTLING[0]
+        if self.white_queen_side_castle != undo.white_queen_side_castle:
+            key ^= ZOBRIST_CASTLING[1]
+        if self.black_king_side_castle != undo.black_king_side_castle:
+            key ^= ZOBRIST_CASTLING[2]
+        if self.black_queen_side_castle != undo.black_queen_side_castle:
+            key ^= ZOBRIST_CASTLING[3]
+
+        # record the square behind a pawn that moved two spaces, it can be captured en passant
+        if move & MOVE_DOUBLE_PUSH:
+            self.pawn_double_move = ((from_row + to_row) // 2, from_col)
+            key ^= ZOBRIST_EN_PASSANT[from_col]
+        else:
+            self.pawn_double_move = None
+        self.zobrist_key = key
+        self.positional_score = positional_score
+
+        if piece_type == PAWN or captured != EMPTY:
+            self.half_move_clock = 0
+        else:
+            self.half_move_clock += 1
+
+        if color == BLACK:
+            self.full_move_clock += 1
+
+        self.last_move = (from_cords, to_cords)
+        self.to_move = BLACK if color == WHITE else WHITE
+        self.key_history.append(undo.zobrist_key)
+        return undo
+
+    def unmake_move(self, undo: Undo):
+        """
+        Take back the move recorded in undo, restoring the position exactly as it was before make_move.
+        """
+        move = undo.move
+        from_row, from_col = SQUARE_CORDS[move & SQUARE_MASK]
+        to_row, to_col = SQUARE_CORDS[(move >> MOVE_TO_SHIFT) & SQUARE_MASK]
+        state = self.state
+        piece = piece_from_code((move >> MOVE_PIECE_SHIFT) & PIECE_CODE_MASK)
+        color = piece & COLOR_MASK
+        from_index = move & SQUARE_MASK
+        to_index = (move >> MOVE_TO_SHIFT) & SQUARE_MASK
+        piece_squares = self.piece_squares
+
+        piece_squares[piece_code(state[to_row][to_col])].remove(to_index)
+        piece_squares[piece_code(piece)].add(from_index)
+        state[from_row][from_col] = piece
+        state[to_row][to_col] = undo.captured
+        if undo.captured != EMPTY:
+            piece_squares[piece_code(undo.captured)].add(to_index)
+
+        if move & MOVE_EN_PASSANT:
+            state[from_row][to_col] = (BLACK if color == WHITE else WHITE) | PAWN
+            piece_squares[piece_code(state[from_row][to_col])].add(from_row * BOARD_WIDTH + to_col)
+        elif move & MOVE_CASTLE:
+            rook_squares = piece_squares[piece_code(color | ROOK)]
+            if to_col > from_col:
+                rook_from, rook_to = BOARD_END - 1, BOARD_END - 3
+            else:
+                rook_from, rook_to = BOARD_START, BOARD_START + 3
+            state[from_row][rook_to] = EMPTY
+            state[from_row][rook_from] = color | ROOK
+            rook_squares.remove(from_row * BOARD_WIDTH + rook_to)
+            rook_squares.add(from_row * BOARD_WIDTH + rook_from)
+
+        self.white_king_side_castle = undo.white_king_side_castle
+        self.white_queen_side_castle = undo.white_queen_side_castle
+        self.black_king_side_castle = undo.black_king_side_castle
+        self.black_queen_side_castle = undo.black_queen_side_castle
+        self.pawn_double_move = undo.pawn_double_move
+        self.half_move_clock = undo.half_move_clock
+        self.full_move_clock = undo.full_move_clock
+        self.white_king_location = undo.white_king_location
+        self.black_king_location = undo.black_king_location
+        self.white_total_piece_value = undo.white_total_piece_value
+        self.black_total_piece_value = undo.black_total_piece_value
+        self.last_move = undo.last_move
+        self.zobrist_key = undo.zobrist_key
+        self.positional_score = undo.positional_score
+        self.to_move = color
+        self.key_history.pop()
+
     def do_move(self, move: str):
         pass
 
@@ -43,27 +322,27 @@ class Chess:
         move_list = []
         for square in range(len(self.board)):
             piece = self.board[square]
-            if piece not in ' .\n' and self.colors[piece] == self.side:
-                for offset in self.directions[piece]:
+            if piece not in ' .\n' and self.settings.colors[piece] == self.side:
+                for offset in self.settings.directions[piece]:
                     target_square = square
                     while True:
                         target_square += offset
                         captured_piece = self.board[target_square]
                         if captured_piece in ' \n':
                             break
-                        if self.colors[captured_piece] == self.side:
+                        if self.settings.colors[captured_piece] == self.side:
                             break
                         if piece in 'Pp' and offset in [9, 11, -9, -11] and captured_piece == '.':
                             break
                         if piece in 'Pp' and offset in [10, 20, -10, -20] and captured_piece != '.':
                             break
                         if piece == 'P' and offset == -20:
-                            if square not in self.rank_2:
+                            if square not in self.settings.rank_2:
                                 break
                             if self.board[square - 10] != '.':
                                 break
                         if piece == 'p' and offset == 20:
-                            if square not in self.rank_7:
+                            if square not in self.settings.rank_7:
                                 break
                             if self.board[square + 10] != '.':
                                 break
@@ -73,18 +352,18 @@ class Chess:
                             'source': square, 'target': target_square,
                             'piece': piece, 'captured': captured_piece
                         })
-                        if self.colors[captured_piece] == (self.side ^ 1):
+                        if self.settings.colors[captured_piece] == (self.side ^ 1):
                             break
                         if piece in 'PpNnKk':
                             break
         return move_list
 
-    def make_move(self, move):
+    def make_board_move(self, move):
         self.board[move['target']] = move['piece']
         self.board[move['source']] = '.'
-        if move['piece'] == 'P' and move['source'] in self.rank_7:
+        if move['piece'] == 'P' and move['source'] in self.settings.rank_7:
             self.board[move['target']] = 'Q'
-        if move['piece'] == 'p' and move['source'] in self.rank_2:
+        if move['piece'] == 'p' and move['source'] in self.settings.rank_2:
             self.board[move['target']] = 'q'
         self.side ^= 1
 
@@ -102,7 +381,7 @@ class Chess:
         if not len(move_list):
             return 10000
         for move in move_list:
-            self.make_move(move)
+            self.make_board_move(move)
             score = -self.search(depth - 1)
             self.take_back(move)
             if score > best_score:
@@ -118,32 +397,32 @@ class Chess:
         for square in range(len(self.board)):
             piece = self.board[square]
             if piece not in ' .\n':
-                score += self.weights[piece]
+                score += self.settings.weights[piece]
                 if piece.islower():
-                    score -= self.pst[square]
+                    score -= self.settings.pst[square]
                 if piece.isupper():
-                    score += self.pst[square]
+                    score += self.settings.pst[square]
         return -score if self.side else score
 
     def play(self):
-        print(''.join([' ' + self.pieces[p] for p in self.board]))
+        print(''.join([' ' + self.settings.pieces[p] for p in self.board]))
         while True:
             raw = input('   Your move: ')
             if len(raw) < 4:
                 continue
-            user_source = self.coordinates.index(raw[0] + raw[1])
-            user_target = self.coordinates.index(raw[2] + raw[3])
-            self.make_move({
+            user_source = self.settings.coordinates.index(raw[0] + raw[1])
+            user_target = self.settings.coordinates.index(raw[2] + raw[3])
+            self.make_board_move({
                 'source': user_source, 'target': user_target,
                 'piece': self.board[user_source], 'captured': self.board[user_target]
             })
-            print(''.join([' ' + self.pieces[p] for p in self.board]))
+            print(''.join([' ' + self.settings.pieces[p] for p in self.board]))
             score = self.search(3)
-            self.make_move({
+            self.make_board_move({
                 'source': self.best_source, 'target': self.best_target,
                 'piece': self.board[self.best_source], 'captured': self.board[self.best_target]
             })
-            print(''.join([' ' + self.pieces[p] for p in self.board]))
+            print(''.join([' ' + self.settings.pieces[p] for p in self.board]))
             if abs(score) == 10000:
                 print('   Checkmate!')
                 break
@@ -243,7 +522,7 @@ def board_from_fen(fen: str = DEFAULT_POSITION) -> Chess:
     else:
         en_passant_pos = algebraic_pairs_to_board_position(en_passant)
 
-    board = Chess('settings.json')
+    board = Chess()
     board.state = b
     board.to_move = to_move
     board.white_king_location = white_king_location
@@ -258,9 +537,37 @@ def board_from_fen(fen: str = DEFAULT_POSITION) -> Chess:
     board.black_total_piece_value = black_piece_value
     board.white_total_piece_value = white_piece_value
     board.last_move = None
+    board.zobrist_key = compute_zobrist_key(board)
+    board.piece_squares = compute_piece_squares(board)
+    board.positional_score = compute_positional_score(board)
     return board
 
 
+def board_to_fen(board: Chess) -> str:
+    fen_rows = []
+    for row in range(BOARD_START, BOARD_END):
+        fen_row = ''
+        empty_squares = 0
+        for col in range(BOARD_START, BOARD_END):
+            piece = board.state[row][col]
+            if piece == EMPTY:
+                empty_squares += 1
+                continue
+            if empty_squares:
+                fen_row += str(empty_squares)
+                empty_squares = 0
+            fen_row += get_fen_string_char(piece)
+        if empty_squares:
+            fen_row += str(empty_squares)
+        fen_rows.append(fen_row)
+
+    castling_privileges = ''.join(c for c, allowed in zip("KQkq", (board.white_king_side_castle, board.white_queen_side_castle,
+                                                                  board.black_king_side_castle, board.black_queen_side_castle)) if allowed)
+    en_passant = board_position_to_algebraic_pair(board.pawn_double_move) if board.pawn_double_move is not None else '-'
+    return (f"{'/'.join(fen_rows)} {'w' if board.to_move == WHITE else 'b'} {castling_privileges or '-'} {en_passant} "
+            f"{board.half_move_clock} {board.full_move_clock}")
+
+
 def new_board() -> Chess:
     b = [[SENTINEL] * 12 for i in range(12)]
 
@@ -292,12 +599,28 @@ def new_board() -> Chess:
     for i in range(2, 10):
         b[8][i] = BLACK | PAWN
 
-    chess = Chess('settings.json')
+    chess = Chess()
     chess.state = copy.deepcopy(b)
     chess.to_move = WHITE
+    chess.zobrist_key = compute_zobrist_key(chess)
+    chess.piece_squares = compute_piece_squares(chess)
+    chess.positional_score = compute_positional_score(chess)
     return chess
 
 
+def compute_piece_squares(board: Chess) -> List[Set[int]]:
+    """
+    Collect the square index of every piece on the board by piece code, make_move keeps them up to date afterwards
+    """
+    piece_squares: List[Set[int]] = [set() for _ in range(PIECE_CODE_MASK + 1)]
+    for row in range(BOARD_START, BOARD_END):
+        for col in range(BOARD_START, BOARD_END):
+            piece = board.state[row][col]
+            if piece != EMPTY:
+                piece_squares[piece_code(piece)].add(row * BOARD_WIDTH + col)
+    return piece_squares
+
+
 """
 1. The castling must be kingside or queen side.
     2. Neither the king nor the chosen rook has previously moved.
@@ -411,75 +734,22 @@ def is_check(board: Chess, color: int) -> bool:
 
 
 def is_check_cords(board: Chess, color: int, square_cords: Tuple[int, int]) -> bool:
-    attacking_color = None
-    if color == WHITE:
-        attacking_color = BLACK
-    else:
-        attacking_color = WHITE
-
-    # Check from knight
-    for mods in KNIGHT_CORDS:
-        _row = square_cords[0] + mods[0]
-        _col = square_cords[1] + mods[1]
-        square = board.state[_row][_col]
-
-        if square == (KNIGHT | attacking_color):
-            return True
-
-    # Check from pawn
-    _row = None
-    if color == WHITE:
-        _row = square_cords[0] - 1
-    else:
-        _row = square_cords[0] + 1
-
-    if board.state[_row][square_cords[1]-1] == (attacking_color | PAWN) or board.state[_row][square_cords[1]+1] == (attacking_color | PAWN):
-        return True
-
-    mods = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-
-    for m in mods:
-        multiplier = 1
-        _row = square_cords[0] + m[0]
-        _col = square_cords[1] + m[1]
-        square = board.state[_row][_col]
-        while is_empty(square):
-            multiplier += 1
-            _row = square_cords[0] + m[0] * multiplier
-            _col = square_cords[1] + m[1] * multiplier
-            square = board.state[_row][_col]
-
-        if square == (attacking_color | ROOK) or square == (attacking_color | QUEEN):
-            return True
-
-    # Check from bishop or queen
-    mods = [1, -1]
-    for i in mods:
-        for j in mods:
-            multiplier = 1
-            _row = square_cords[0] + i
-            _col = square_cords[1] + j
-            square = board.state[_row][_col]
-            while is_empty(square):
-                multiplier += 1
-                _row = square_cords[0] + i * multiplier
-                _col = square_cords[1] + j * multiplier
-                square = board.state[_row][_col]
-
-            if square == (attacking_color | BISHOP) or square == (attacking_color | QUEEN):
-                return True
-
-    # Check from king
-    for i in range(-1, 2):
-        for j in range(-1, 2):
-            _row = square_cords[0] + i
-            _col = square_cords[1] + j
-            square = board.state[_row][_col]
-            if is_outside_board(square):
-                continue
-
-            if is_king(square) and (square & COLOR_MASK) == attacking_color:
-                return True
+    """
+    Is square_cords attacked by the side that is not color.
+    Every enemy piece the super-piece on the square cannot reach is rejected with one table lookup,
+    only sliders that line up have their path walked.
+    """
+    target = (square_cords[0] * BOARD_WIDTH + square_cords[1]) * BOARD_SQUARES
+    state = board.state
+    piece_squares = board.piece_squares
+    for code in ATTACKER_CODES[color]:
+        for index in piece_squares[code]:
+            if ATTACK_TABLE[target + index] >> code & 1:
+                for row, col in SQUARES_BETWEEN[target + index]:
+                    if state[row][col] != EMPTY:
+                        break
+                else:
+                    return True
     return False
 
 
@@ -646,207 +916,493 @@ def knight_moves(row: int, col: int, board: Chess, moves: List[Tuple[int, int]])
             moves.append((_row, _col))
 
 
-def generate_moves(board: Chess) -> List[Chess]:
-    new_moves = []
+MAX_PLY = 128
+MAX_MOVES = 256
+
 
-    for i in range(BOARD_START, BOARD_END):
-        for j in range(BOARD_START, BOARD_END):
-            color = get_color(board.state[i][j])
-            if color is not None and color == board.to_move:
-                generate_move_for_piece(board, (i,j), new_moves)
+class MoveBuffer:
+    """
+    Preallocated storage for the packed moves of one ply.
+    Generation writes into moves and sets count, the buffer is reused instead of reallocated.
+    scores holds the move ordering score of every move while it is searched.
+    """
+    __slots__ = ("moves", "scores", "count")
 
-    generate_castling_moves(board, new_moves) 
-    return new_moves
+    def __init__(self):
+        self.moves = array('I', [NULL_MOVE]) * MAX_MOVES
+        self.scores = array('i', [0]) * MAX_MOVES
+        self.count = 0
 
 
+def new_move_buffers() -> List[MoveBuffer]:
+    return [MoveBuffer() for _ in range(MAX_PLY)]
 
 
-def generate_move_for_piece(board: Chess, square_cords: Point, new_moves: List[Chess]):
-    moves: List[int] = []
-    piece = board.state[square_cords[0]][square_cords[1]]
-    color = get_color(piece)
-    get_moves(square_cords[0], square_cords[1], board, moves)
-    # make all the valid moes of this piece
-    for _move in moves:
+def generate_moves(board: Chess) -> List[Chess]:
+    """
+    Every legal child position of board. Search and perft work on packed moves with make/unmake,
+    this is kept for callers that want whole boards to hold on to.
+    """
+    new_boards = []
+    for move in generate_legal_moves(board):
         new_board = copy.deepcopy(board)
-        new_board.swap_color()
-        if color == BLACK:
-            new_board.full_move_clock += 1
+        new_board.make_move(move)
+        new_boards.append(new_board)
+    return new_boards
 
-        # update king location if we are moving the king
-        if piece == WHITE | KING:
-            new_board.white_king_location = (_move[0], _move[1])
-        elif piece == BLACK | KING:
-            new_board.black_king_location = (_move[0], _move[1])
 
-        target_square = new_board.state[_move[0]][_move[1]]
-        if not is_empty(target_square):
-            piece_value = PIECE_VALUES[target_square & PIECE_MASK]
+# piece codes of each side, for walking its piece lists
+COLOR_PIECE_CODES = {
+    WHITE: [piece_code(WHITE | piece_type) for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)],
+    BLACK: [piece_code(BLACK | piece_type) for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)],
+}
 
-            if board.to_move == WHITE:
-                new_board.black_total_piece_value -= piece_value
-            else:
-                new_board.white_total_piece_value -= piece_value
 
-        # move the piece, this will take care of any captures, except for en passant captures
-        new_board.state[_move[0]][_move[1]] = piece
-        new_board.state[square_cords[0]][square_cords[1]] = EMPTY
+def generate_pseudo_legal_moves(board: Chess, buffer: MoveBuffer) -> int:
+    """
+    Write every pseudo-legal move of the side to move into buffer, returns the number of moves
+    """
+    moves = buffer.moves
+    piece_squares = board.piece_squares
+    n = 0
+
+    for code in COLOR_PIECE_CODES[board.to_move]:
+        piece = piece_from_code(code)
+        for index in piece_squares[code]:
+            row, col = SQUARE_CORDS[index]
+            n = generate_move_for_piece(board, row, col, piece, moves, n)
+
+    n = generate_castling_moves(board, moves, n)
+    buffer.count = n
+    return n
+
+
+def generate_legal_moves(board: Chess) -> List[Move]:
+    buffer = MoveBuffer()
+    n = generate_checked_legal_moves(board, buffer)
+    return list(buffer.moves[:n])
+
+
+def find_checkers_and_pins(board: Chess, color: int) -> Tuple[int, Set[int], dict]:
+    """
+    Look at every enemy piece that lines up with the king of color.
+    Returns the number of checkers, the squares a piece can move to to stop a single check (the checker and the squares between)
+    and the pinned pieces, mapping the square of each to the squares of its pin ray.
+    """
+    king_row, king_col = board.white_king_location if color == WHITE else board.black_king_location
+    target = (king_row * BOARD_WIDTH + king_col) * BOARD_SQUARES
+    state = board.state
+    checkers = 0
+    evasions: Set[int] = set()
+    pins = {}
+    for code in ATTACKER_CODES[color]:
+        for index in board.piece_squares[code]:
+            if not ATTACK_TABLE[target + index] >> code & 1:
+                continue
+            between = SQUARES_BETWEEN[target + index]
+            blockers = [(row, col) for row, col in between if state[row][col] != EMPTY]
+            if not blockers:
+                checkers += 1
+                evasions.add(index)
+                evasions.update(row * BOARD_WIDTH + col for row, col in between)
+            elif len(blockers) == 1 and state[blockers[0][0]][blockers[0][1]] & COLOR_MASK == color:
+                ray = {row * BOARD_WIDTH + col for row, col in between}
+                ray.add(index)
+                pins[blockers[0][0] * BOARD_WIDTH + blockers[0][1]] = ray
+    return checkers, evasions, pins
+
+
+def generate_checked_legal_moves(board: Chess, buffer: MoveBuffer) -> int:
+    """
+    Write only the legal moves of the side to move into buffer, returns the number of moves.
+    Checkers and pins are found once for the position instead of trying every move on the board:
+    - in double check only the king moves
+    - in single check the other pieces must capture the checker or block it
+    - pinned pieces stay on their pin ray, a pinned knight cannot move at all
+    - the king does not step onto an attacked square, looked up with the king taken off the board so it cannot hide behind itself
+    En passant removes two pawns from a row at once and can uncover a check no pin shows, so it is tried on the board.
+    """
+    moves = buffer.moves
+    state = board.state
+    color = board.to_move
+    king_code = piece_code(color | KING)
+    checkers, evasions, pins = find_checkers_and_pins(board, color)
+    n = 0
+
+    if checkers < 2:
+        for code in COLOR_PIECE_CODES[color]:
+            if code == king_code:
+                continue
+            piece = piece_from_code(code)
+            piece_type = piece & PIECE_MASK
+            for index in board.piece_squares[code]:
+                allowed = pins.get(index)
+                if checkers:
+                    allowed = evasions if allowed is None else allowed & evasions
+                # a pawn with nowhere to go might still capture en passant
+                if allowed is not None and not allowed and piece_type != PAWN:
+                    continue
+                if piece_type == KNIGHT and index in pins:
+                    continue
+                row, col = SQUARE_CORDS[index]
+                start = n
+                n = generate_move_for_piece(board, row, col, piece, moves, n)
+                if allowed is not None:
+                    n = keep_moves_to(moves, start, n, allowed)
+
+        # only once the piece lists are walked, playing a move reorders them
+        if board.pawn_double_move is not None:
+            n = keep_legal_en_passant(board, moves, n)
+
+    # king moves, castling checks its own path
+    king_row, king_col = board.white_king_location if color == WHITE else board.black_king_location
+    start = n
+    n = add_step_moves(state, king_row, king_col, color | KING, KING_OFFSETS, moves, n)
+    state[king_row][king_col] = EMPTY
+    kept = start
+    for i in range(start, n):
+        move = moves[i]
+        if not is_check_cords(board, color, SQUARE_CORDS[(move >> MOVE_TO_SHIFT) & SQUARE_MASK]):
+            moves[kept] = move
+            kept += 1
+    state[king_row][king_col] = color | KING
+    n = kept
+    if not checkers:
+        n = generate_castling_moves(board, moves, n)
+
+    buffer.count = n
+    return n
+
+
+def keep_moves_to(moves: array, start: int, n: int, allowed: Set[int]) -> int:
+    """
+    Compact moves[start:n] to the moves landing on allowed, en passant is left for keep_legal_en_passant
+    """
+    kept = start
+    for i in range(start, n):
+        move = moves[i]
+        if move & MOVE_EN_PASSANT or (move >> MOVE_TO_SHIFT) & SQUARE_MASK in allowed:
+            moves[kept] = move
+            kept += 1
+    return kept
 
-        # if you make your move, and you are in check, this move is not valid
-        if is_check(new_board, color):
-            continue
 
-        # this is a valid board state, update the variables
-
-        # deal with setting castling privileges and updating king location
-        if piece == WHITE | KING:
-            new_board.white_king_side_castle = False
-            new_board.white_queen_side_castle = False
-        elif piece == BLACK | KING:
-            new_board.black_king_side_castle = False
-            new_board.black_queen_side_castle = False
-        elif square_cords[0] == BOARD_END-1 and square_cords[1] == BOARD_END-1:
-            new_board.white_king_side_castle = False
-        elif square_cords[0] == BOARD_END-1 and square_cords[1] == BOARD_START:
-            new_board.white_queen_side_castle = False
-        elif square_cords[0] == BOARD_START and square_cords[1] == BOARD_START:
-            new_board.black_queen_side_castle = False
-        elif square_cords[0] == BOARD_START and square_cords[1] == BOARD_END-1:
-            new_board.black_king_side_castle = False
-
-        # if the rook is captured, take away castling privileges
-        if _move[0] == BOARD_END-1 and _move[1] == BOARD_END-1:
-            new_board.white_king_side_castle = False
-        elif _move[0] == BOARD_END-1 and _move[1] == BOARD_START:
-            new_board.white_queen_side_castle = False
-        elif _move[0] == BOARD_START and _move[1] == BOARD_START:
-            new_board.black_queen_side_castle = False
-        elif _move[0] == BOARD_START and _move[1] == BOARD_END-1:
-            new_board.black_king_side_castle = False
-
-        # checks if the pawn has moved two spaces, if it has it can be captured en passant, record the space behind the pawn
-        if is_pawn(piece) and abs(square_cords[0] -_move[0]) == 2:
-            if is_white(piece):
-                new_board.pawn_double_move = (_move[0]+1, _move[1])
+def keep_legal_en_passant(board: Chess, moves: array, n: int) -> int:
+    """
+    Play every en passant capture in moves[:n] on the board and drop those that leave the king in check
+    """
+    kept = 0
+    color = board.to_move
+    for i in range(n):
+        move = moves[i]
+        if move & MOVE_EN_PASSANT:
+            undo = board.make_move(move)
+            legal = not is_check(board, color)
+            board.unmake_move(undo)
+            if not legal:
+                continue
+        moves[kept] = move
+        kept += 1
+    return kept
+
+
+def generate_move_for_piece(board: Chess, row: int, col: int, piece: int, moves: array, n: int) -> int:
+    piece_type = piece & PIECE_MASK
+    if piece_type == PAWN:
+        return add_pawn_moves(board, row, col, piece, moves, n)
+    elif piece_type == KNIGHT:
+        return add_step_moves(board.state, row, col, piece, KNIGHT_CORDS, moves, n)
+    elif piece_type == BISHOP:
+        return add_slide_moves(board.state, row, col, piece, BISHOP_DIRECTIONS, moves, n)
+    elif piece_type == ROOK:
+        return add_slide_moves(board.state, row, col, piece, ROOK_DIRECTIONS, moves, n)
+    elif piece_type == QUEEN:
+        return add_slide_moves(board.state, row, col, piece, QUEEN_DIRECTIONS, moves, n)
+    elif piece_type == KING:
+        return add_step_moves(board.state, row, col, piece, KING_OFFSETS, moves, n)
+    raise ValueError('Unrecognized piece')
+
+
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KING_OFFSETS = QUEEN_DIRECTIONS
+
+BOARD_SQUARES = BOARD_WIDTH * BOARD_WIDTH
+
+"""
+    Attack tables for check detection, indexed by target * BOARD_SQUARES + source over the 12x12 square indexes.
+    ATTACK_TABLE is a super-piece on the target square: it holds a bit for every piece code that could attack the target
+    from the source on an empty board. SQUARES_BETWEEN lists the squares a slider needs empty to get there.
+"""
+ATTACK_TABLE = [0] * (BOARD_SQUARES * BOARD_SQUARES)
+SQUARES_BETWEEN: List[Tuple[Point, ...]] = [()] * (BOARD_SQUARES * BOARD_SQUARES)
+
+
+def add_attacks(piece_codes: int, offsets: List[Point], slides: bool):
+    for row in range(BOARD_START, BOARD_END):
+        for col in range(BOARD_START, BOARD_END):
+            target = (row * BOARD_WIDTH + col) * BOARD_SQUARES
+            for row_step, col_step in offsets:
+                between = []
+                _row, _col = row + row_step, col + col_step
+                while BOARD_START <= _row < BOARD_END and BOARD_START <= _col < BOARD_END:
+                    ATTACK_TABLE[target + _row * BOARD_WIDTH + _col] |= piece_codes
+                    SQUARES_BETWEEN[target + _row * BOARD_WIDTH + _col] = tuple(between)
+                    if not slides:
+                        break
+                    between.append((_row, _col))
+                    _row, _col = _row + row_step, _col + col_step
+
+
+def code_bits(*pieces: int) -> int:
+    bits = 0
+    for piece in pieces:
+        bits |= 1 << piece_code(piece)
+    return bits
+
+
+add_attacks(code_bits(WHITE | KNIGHT, BLACK | KNIGHT), KNIGHT_CORDS, False)
+add_attacks(code_bits(WHITE | KING, BLACK | KING), KING_OFFSETS, False)
+add_attacks(code_bits(WHITE | ROOK, BLACK | ROOK, WHITE | QUEEN, BLACK | QUEEN), ROOK_DIRECTIONS, True)
+add_attacks(code_bits(WHITE | BISHOP, BLACK | BISHOP, WHITE | QUEEN, BLACK | QUEEN), BISHOP_DIRECTIONS, True)
+# white pawns attack up the board, so they stand one row below the target
+add_attacks(code_bits(WHITE | PAWN), [(1, -1), (1, 1)], False)
+add_attacks(code_bits(BLACK | PAWN), [(-1, -1), (-1, 1)], False)
+
+# attacking piece codes of the side that is not color, the cheap non sliders first
+ATTACKER_CODES = {
+    WHITE: [piece_code(BLACK | piece_type) for piece_type in (PAWN, KNIGHT, KING, BISHOP, ROOK, QUEEN)],
+    BLACK: [piece_code(WHITE | piece_type) for piece_type in (PAWN, KNIGHT, KING, BISHOP, ROOK, QUEEN)],
+}
+
+
+def add_step_moves(state: List[List[int]], row: int, col: int, piece: int, offsets: List[Point], moves: array, n: int) -> int:
+    color = piece & COLOR_MASK
+    from_bits = (row * BOARD_WIDTH + col) | piece_code(piece) << MOVE_PIECE_SHIFT
+    for d_row, d_col in offsets:
+        to_row = row + d_row
+        to_col = col + d_col
+        target = state[to_row][to_col]
+        if target == EMPTY:
+            moves[n] = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT
+            n += 1
+        elif target != SENTINEL and target & COLOR_MASK != color:
+            moves[n] = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT | piece_code(target) << MOVE_CAPTURED_SHIFT
+            n += 1
+    return n
+
+
+def add_slide_moves(state: List[List[int]], row: int, col: int, piece: int, directions: List[Point], moves: array, n: int) -> int:
+    color = piece & COLOR_MASK
+    from_bits = (row * BOARD_WIDTH + col) | piece_code(piece) << MOVE_PIECE_SHIFT
+    for d_row, d_col in directions:
+        to_row = row + d_row
+        to_col = col + d_col
+        target = state[to_row][to_col]
+        while target == EMPTY:
+            moves[n] = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT
+            n += 1
+            to_row += d_row
+            to_col += d_col
+            target = state[to_row][to_col]
+
+        if target != SENTINEL and target & COLOR_MASK != color:
+            moves[n] = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT | piece_code(target) << MOVE_CAPTURED_SHIFT
+            n += 1
+    return n
+
+
+def add_pawn_moves(board: Chess, row: int, col: int, piece: int, moves: array, n: int) -> int:
+    state = board.state
+    color = piece & COLOR_MASK
+    # white pawns move up board
+    if color == WHITE:
+        step, start_row, last_row = -1, BOARD_END - 2, BOARD_START
+    else:
+        step, start_row, last_row = 1, BOARD_START + 1, BOARD_END - 1
+
+    from_bits = (row * BOARD_WIDTH + col) | piece_code(piece) << MOVE_PIECE_SHIFT
+    to_row = row + step
+
+    # check captures
+    for to_col in (col - 1, col + 1):
+        target = state[to_row][to_col]
+        if target != EMPTY and target != SENTINEL and target & COLOR_MASK != color:
+            move = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT | piece_code(target) << MOVE_CAPTURED_SHIFT
+            if to_row == last_row:
+                n = promote_pawn(move, moves, n)
             else:
-                new_board.pawn_double_move = (_move[0]-1, _move[1])
-        else:
-            # the most recent move was not a double pawn move, unset any possibly existing pawn double move
-            new_board.pawn_double_move = None
-
-        # deal with pawn promotions
-        if _move[0] == BOARD_START and piece == (WHITE | PAWN):
-            promote_pawn(new_board, WHITE, (_move[0], _move[1]), new_moves)
-        elif piece == (BLACK | PAWN) and _move[0] == BOARD_END-1:
-            promote_pawn(new_board, BLACK, (_move[0], _move[1]), new_moves)
+                moves[n] = move
+                n += 1
+
+    # check a normal push
+    if state[to_row][col] == EMPTY:
+        move = from_bits | (to_row * BOARD_WIDTH + col) << MOVE_TO_SHIFT
+        if to_row == last_row:
+            n = promote_pawn(move, moves, n)
         else:
-            new_moves.append(new_board)
+            moves[n] = move
+            n += 1
+            # check double push
+            if row == start_row and state[to_row + step][col] == EMPTY:
+                moves[n] = from_bits | ((to_row + step) * BOARD_WIDTH + col) << MOVE_TO_SHIFT | MOVE_DOUBLE_PUSH
+                n += 1
 
     # take care of en passant captures
-    if is_pawn(piece):
-        en_passant = pawn_moves_en_passant(square_cords[0], square_cords[1], board)
-        if en_passant is not None:
-            _move = copy.deepcopy(en_passant)
-            new_board = copy.deepcopy(board)
-            new_board.swap_color()
-            new_board.pawn_double_move = None
-
-            new_board.state[_move[0]][_move[1]] = piece
-            new_board.state[square_cords[0]][square_cords[1]] = EMPTY
-            if is_white(piece):
-                new_board.state[_move[0]+1][_move[1]] = EMPTY
-                new_board.black_total_piece_value -= PIECE_VALUES[PAWN]
+    en_passant = board.pawn_double_move
+    if en_passant is not None and en_passant[0] == to_row and abs(en_passant[1] - col) == 1:
+        captured = state[row][en_passant[1]]
+        if captured == (BLACK if color == WHITE else WHITE) | PAWN:
+            moves[n] = (from_bits | (to_row * BOARD_WIDTH + en_passant[1]) << MOVE_TO_SHIFT
+                        | piece_code(captured) << MOVE_CAPTURED_SHIFT | MOVE_EN_PASSANT)
+            n += 1
+    return n
+
+
+def generate_captures(board: Chess, buffer: MoveBuffer) -> int:
+    """
+    Write only the captures and promotions of the side to move into buffer, for the quiescence search
+    """
+    moves = buffer.moves
+    state = board.state
+    piece_squares = board.piece_squares
+    n = 0
+
+    for code in COLOR_PIECE_CODES[board.to_move]:
+        piece = piece_from_code(code)
+        piece_type = piece & PIECE_MASK
+        for index in piece_squares[code]:
+            row, col = SQUARE_CORDS[index]
+            if piece_type == PAWN:
+                n = add_pawn_captures(board, row, col, piece, moves, n)
+            elif piece_type == KNIGHT:
+                n = add_step_captures(state, row, col, piece, KNIGHT_CORDS, moves, n)
+            elif piece_type == BISHOP:
+                n = add_slide_captures(state, row, col, piece, BISHOP_DIRECTIONS, moves, n)
+            elif piece_type == ROOK:
+                n = add_slide_captures(state, row, col, piece, ROOK_DIRECTIONS, moves, n)
+            elif piece_type == QUEEN:
+                n = add_slide_captures(state, row, col, piece, QUEEN_DIRECTIONS, moves, n)
+            elif piece_type == KING:
+                n = add_step_captures(state, row, col, piece, KING_OFFSETS, moves, n)
+
+    buffer.count = n
+    return n
+
+
+def add_step_captures(state: List[List[int]], row: int, col: int, piece: int, offsets: List[Point], moves: array, n: int) -> int:
+    color = piece & COLOR_MASK
+    from_bits = (row * BOARD_WIDTH + col) | piece_code(piece) << MOVE_PIECE_SHIFT
+    for d_row, d_col in offsets:
+        target = state[row + d_row][col + d_col]
+        if target != EMPTY and target != SENTINEL and target & COLOR_MASK != color:
+            moves[n] = from_bits | ((row + d_row) * BOARD_WIDTH + col + d_col) << MOVE_TO_SHIFT | piece_code(target) << MOVE_CAPTURED_SHIFT
+            n += 1
+    return n
+
+
+def add_slide_captures(state: List[List[int]], row: int, col: int, piece: int, directions: List[Point], moves: array, n: int) -> int:
+    color = piece & COLOR_MASK
+    from_bits = (row * BOARD_WIDTH + col) | piece_code(piece) << MOVE_PIECE_SHIFT
+    for d_row, d_col in directions:
+        to_row = row + d_row
+        to_col = col + d_col
+        target = state[to_row][to_col]
+        while target == EMPTY:
+            to_row += d_row
+            to_col += d_col
+            target = state[to_row][to_col]
+
+        if target != SENTINEL and target & COLOR_MASK != color:
+            moves[n] = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT | piece_code(target) << MOVE_CAPTURED_SHIFT
+            n += 1
+    return n
+
+
+def add_pawn_captures(board: Chess, row: int, col: int, piece: int, moves: array, n: int) -> int:
+    state = board.state
+    color = piece & COLOR_MASK
+    if color == WHITE:
+        to_row, last_row = row - 1, BOARD_START
+    else:
+        to_row, last_row = row + 1, BOARD_END - 1
+
+    from_bits = (row * BOARD_WIDTH + col) | piece_code(piece) << MOVE_PIECE_SHIFT
+    for to_col in (col - 1, col + 1):
+        target = state[to_row][to_col]
+        if target != EMPTY and target != SENTINEL and target & COLOR_MASK != color:
+            move = from_bits | (to_row * BOARD_WIDTH + to_col) << MOVE_TO_SHIFT | piece_code(target) << MOVE_CAPTURED_SHIFT
+            if to_row == last_row:
+                n = promote_pawn(move, moves, n)
             else:
-                new_board.state[_move[0]-1][_move[1]] = EMPTY
-                new_board.white_total_piece_value -= PIECE_VALUES[PAWN]
+                moves[n] = move
+                n += 1
+
+    # a push to the last row is a promotion, which can change the material balance as much as a capture
+    if to_row == last_row and state[to_row][col] == EMPTY:
+        n = promote_pawn(from_bits | (to_row * BOARD_WIDTH + col) << MOVE_TO_SHIFT, moves, n)
+
+    en_passant = board.pawn_double_move
+    if en_passant is not None and en_passant[0] == to_row and abs(en_passant[1] - col) == 1:
+        captured = state[row][en_passant[1]]
+        if captured == (BLACK if color == WHITE else WHITE) | PAWN:
+            moves[n] = (from_bits | (to_row * BOARD_WIDTH + en_passant[1]) << MOVE_TO_SHIFT
+                        | piece_code(captured) << MOVE_CAPTURED_SHIFT | MOVE_EN_PASSANT)
+            n += 1
+    return n
+
+
+def generate_castling_moves(board: Chess, moves: array, n: int) -> int:
+    # take care of castling, the king moves two squares and make_move brings the rook across
+    color = board.to_move
+    if color == WHITE:
+        row = BOARD_END - 1
+        king_side, queen_side = CastlingType.WHITE_KING_SIDE, CastlingType.WHITE_QUEEN_SIDE
+    else:
+        row = BOARD_START
+        king_side, queen_side = CastlingType.BLACK_KING_SIDE, CastlingType.BLACK_QUEEN_SIDE
 
-            # if you make your move, and you do not end up in check, this this move is valid
-            if not is_check(new_board, board.to_move):
-                new_moves.append(new_board)
+    if board.state[row][BOARD_START + 4] != color | KING:
+        return n
 
+    from_bits = (row * BOARD_WIDTH + BOARD_START + 4) | piece_code(color | KING) << MOVE_PIECE_SHIFT | MOVE_CASTLE
+    if board.state[row][BOARD_END - 1] == color | ROOK and can_castle(board, king_side):
+        moves[n] = from_bits | (row * BOARD_WIDTH + BOARD_END - 2) << MOVE_TO_SHIFT
+        n += 1
+    if board.state[row][BOARD_START] == color | ROOK and can_castle(board, queen_side):
+        moves[n] = from_bits | (row * BOARD_WIDTH + BOARD_START + 2) << MOVE_TO_SHIFT
+        n += 1
+    return n
 
-def generate_castling_moves(board: Chess, new_moves: List[Chess]):
-    # take care of castling
-    if board.to_move == WHITE and can_castle(board, CastlingType.WHITE_KING_SIDE):
-        new_board = copy.deepcopy(board)
-        new_board.swap_color()
-        new_board.pawn_double_move = None
-        new_board.white_king_side_castle = False
-        new_board.white_queen_side_castle = False
-        new_board.white_king_location = (BOARD_END - 1, BOARD_END - 2)
-        new_board.state[BOARD_END - 1][BOARD_START + 4] = EMPTY
-        new_board.state[BOARD_END - 1][BOARD_END - 1] = EMPTY
-        new_board.state[BOARD_END - 1][BOARD_END - 2] = WHITE | KING
-        new_board.state[BOARD_END - 1][BOARD_END - 3] = WHITE | ROOK
-        new_moves.append(new_board)
-
-    if board.to_move == WHITE and can_castle(board, CastlingType.WHITE_QUEEN_SIDE):
-        new_board = copy.deepcopy(board)
-        new_board.swap_color()
-        new_board.pawn_double_move = None
-        new_board.white_king_side_castle = False
-        new_board.white_queen_side_castle = False
-        new_board.white_king_location = (BOARD_END - 1, BOARD_START + 2)
-        new_board.state[BOARD_END - 1][BOARD_START + 4] = EMPTY
-        new_board.state[BOARD_END - 1][BOARD_START] = EMPTY
-        new_board.state[BOARD_END - 1][BOARD_START + 2] = WHITE | KING
-        new_board.state[BOARD_END - 1][BOARD_START + 3] = WHITE | ROOK
-        new_moves.append(new_board)
-
-    if board.to_move == BLACK and can_castle(board, CastlingType.BLACK_KING_SIDE):
-        new_board = copy.deepcopy(board)
-        new_board.swap_color()
-        new_board.pawn_double_move = None
-        new_board.black_king_side_castle = False
-        new_board.black_queen_side_castle = False
-        new_board.black_king_location = (BOARD_START, BOARD_END - 2)
-        new_board.state[BOARD_START][BOARD_START + 4] = EMPTY
-        new_board.state[BOARD_START][BOARD_END - 1] = EMPTY
-        new_board.state[BOARD_START][BOARD_END - 2] = BLACK | KING
-        new_board.state[BOARD_START][BOARD_END - 3] = BLACK | ROOK
-        new_moves.append(new_board)
-
-    if board.to_move == BLACK and can_castle(board, CastlingType.BLACK_QUEEN_SIDE):
-        new_board = copy.deepcopy(board)
-        new_board.swap_color()
-        new_board.pawn_double_move = None
-        new_board.black_king_side_castle = False
-        new_board.black_queen_side_castle = False
-        new_board.black_king_location = (BOARD_START, BOARD_START + 2)
-        new_board.state[BOARD_START][BOARD_START + 4] = EMPTY
-        new_board.state[BOARD_START][BOARD_START] = EMPTY
-        new_board.state[BOARD_START][BOARD_START + 2] = BLACK | KING
-        new_board.state[BOARD_START][BOARD_START + 3] = BLACK | ROOK
-        new_moves.append(new_board)
-
-
-def generate_moves_test(board: Chess, cur_depth: int, depth: int, move_counts: List[int]):
+
+def generate_moves_test(board: Chess, cur_depth: int, depth: int, move_counts: List[int], buffers: List[MoveBuffer] | None = None, verify_hash: bool = False):
+    """
+    Count the legal moves at every depth into move_counts.
+    With verify_hash the incrementally updated zobrist key is compared against a full recompute at every node.
+    """
+    if verify_hash and board.zobrist_key != compute_zobrist_key(board):
+        raise ValueError(f"Zobrist key mismatch after {board.last_move}")
     if cur_depth == depth:
         return
-    moves = generate_moves(board)
-    move_counts[cur_depth] += len(moves)
-    for mov in moves:
-        generate_moves_test(mov, cur_depth+1, depth, move_counts)
+    if buffers is None:
+        buffers = new_move_buffers()
 
+    buffer = buffers[cur_depth]
+    n = generate_checked_legal_moves(board, buffer)
+    move_counts[cur_depth] += n
+    moves = buffer.moves
+    for i in range(n):
+        undo = board.make_move(moves[i])
+        generate_moves_test(board, cur_depth+1, depth, move_counts, buffers, verify_hash)
+        board.unmake_move(undo)
 
-def promote_pawn(board: Chess, color: int, square_cords: Point, moves: List[Chess]):
-    pawn_value = PIECE_VALUES[PAWN]
-    for promotion_piece in [QUEEN, KNIGHT, BISHOP, ROOK]:
-        new_board = copy.deepcopy(board)
-        new_board.pawn_double_move = None
-        if color == WHITE:
-            new_board.state[square_cords[0]][square_cords[1]] = (
-                WHITE | promotion_piece)
-        else:
-            new_board.state[square_cords[0]][square_cords[1]] = (
-                BLACK | promotion_piece) 
-        value = PIECE_VALUES[promotion_piece] - pawn_value
 
-        if color == BLACK:
-            new_board.black_total_piece_value += value
-        else:
-            new_board.white_total_piece_value += value
-        moves.append(new_board)
+def promote_pawn(move: Move, moves: array, n: int) -> int:
+    for promotion_piece in [QUEEN, KNIGHT, BISHOP, ROOK]:
+        moves[n] = move | promotion_piece << MOVE_PROMOTION_SHIFT
+        n += 1
+    return n
 
 
 PIECE_VALUES = [0, 100, 320, 330, 500, 900, 20000]
@@ -955,7 +1511,63 @@ def get_pos_evaluation(row: int, col: int, board: Chess, color: int) -> int:
         raise ValueError("Could not recognize piece")
 
 
+def square_table(weights: List[List[int]], color: int) -> List[int]:
+    """
+    Spread an 8x8 weight table over the square indexes of the 12x12 board, negated for black so scores can be summed
+    """
+    table = [0] * (BOARD_WIDTH * BOARD_WIDTH)
+    for row in range(BOARD_START, BOARD_END):
+        for col in range(BOARD_START, BOARD_END):
+            _row = row - BOARD_START
+            if color == BLACK:
+                table[row * BOARD_WIDTH + col] = -weights[7 - _row][col - BOARD_START]
+            else:
+                table[row * BOARD_WIDTH + col] = weights[_row][col - BOARD_START]
+    return table
+
+
+# piece square tables indexed by piece code and square index, kings are left at 0 and scored by the king tables
+PIECE_SQUARE_TABLES = [[0] * (BOARD_WIDTH * BOARD_WIDTH) for _ in range(PIECE_CODE_MASK + 1)]
+for _piece, _weights in [(PAWN, PAWN_WEIGHTS), (KNIGHT, KNIGHT_WEIGHTS), (BISHOP, BISHOP_WEIGHTS), (ROOK, ROOK_WEIGHTS), (QUEEN, QUEEN_WEIGHTS)]:
+    PIECE_SQUARE_TABLES[piece_code(WHITE | _piece)] = square_table(_weights, WHITE)
+    PIECE_SQUARE_TABLES[piece_code(BLACK | _piece)] = square_table(_weights, BLACK)
+
+# the king table switches after move 30, so the king term is looked up at evaluation time instead of being kept up to date
+LATE_GAME_MOVE = 30
+WHITE_KING_TABLE = square_table(KING_WEIGHTS, WHITE)
+BLACK_KING_TABLE = square_table(KING_WEIGHTS, BLACK)
+WHITE_KING_LATE_GAME_TABLE = square_table(KING_LATE_GAME, WHITE)
+BLACK_KING_LATE_GAME_TABLE = square_table(KING_LATE_GAME, BLACK)
+
+
+def compute_positional_score(board: Chess) -> int:
+    """
+    The piece square score of every piece but the kings, make_move keeps it up to date as board.positional_score
+    """
+    score = 0
+    for code, squares in enumerate(board.piece_squares):
+        table = PIECE_SQUARE_TABLES[code]
+        for index in squares:
+            score += table[index]
+    return score
+
+
 def get_evaluation(board: Chess) -> int:
+    white_king = board.white_king_location
+    black_king = board.black_king_location
+    if board.full_move_clock > LATE_GAME_MOVE:
+        king_score = (WHITE_KING_LATE_GAME_TABLE[white_king[0] * BOARD_WIDTH + white_king[1]]
+                      + BLACK_KING_LATE_GAME_TABLE[black_king[0] * BOARD_WIDTH + black_king[1]])
+    else:
+        king_score = (WHITE_KING_TABLE[white_king[0] * BOARD_WIDTH + white_king[1]]
+                      + BLACK_KING_TABLE[black_king[0] * BOARD_WIDTH + black_king[1]])
+    return board.white_total_piece_value - board.black_total_piece_value + board.positional_score + king_score
+
+
+def get_evaluation_from_scratch(board: Chess) -> int:
+    """
+    Evaluate by walking the whole board, the reference get_evaluation is checked against
+    """
     evaluation = board.white_total_piece_value
     evaluation -= board.black_total_piece_value
     for row in range(BOARD_START, BOARD_END):
@@ -972,118 +1584,1216 @@ def get_evaluation(board: Chess) -> int:
     return evaluation
 
 
-def alpha_beta_search(board: Chess, depth: int, alpha: int, beta: int, maximizing_player: int) -> (Chess | None, int):
-    if depth == 0:
-        return (None, get_evaluation(board))
+# how many nodes are searched between looking at the clock and for a stop request
+TIME_CHECK_INTERVAL = 1024
+
+# a won bitbase position, beyond any evaluation and short of a mate
+BITBASE_SCORE = 1000000
+# won bitbase positions rank by how close the losing king is to the edge and to the winning king
+MOP_UP_EDGE = 100
+MOP_UP_CLOSE = 40
+MOP_UP_BOX = 10
+
+# move ordering scores: hash move, then captures and promotions, then killers, then quiet moves by history
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 26
+HISTORY_MAX = KILLER_SCORE - 1
+# the moved piece code and to square are 12 neighbouring bits of a move
+HISTORY_SHIFT = MOVE_TO_SHIFT
+HISTORY_MASK = 0xFFF
+HISTORY_SIZE = HISTORY_MASK + 1
+
+
+class SearchState:
+    """
+    Everything shared by the nodes of one search: the per-ply move buffers, the transposition table,
+    statistics and the limits that stop the search
+    """
+
+    def __init__(self, tt: TranspositionTable | None = None, order_moves: bool = True, quiescence: bool = True):
+        self.buffers = new_move_buffers()
+        self.tt = tt
+        self.nodes = 0
+        # nodes searched by quiescence_search, also counted in nodes
+        self.qnodes = 0
+        self.quiescence = quiescence
+        self.stopped = False
+        # time.monotonic() after which the search stops, None to search without a clock
+        self.deadline: float | None = None
+        self.node_limit = sys.maxsize
+        self.order_moves = order_moves
+        # two quiet moves per ply that recently caused a beta cutoff
+        self.killers = [[NULL_MOVE, NULL_MOVE] for _ in range(MAX_PLY)]
+        # quiet move cutoff history, indexed by the moved piece code and to square bits of the move
+        self.history = [0] * HISTORY_SIZE
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        # set by another thread or process to stop this search: the UCI stop command, Lazy SMP helpers
+        self.stop_event = None
+        # the first depth iterative_deepening_search searches, Lazy SMP helpers start deeper than the main search
+        self.start_depth = 1
+        # the number of best root moves iterative_deepening_search reports, the UCI MultiPV option
+        self.multipv = 1
+        # root moves left out while searching for the second, third, ... best line
+        self.excluded_moves: Set[Move] = set()
+        # (move, score) of every line of the last completed iteration, best first
+        self.lines: List[Tuple[Move, int]] = []
+        # searching on the opponent's time: no time limits until ponderhit gives the search its budget
+        self.pondering = False
+        # seconds after started at which no new iteration is started, None to finish every iteration
+        self.soft_limit: float | None = None
+        self.started = 0.0
+        # endgame bitbases probed below the root, exact results for the positions they hold
+        self.bitbases: Bitbases | None = None
+        self.bitbase_hits = 0
+        # the piece counts of the root, a node with other counts was reached by a capture or promotion
+        self.root_material: Tuple[int, ...] = ()
+
+    def start(self, deadline: float | None = None, node_limit: int | None = None):
+        self.nodes = 0
+        self.qnodes = 0
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.bitbase_hits = 0
+        self.stopped = False
+        self.deadline = deadline
+        self.node_limit = node_limit if node_limit is not None else sys.maxsize
+        for killers in self.killers:
+            killers[0] = killers[1] = NULL_MOVE
+        self.history = [value // 2 for value in self.history]
+
+    def stop(self):
+        self.stopped = True
+
+    def ponderhit(self, limits: 'SearchLimits', color: int):
+        """
+        The opponent played the expected move, the search goes on with the time of a normal search started now
+        """
+        soft, hard = allocate_time(limits, color)
+        now = time.monotonic()
+        self.deadline = now + hard if hard is not None else None
+        self.soft_limit = now - self.started + soft if soft is not None else None
+        self.pondering = False
+
+    def check_limits(self):
+        if self.nodes >= self.node_limit:
+            self.stopped = True
+        elif self.deadline is not None and time.monotonic() >= self.deadline:
+            self.stopped = True
+        elif self.stop_event is not None and self.stop_event.is_set():
+            self.stopped = True
+
+
+def is_repetition(board: Chess) -> bool:
+    """
+    The position was on the board before with the same side to move, since the last capture or pawn move
+    """
+    history = board.key_history
+    key = board.zobrist_key
+    for i in range(len(history) - 4, max(len(history) - board.half_move_clock, 0) - 1, -2):
+        if history[i] == key:
+            return True
+    return False
+
 
-    moves = generate_moves(board)
-    if len(moves) == 0:
+def material_counts(board: Chess) -> Tuple[int, ...]:
+    return tuple(map(len, board.piece_squares))
+
+
+def mop_up_score(board: Chess, winner: int) -> int:
+    """
+    How far winner has got with the mate: the losing king pushed to the edge and the winning king next to it
+    """
+    if winner == WHITE:
+        winning_king, losing_king = board.white_king_location, board.black_king_location
+    else:
+        winning_king, losing_king = board.black_king_location, board.white_king_location
+    row, col = losing_king[0] - BOARD_START, losing_king[1] - BOARD_START
+    edge = max(3 - row, row - 4) + max(3 - col, col - 4)
+    distance = max(abs(winning_king[0] - losing_king[0]), abs(winning_king[1] - losing_king[1]))
+    # the box a rook fences the losing king into by its rank and file
+    box = 64
+    for index in board.piece_squares[piece_code(winner | ROOK)]:
+        rook_row, rook_col = SQUARE_CORDS[index]
+        rook_row, rook_col = rook_row - BOARD_START, rook_col - BOARD_START
+        rows = 8 if row == rook_row else (rook_row if row < rook_row else 7 - rook_row)
+        cols = 8 if col == rook_col else (rook_col if col < rook_col else 7 - rook_col)
+        box = min(box, rows * cols)
+    return MOP_UP_EDGE * edge + MOP_UP_CLOSE * (7 - distance) + MOP_UP_BOX * (64 - box)
+
+
+def bitbase_score(board: Chess, result: int, buffer: MoveBuffer, ply: int) -> int:
+    """
+    The white relative score of a bitbase result for the side to move ply moves below the root. A mate scores as a mate,
+    other won positions by their material and mop_up_score less a point a ply, so the search makes progress towards
+    the mate now rather than later.
+    """
+    if result == BITBASE_DRAW:
+        return 0
+    if result == BITBASE_LOSS and is_check(board, board.to_move) and generate_checked_legal_moves(board, buffer) == 0:
+        return -sys.maxsize if board.to_move == WHITE else sys.maxsize
+    winner = board.to_move if result == BITBASE_WIN else (BLACK if board.to_move == WHITE else WHITE)
+    score = BITBASE_SCORE + mop_up_score(board, winner) - ply
+    # the king tables of get_evaluation would keep the kings home or in the center, the mop up places them instead
+    material = board.white_total_piece_value - board.black_total_piece_value + board.positional_score
+    return material + (score if winner == WHITE else -score)
+
+
+def mvv_lva_score(victim: int, attacker: int) -> int:
+    """
+    Most valuable victim first, then least valuable attacker
+    """
+    return PIECE_VALUES[victim] * 100 - PIECE_VALUES[attacker] // 100
+
+
+MVV_LVA = [[mvv_lva_score(victim, attacker) for attacker in range(len(PIECE_VALUES))] for victim in range(len(PIECE_VALUES))]
+
+
+def score_moves(search: SearchState, buffer: MoveBuffer, n: int, hash_move: Move, ply: int):
+    moves = buffer.moves
+    scores = buffer.scores
+    killer_1, killer_2 = search.killers[ply]
+    history = search.history
+    for i in range(n):
+        move = moves[i]
+        if move == hash_move:
+            scores[i] = HASH_MOVE_SCORE
+        elif move & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK):
+            scores[i] = (CAPTURE_SCORE
+                         + MVV_LVA[(move >> MOVE_CAPTURED_SHIFT) & PIECE_MASK][(move >> MOVE_PIECE_SHIFT) & PIECE_MASK]
+                         + PIECE_VALUES[(move >> MOVE_PROMOTION_SHIFT) & PIECE_MASK])
+        elif move == killer_1:
+            scores[i] = KILLER_SCORE + 1
+        elif move == killer_2:
+            scores[i] = KILLER_SCORE
+        else:
+            scores[i] = history[(move >> HISTORY_SHIFT) & HISTORY_MASK]
+
+
+def pick_next_move(buffer: MoveBuffer, i: int, n: int) -> Move:
+    """
+    Swap the best scored of the remaining moves into position i, moves are only sorted as far as they are searched
+    """
+    moves = buffer.moves
+    scores = buffer.scores
+    best = max(range(i, n), key=scores.__getitem__)
+    if best != i:
+        moves[i], moves[best] = moves[best], moves[i]
+        scores[i], scores[best] = scores[best], scores[i]
+    return moves[i]
+
+
+def record_cutoff(search: SearchState, move: Move, depth: int, ply: int, moves_searched: int):
+    search.beta_cutoffs += 1
+    if moves_searched == 1:
+        search.first_move_cutoffs += 1
+    if search.order_moves and not move & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK):
+        update_quiet_cutoff(search, move, depth, ply)
+
+
+def update_quiet_cutoff(search: SearchState, move: Move, depth: int, ply: int):
+    killers = search.killers[ply]
+    if killers[0] != move:
+        killers[1] = killers[0]
+        killers[0] = move
+
+    history = search.history
+    index = (move >> HISTORY_SHIFT) & HISTORY_MASK
+    history[index] += depth * depth
+    if history[index] > HISTORY_MAX:
+        search.history = [value // 2 for value in history]
+
+
+# a capture that can't bring the score back within this margin of alpha is not searched
+DELTA_MARGIN = 200
+
+
+def quiescence_search(board: Chess, alpha: int, beta: int, maximizing_player: int, ply: int, search: SearchState) -> int:
+    """
+    Search captures and promotions only until the position is quiet, so leaves aren't evaluated in the middle of an exchange
+    """
+    search.nodes += 1
+    search.qnodes += 1
+    if search.nodes >= search.node_limit or search.nodes % TIME_CHECK_INTERVAL == 0:
+        search.check_limits()
+    if search.stopped:
+        return 0
+
+    # the side to move can always decline to capture, so the static evaluation is a bound on the score
+    stand_pat = get_evaluation(board)
+    if ply >= MAX_PLY - 1:
+        return stand_pat
+    if maximizing_player == WHITE:
+        if stand_pat >= beta:
+            return stand_pat
+        alpha = max(alpha, stand_pat)
+    else:
+        if stand_pat <= alpha:
+            return stand_pat
+        beta = min(beta, stand_pat)
+
+    buffer = search.buffers[ply]
+    n = generate_captures(board, buffer)
+    score_moves(search, buffer, n, NULL_MOVE, ply)
+    best_val = stand_pat
+
+    for i in range(n):
+        move = pick_next_move(buffer, i, n)
+        gain = PIECE_VALUES[(move >> MOVE_CAPTURED_SHIFT) & PIECE_MASK] + DELTA_MARGIN
+        promotion = (move >> MOVE_PROMOTION_SHIFT) & PIECE_MASK
+        if promotion != EMPTY:
+            gain += PIECE_VALUES[promotion] - PIECE_VALUES[PAWN]
+
+        # delta pruning
         if maximizing_player == WHITE:
-            if is_check(board, WHITE):
-                # return (None, -99999999 - depth)  # checkmate
-                return (None, -sys.maxsize)
+            if stand_pat + gain <= alpha:
+                continue
+        elif stand_pat - gain >= beta:
+            continue
+
+        undo = board.make_move(move)
+        if is_check(board, maximizing_player):
+            board.unmake_move(undo)
+            continue
+        score = quiescence_search(board, alpha, beta, BLACK if maximizing_player == WHITE else WHITE, ply + 1, search)
+        board.unmake_move(undo)
+        if search.stopped:
+            return best_val
+
+        if maximizing_player == WHITE:
+            if score > best_val:
+                best_val = score
+            alpha = max(alpha, score)
         else:
-            if is_check(board, BLACK):
-                # return (None, 99999999 + depth)  # checkmate
-                return (None, sys.maxsize)
+            if score < best_val:
+                best_val = score
+            beta = min(beta, score)
+        if beta <= alpha:
+            break
 
-        return (None, 0)  # stalemate
+    return best_val
+
+
+def alpha_beta_search(board: Chess, depth: int, alpha: int, beta: int, maximizing_player: int, ply: int = 0, search: SearchState | None = None) -> (Move | None, int):
+    if search is None:
+        search = SearchState()
+    search.nodes += 1
+    if search.nodes >= search.node_limit or search.nodes % TIME_CHECK_INTERVAL == 0:
+        search.check_limits()
+    if search.stopped:
+        return (None, 0)
+    # a repetition is a draw, without it a won ending can go round in circles
+    if ply > 0 and board.half_move_clock >= 4 and is_repetition(board):
+        return (None, 0)
+    if search.bitbases is not None:
+        # positions with the material of the root are searched, so the mate is found, and probed only as leaves
+        if ply == 0:
+            search.root_material = material_counts(board)
+        elif depth == 0 or material_counts(board) != search.root_material:
+            result = search.bitbases.probe(board)
+            if result is not None:
+                search.bitbase_hits += 1
+                return (None, bitbase_score(board, result, search.buffers[ply], ply))
+    if depth == 0:
+        if search.quiescence:
+            return (None, quiescence_search(board, alpha, beta, maximizing_player, ply, search))
+        return (None, get_evaluation(board))
+
+    tt = search.tt
+    hash_move = NULL_MOVE
+    if tt is not None:
+        entry = tt.get(board.zobrist_key)
+        if entry is not None:
+            tt_depth, tt_score, tt_bound, hash_move = entry
+            # never cut at the root, the caller needs a move it can play
+            if ply > 0 and tt_depth >= depth:
+                if tt_bound == BOUND_EXACT or (tt_bound == BOUND_LOWER and tt_score >= beta) or (tt_bound == BOUND_UPPER and tt_score <= alpha):
+                    return (hash_move if hash_move != NULL_MOVE else None, tt_score)
+
+    buffer = search.buffers[ply]
+    n = generate_checked_legal_moves(board, buffer)
+    moves = buffer.moves
+    legal_moves = 0
+    alpha_orig = alpha
+    beta_orig = beta
+
+    order_moves = search.order_moves
+    if order_moves:
+        score_moves(search, buffer, n, hash_move, ply)
 
     best_move = None
     if maximizing_player == WHITE:
         best_val = -sys.maxsize
-        for board in moves:
-            evaluation = alpha_beta_search(board, depth-1, alpha, beta, BLACK)
-            if evaluation[1] > best_val:
+        for i in range(n):
+            move = pick_next_move(buffer, i, n) if order_moves else moves[i]
+            if ply == 0 and move in search.excluded_moves:
+                continue
+            undo = board.make_move(move)
+            legal_moves += 1
+            evaluation = alpha_beta_search(board, depth-1, alpha, beta, BLACK, ply+1, search)
+            board.unmake_move(undo)
+            if search.stopped:
+                return (best_move, best_val)
+            if best_move is None or evaluation[1] > best_val:
                 best_val = evaluation[1]
-                best_move = board
+                best_move = move
             alpha = max([alpha, evaluation[1]])
             if beta <= alpha:
+                record_cutoff(search, move, depth, ply, legal_moves)
                 break
-        return (best_move, best_val)
     else:
         best_val = sys.maxsize
-        for board in moves:
-            evaluation = alpha_beta_search(board, depth-1, alpha, beta, WHITE)
-            if evaluation[1] < best_val:
+        for i in range(n):
+            move = pick_next_move(buffer, i, n) if order_moves else moves[i]
+            if ply == 0 and move in search.excluded_moves:
+                continue
+            undo = board.make_move(move)
+            legal_moves += 1
+            evaluation = alpha_beta_search(board, depth-1, alpha, beta, WHITE, ply+1, search)
+            board.unmake_move(undo)
+            if search.stopped:
+                return (best_move, best_val)
+            if best_move is None or evaluation[1] < best_val:
                 best_val = evaluation[1]
-                best_move = board
+                best_move = move
 
             beta = min([beta, evaluation[1]])
             if beta <= alpha:
+                record_cutoff(search, move, depth, ply, legal_moves)
+                break
+
+    if legal_moves == 0:
+        best_val = 0  # stalemate
+        if maximizing_player == WHITE:
+            if is_check(board, WHITE):
+                # best_val = -99999999 - depth  # checkmate
+                best_val = -sys.maxsize
+        else:
+            if is_check(board, BLACK):
+                # best_val = 99999999 + depth  # checkmate
+                best_val = sys.maxsize
+
+    # the best of the remaining root moves is not the best move of the position
+    if tt is not None and not (ply == 0 and search.excluded_moves):
+        if legal_moves == 0:
+            bound = BOUND_EXACT
+        elif best_val <= alpha_orig:
+            bound = BOUND_UPPER
+        elif best_val >= beta_orig:
+            bound = BOUND_LOWER
+        else:
+            bound = BOUND_EXACT
+        tt.store(board.zobrist_key, depth, best_val, bound, best_move if best_move is not None else NULL_MOVE)
+
+    return (best_move, best_val)
+
+
+class SearchLimits(NamedTuple):
+    """
+    Limits for iterative_deepening_search, times are in milliseconds like the UCI go command
+    """
+    depth: int | None = None
+    nodes: int | None = None
+    movetime: int | None = None
+    wtime: int | None = None
+    btime: int | None = None
+    winc: int = 0
+    binc: int = 0
+    movestogo: int | None = None
+    infinite: bool = False
+
+
+MAX_SEARCH_DEPTH = 64
+# seconds kept back from every move for talking to the GUI
+MOVE_OVERHEAD = 0.05
+# assume this many moves are left when the GUI does not send movestogo
+DEFAULT_MOVES_TO_GO = 30
+
+
+def allocate_time(limits: SearchLimits, color: int) -> Tuple[float | None, float | None]:
+    """
+    Returns (soft, hard) limits in seconds.
+    No new iteration is started when it is not expected to finish before the soft limit,
+    the hard limit stops the search in the middle of an iteration.
+    """
+    if limits.infinite:
+        return (None, None)
+
+    if limits.movetime is not None:
+        # the whole move time is ours, only the hard limit applies
+        return (None, max(0.001, limits.movetime / 1000 - MOVE_OVERHEAD))
+
+    remaining = limits.wtime if color == WHITE else limits.btime
+    if remaining is None:
+        return (None, None)
+
+    increment = (limits.winc if color == WHITE else limits.binc) / 1000
+    remaining = remaining / 1000
+    moves_to_go = limits.movestogo if limits.movestogo else DEFAULT_MOVES_TO_GO
+    max_time = max(0.001, remaining - MOVE_OVERHEAD)
+
+    soft = min(remaining / moves_to_go + increment * 0.75, max_time)
+    # an unstable iteration may run past the soft limit, but never spend more than an eighth of the clock on one move
+    hard = min(soft * 4, remaining / 8, max_time)
+    return (soft, max(soft, hard))
+
+
+def iterative_deepening_search(board: Chess, limits: SearchLimits = SearchLimits(), search: SearchState | None = None, on_iteration=None) -> (Move | None, int):
+    """
+    Search depth 1, 2, 3, ... until a limit is reached, returns the best move and score of the deepest completed iteration.
+    on_iteration(depth, score, nodes, seconds, move) is called after every completed iteration.
+    """
+    if search is None:
+        search = SearchState(TranspositionTable())
+    start = time.monotonic()
+    pondering = search.pondering
+    soft, hard = allocate_time(limits, board.to_move) if not pondering else (None, None)
+    search.start(start + hard if hard is not None else None, limits.nodes)
+    search.started = start
+    search.soft_limit = soft
+    if pondering and not search.pondering:
+        # the ponderhit came while the search was starting, its limits were overwritten
+        search.ponderhit(limits, board.to_move)
+    if search.tt is not None:
+        search.tt.new_search()
+
+    legal_moves = generate_legal_moves(board)
+    if len(legal_moves) == 0:
+        if is_check(board, board.to_move):
+            return (None, -sys.maxsize if board.to_move == WHITE else sys.maxsize)
+        return (None, 0)
+
+    # always have a move ready, even if the first iteration can't finish
+    best_move, best_score = legal_moves[0], get_evaluation(board)
+    max_depth = min(limits.depth, MAX_SEARCH_DEPTH) if limits.depth is not None else MAX_SEARCH_DEPTH
+    iteration_nodes: List[int] = []
+
+    for depth in range(min(search.start_depth, max_depth), max_depth + 1):
+        iteration_start = time.monotonic()
+        nodes_before = search.nodes
+        move, score = alpha_beta_search(board, depth, -sys.maxsize, sys.maxsize, board.to_move, 0, search)
+        if search.stopped:
+            break
+
+        if move is not None:
+            best_move, best_score = move, score
+        search.lines = [(best_move, best_score)] + search_other_lines(board, depth, best_move, min(search.multipv, len(legal_moves)), search)
+        if search.stopped:
+            break
+        now = time.monotonic()
+        if on_iteration is not None:
+            on_iteration(depth, best_score, search.nodes, now - start, best_move)
+
+        # a forced mate won't change with more depth
+        if abs(best_score) == sys.maxsize:
+            break
+
+        iteration_nodes.append(search.nodes - nodes_before)
+        # ponderhit may set the limit while searching
+        soft = search.soft_limit
+        if soft is None:
+            continue
+        if len(iteration_nodes) >= 3 and iteration_nodes[-3] > 0:
+            # the next iteration is expected to grow by the branching factor measured over the last two,
+            # measuring over two iterations smooths out the difference between odd and even depths
+            branching_factor = max(1.0, (iteration_nodes[-1] / iteration_nodes[-3]) ** 0.5)
+            if now - start + (now - iteration_start) * branching_factor > soft:
                 break
-        return (best_move, best_val)
+        elif now - start > soft / 2:
+            break
+
+    return (best_move, best_score)
+
+
+def search_other_lines(board: Chess, depth: int, best_move: Move, lines: int, search: SearchState) -> List[Tuple[Move, int]]:
+    """
+    Search the root again for the second to lines-th best move, each time without the moves already found
+    """
+    found = []
+    search.excluded_moves = {best_move}
+    try:
+        while len(found) + 1 < lines:
+            move, score = alpha_beta_search(board, depth, -sys.maxsize, sys.maxsize, board.to_move, 0, search)
+            if search.stopped or move is None:
+                break
+            found.append((move, score))
+            search.excluded_moves.add(move)
+    finally:
+        search.excluded_moves = set()
+    return found
+
 
+def principal_variation(board: Chess, move: Move, search: SearchState, max_length: int = MAX_SEARCH_DEPTH) -> List[Move]:
+    """
+    move followed by the hash moves of the positions it leads to, as long as they are legal and don't repeat
+    """
+    pv = [move]
+    undos = [board.make_move(move)]
+    seen = {board.zobrist_key}
+    while search.tt is not None and len(pv) < max_length:
+        entry = search.tt.get(board.zobrist_key)
+        if entry is None or entry[3] == NULL_MOVE or entry[3] not in generate_legal_moves(board):
+            break
+        pv.append(entry[3])
+        undos.append(board.make_move(entry[3]))
+        if board.zobrist_key in seen:
+            break
+        seen.add(board.zobrist_key)
+    for undo in reversed(undos):
+        board.unmake_move(undo)
+    return pv
+
+
+# words per worker in the Lazy SMP result array: completed depth, move and score
+SMP_RESULT_SIZE = 3
+# helper history tables start with random values below this, a cutoff at depth d adds d * d
+SMP_HISTORY_SEED = 256
 
-def play_game_against_self(b: Chess, depth: int, max_moves: int):
+
+def lazy_smp_worker(fen: str, limits: SearchLimits, tt_name: str, tt_size_mb: int, tt_age: int, index: int, results, stop_event,
+                    bitbase_directory: str | None = None):
+    """
+    A Lazy SMP helper: search the root on its own, sharing only the transposition table.
+    Whatever the limits, helpers differ from the main search and from each other: odd helpers start one iteration
+    deeper, and a history table seeded from index orders the quiet moves differently, so the workers search
+    different trees and fill the table for each other. With a depth limit odd helpers also search one ply deeper.
+    """
+    board = board_from_fen(fen)
+    tt = SharedTranspositionTable(tt_size_mb, tt_name, tt_age)
+    search = SearchState(tt)
+    search.stop_event = stop_event
+    if bitbase_directory is not None:
+        search.bitbases = Bitbases(bitbase_directory)
+    search.start_depth = 1 + index % 2
+    rng = random.Random(index)
+    search.history = [rng.randrange(SMP_HISTORY_SEED) for _ in range(HISTORY_SIZE)]
+    if limits.depth is not None:
+        limits = limits._replace(depth=limits.depth + index % 2)
+
+    def record(depth, score, nodes, seconds, move):
+        offset = index * SMP_RESULT_SIZE
+        results[offset], results[offset + 1], results[offset + 2] = depth, move, score
+
+    iterative_deepening_search(board, limits, search, record)
+    tt.close()
+
+
+class SmpHelpers(NamedTuple):
+    processes: List[multiprocessing.Process]
+    # SMP_RESULT_SIZE words per worker, the main search is worker 0
+    results: object
+    stop_event: object
+
+
+def start_smp_helpers(board: Chess, limits: SearchLimits, threads: int, tt: SharedTranspositionTable, bitbases: Bitbases | None = None) -> SmpHelpers:
+    """
+    Start the threads - 1 helper processes of a Lazy SMP search, each opens the bitbases of the main search itself.
+    Helpers are forked, so this must not run while another thread holds a lock the child needs, like the stdin reader's.
+    """
+    results = multiprocessing.Array('q', SMP_RESULT_SIZE * threads, lock=False)
+    stop_event = multiprocessing.Event()
+    fen = board_to_fen(board)
+    processes = [multiprocessing.Process(target=lazy_smp_worker, args=(fen, limits, tt.name, tt.size_mb, tt.age, index, results, stop_event,
+                                                                               bitbases.directory if bitbases is not None else None), daemon=True)
+                 for index in range(1, threads)]
+    for process in processes:
+        process.start()
+    return SmpHelpers(processes, results, stop_event)
+
+
+def lazy_smp_search(board: Chess, limits: SearchLimits = SearchLimits(), threads: int = 1, search: SearchState | None = None, on_iteration=None,
+                    helpers: SmpHelpers | None = None) -> (Move | None, int):
+    """
+    Lazy SMP: threads - 1 helper processes search the same root as this one, sharing one SharedTranspositionTable.
+    This process decides when to stop, then the deepest iteration any worker completed is played.
+    helpers are the already started helpers from start_smp_helpers, they are started here if None.
+    """
+    if search is None:
+        if threads <= 1:
+            return iterative_deepening_search(board, limits, SearchState(TranspositionTable()), on_iteration)
+        search = SearchState(SharedTranspositionTable())
+        try:
+            return lazy_smp_search(board, limits, threads, search, on_iteration)
+        finally:
+            search.tt.close()
+    if threads <= 1 or not isinstance(search.tt, SharedTranspositionTable):
+        return iterative_deepening_search(board, limits, search, on_iteration)
+
+    if helpers is None:
+        helpers = start_smp_helpers(board, limits, threads, search.tt, search.bitbases)
+    results = helpers.results
+
+    def record(depth, score, nodes, seconds, move):
+        results[0], results[1], results[2] = depth, move, score
+        if on_iteration is not None:
+            on_iteration(depth, score, nodes, seconds, move)
+
+    best_move, best_score = iterative_deepening_search(board, limits, search, record)
+    helpers.stop_event.set()
+    for process in helpers.processes:
+        process.join()
+
+    best_depth = results[0]
+    for index in range(1, threads):
+        depth, move, score = results[index * SMP_RESULT_SIZE:(index + 1) * SMP_RESULT_SIZE]
+        if depth > best_depth and move != NULL_MOVE:
+            best_depth, best_move, best_score = depth, move, score
+    return (best_move, best_score)
+
+
+# the positions of the bench command: the test_perft.py positions, middle games and endings.
+# Changing the list, the depths or anything the search does changes the signature.
+BENCH_POSITIONS = [
+    DEFAULT_POSITION,
+    KIWI_PETE,
+    POSITION_3,
+    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "r3k2r/2pb1ppp/2pp1q2/p7/1nP1B3/1P2P3/P2N1PPP/R2QK2R w KQkq a6 0 14",
+    "4rrk1/2p1b1p1/p1p3q1/4p3/2P2n1p/1P1NR2P/PB3PP1/3R1QK1 b - - 2 24",
+    "r3qbrk/6p1/2b2pPp/p3pP1Q/PpPpP2P/3P1B2/2PB3K/R5R1 w - - 16 42",
+    "6k1/1R3p2/6p1/2Bp3p/3P2q1/P7/1P2rQ1K/5R2 b - - 4 44",
+    "8/8/1p2k1p1/3p3p/1p1P1P1P/1P2PK2/8/8 w - - 3 54",
+    "7r/2p3k1/1p1p1qp1/1P1Bp3/p1P2r1P/P7/4R3/Q4RK1 w - - 0 36",
+    "r1bq1rk1/pp2b1pp/n1pp1n2/3P1p2/2P1p3/2N1P2N/PP2BPPP/R1BQ1RK1 b - - 2 10",
+    "3r3k/2r4p/1p1b3q/p4P2/P2Pp3/1B2P3/3BQ1RP/6K1 w - - 3 87",
+    "2r4r/1p4k1/1Pnp4/3Qb1pq/8/4BpPp/5P2/2RR1BK1 w - - 0 42",
+    "4q1bk/6b1/7p/p1p4p/PNPpP2P/KN4P1/3Q4/4R3 b - - 0 37",
+    "2q3r1/1r2pk2/pp3pp1/2pP3p/P1Pb1BbP/1P4Q1/R3NPP1/4R1K1 w - - 2 34",
+    "1r2r2k/1b4q1/pp5p/2pPp1p1/P3Pn2/1P1B1Q1P/2R3P1/4BR1K b - - 1 37",
+    "r3kbbr/pp1n1p1P/3ppnp1/q5N1/1P1pP3/P1N1B3/2P1QP2/R3KB1R b KQkq b3 0 17",
+    "8/6pk/2b1Rp2/3r4/1R1B2PP/P5K1/8/2r5 b - - 16 42",
+    "1r4k1/4ppb1/2n1b1qp/pB4p1/1n1BP1P1/7P/2PNQPK1/3RN3 w - - 8 29",
+    "8/p2B4/PkP5/4p1pK/4Pb1p/5P2/8/8 w - - 29 68",
+    "3r4/ppq1ppkp/4bnp1/2pN4/2P1P3/1P4P1/PQ3PBP/R4K2 b - - 2 20",
+    "5rr1/4n2k/4q2P/P1P2n2/3B1p2/4pP2/2N1P3/1RR1K2Q w - - 1 49",
+    "1r5k/2pq2p1/3p3p/p1pP4/4QP2/PP1R3P/6PK/8 w - - 1 51",
+    "q5k1/5ppp/1r3bn1/1B6/P1N2P2/BQ2P1P1/5K1P/8 b - - 2 34",
+    "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+    "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+    "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+]
+BENCH_DEPTH = 3
+BENCH_PERFT_DEPTH = 3
+BENCH_FILE = "bench.json"
+
+
+def bench(depth: int = BENCH_DEPTH, perft_depth: int = BENCH_PERFT_DEPTH, json_file: str | None = BENCH_FILE, out=print) -> dict:
+    """
+    Count perft and search a fixed depth on every bench position, each search starting from an empty table.
+    The search node total is the signature, it only changes when the search does, the nodes per second
+    are what to compare between revisions. The results are written to json_file unless it is None.
+    """
+    results = []
+    for fen in BENCH_POSITIONS:
+        move_counts = [0] * perft_depth
+        start = time.monotonic()
+        generate_moves_test(board_from_fen(fen), 0, perft_depth, move_counts)
+        perft_seconds = time.monotonic() - start
+
+        search = SearchState(TranspositionTable())
+        start = time.monotonic()
+        move, score = iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=depth), search)
+        search_seconds = time.monotonic() - start
+        results.append({
+            "fen": fen,
+            "perft_nodes": move_counts[-1],
+            "perft_seconds": perft_seconds,
+            "search_nodes": search.nodes,
+            "search_seconds": search_seconds,
+            "move": move_to_algebraic(move) if move is not None else None,
+            "score": score,
+        })
+        out(f"{fen:<72} perft {move_counts[-1]:>9} search {search.nodes:>9} {results[-1]['move']}")
+
+    report = {"depth": depth, "perft_depth": perft_depth, "positions": results}
+    for name in ("perft", "search"):
+        nodes = sum(result[f"{name}_nodes"] for result in results)
+        seconds = sum(result[f"{name}_seconds"] for result in results)
+        report[name] = {"nodes": nodes, "seconds": seconds, "nps": round(nodes / max(seconds, 1e-9))}
+        out(f"{name:<7} {nodes:>10} nodes {seconds:>8.2f}s {report[name]['nps']:>9} nps")
+    report["signature"] = report["search"]["nodes"]
+    out(f"signature {report['signature']}")
+    if json_file is not None:
+        with open(json_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def play_game_against_self(b: Chess, depth: int, max_moves: int, movetime: int | None = None):
     board = copy.deepcopy(b)
     board.print_board()
+    search = SearchState(TranspositionTable())
     while board.full_move_clock < max_moves:
-        res = alpha_beta_search(
-            board, depth, -sys.maxsize, sys.maxsize, board.to_move)
+        res = iterative_deepening_search(board, SearchLimits(depth=depth, movetime=movetime), search)
         if res[0] is not None:
-            board = copy.deepcopy(res[0])
+            board.make_move(res[0])
         else:
             break
 
         board.print_board()
 
 
-def play_game_uci():
-    board = board_from_fen(DEFAULT_POSITION)
-    buffer = read_from_gui()
+MAX_THREADS = 64
 
-    if buffer != "uci":
-        log_error(f"Expected uci protocol but got {buffer}\n")
-        return
 
-    send_to_gui("id name ChessEngine\n")
-    send_to_gui("id author Hirokazu Hirono\n")
-    send_to_gui("uciok\n")
+def parse_go(tokens: List[str]) -> SearchLimits:
+    """
+    SearchLimits from the arguments of a UCI go command, a limit with a value that isn't a number is left out
+    """
+    limits = {}
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "infinite":
+            limits["infinite"] = True
+        elif tokens[i] in SearchLimits._fields and i + 1 < len(tokens):
+            try:
+                limits[tokens[i]] = int(tokens[i + 1])
+            except ValueError:
+                log_error(f"Invalid value {tokens[i + 1]} for go {tokens[i]}\n")
+            i += 1
+        i += 1
+    return SearchLimits(**limits)
+
+
+def new_search_state(threads: int, hash_mb: int = DEFAULT_HASH_MB) -> SearchState:
+    """
+    A search with a transposition table that helper processes can attach to once there is more than one thread
+    """
+    return SearchState(SharedTranspositionTable(hash_mb) if threads > 1 else TranspositionTable(hash_mb))
+
 
-    buffer = read_from_gui()
-    if buffer != "isready":
-        log_error(f"Expected isready protocol but got {buffer}")
-        return
+def close_search_state(search: SearchState):
+    if isinstance(search.tt, SharedTranspositionTable):
+        search.tt.close()
 
-    send_to_gui("readyok\n")
 
-    while True:
-        buffer = read_from_gui()
-        if buffer == "quit":
-            break
-        elif buffer == "ucinewgame":
-            print("ucinewgame")
-        elif buffer == "position startpos":
-            board = board_from_fen(DEFAULT_POSITION)
-        elif buffer == "isready":
+def parse_move(board: Chess, text: str) -> Move | None:
+    """
+    The legal move written in long algebraic notation, e2e4 or e7e8q, None if there is none
+    """
+    for move in generate_legal_moves(board):
+        if move_to_algebraic(move) == text:
+            return move
+    return None
+
+
+def uci_score(score: int, depth: int, color: int) -> str:
+    """
+    A white relative score as seen by the side to move, the search stops at the first depth that finds a mate
+    """
+    score = score if color == WHITE else -score
+    if abs(score) == sys.maxsize:
+        return f"mate {(depth + 1) // 2 if score > 0 else -((depth + 1) // 2)}"
+    return f"cp {score}"
+
+
+MAX_HASH_MB = 1024
+MAX_MULTIPV = 32
+
+
+class UciEngine:
+    """
+    The state of a UCI session: the game position, the options and the search state kept between moves
+    """
+
+    def __init__(self):
+        self.board = board_from_fen(DEFAULT_POSITION)
+        # the position command the board was built from, its fen and moves
+        self.fen = DEFAULT_POSITION
+        self.moves: List[str] = []
+        self.threads = 1
+        self.hash_mb = DEFAULT_HASH_MB
+        self.multipv = 1
+        self.search = new_search_state(self.threads, self.hash_mb)
+        # the thread running the current go command, the main thread keeps reading commands meanwhile
+        self.search_thread: threading.Thread | None = None
+        self.stop_event = threading.Event()
+        # the Ponder option, the GUI only sends go ponder when it is on
+        self.ponder = False
+        # the limits of the current go command, a ponderhit starts the clock with them
+        self.limits = SearchLimits()
+        # the side to move at the root of the current go command, the search thread is moving pieces on the board meanwhile
+        self.root_color = WHITE
+        # set by ponderhit or stop, a ponder search can't answer before either
+        self.ponder_over = threading.Event()
+        # the Book option, moves are played from it without searching while the position is in it
+        self.book: PolyglotBook | None = None
+        self.book_best = False
+        # the Bitbases option, a directory of endgame bitbases made by retrograde.py, the default one when it was generated
+        self.bitbases: Bitbases | None = None
+        if os.path.isdir(BITBASE_DIRECTORY):
+            self.open_bitbases(BITBASE_DIRECTORY)
+
+    def handle(self, command: str) -> bool:
+        """
+        Execute one command, returns False once the GUI asked to quit. Commands may come in any order.
+        """
+        tokens = command.split()
+        if not tokens:
+            return True
+        name = tokens[0]
+        if name == "quit":
+            self.stop()
+            return False
+        # these are answered at once, also while a search is running
+        if name == "uci":
+            self.uci()
+            return True
+        if name == "isready":
             send_to_gui("readyok\n")
+            return True
+        if name == "stop":
+            self.stop()
+            return True
+        if name == "ponderhit":
+            self.ponderhit()
+            return True
+        if name not in ("ucinewgame", "position", "setoption", "go", "bench"):
+            log_error(f"Unrecognized command {command}\n")
+            return True
+
+        # everything else changes what the search works on, it has to finish first
+        self.wait()
+        if name == "ucinewgame":
+            self.search.tt.clear()
+        elif name == "position":
+            self.position(tokens[1:])
+        elif name == "setoption":
+            self.setoption(tokens[1:])
+        elif name == "go":
+            self.go(tokens[1:])
+        elif name == "bench":
+            self.bench(tokens[1:])
+        return True
+
+    def bench(self, tokens: List[str]):
+        """
+        bench [depth], the results go to the GUI only, no bench file is written
+        """
+        try:
+            depth = int(tokens[0]) if tokens else BENCH_DEPTH
+        except ValueError:
+            log_error(f"Invalid bench depth {tokens[0]}\n")
+            return
+        bench(depth, json_file=None, out=lambda line: send_to_gui(f"{line}\n"))
+
+    def uci(self):
+        send_to_gui("id name ChessEngine\n")
+        send_to_gui("id author Hirokazu Hirono\n")
+        send_to_gui(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max {MAX_HASH_MB}\n")
+        send_to_gui(f"option name Threads type spin default 1 min 1 max {MAX_THREADS}\n")
+        send_to_gui(f"option name MultiPV type spin default 1 min 1 max {MAX_MULTIPV}\n")
+        send_to_gui("option name Ponder type check default false\n")
+        send_to_gui(f"option name Book type string default {self.book.filename if self.book is not None else '<empty>'}\n")
+        send_to_gui("option name Best Book Move type check default false\n")
+        send_to_gui(f"option name Bitbases type string default {self.bitbases.directory if self.bitbases is not None else '<empty>'}\n")
+        send_to_gui(f"option name Debug Log File type string default {log_writer.filename if log_writer is not None else '<empty>'}\n")
+        send_to_gui("uciok\n")
+
+    def position(self, tokens: List[str]):
+        """
+        position startpos|fen <fen> [moves <move> ...]
+        When the GUI repeats the game so far with new moves appended, only the new moves are played.
+        """
+        moves_index = tokens.index("moves") if "moves" in tokens else len(tokens)
+        moves = tokens[moves_index + 1:]
+        if tokens and tokens[0] == "startpos":
+            fen = DEFAULT_POSITION
+        elif tokens and tokens[0] == "fen":
+            fields = tokens[1:moves_index]
+            fen = " ".join(fields + ["0", "1"][len(fields) - 4:] if 4 <= len(fields) < 6 else fields)
         else:
-            log_error(f"Unrecognized command {buffer}\n")
+            log_error(f"Invalid position {' '.join(tokens)}\n")
+            return
+
+        if fen == self.fen and moves[:len(self.moves)] == self.moves:
+            new_moves = moves[len(self.moves):]
+        else:
+            try:
+                board = board_from_fen(fen)
+            except (ValueError, IndexError) as e:
+                log_error(f"Invalid fen {fen}: {e}\n")
+                return
+            self.board, self.fen, self.moves, new_moves = board, fen, [], moves
+
+        for text in new_moves:
+            move = parse_move(self.board, text)
+            if move is None:
+                log_error(f"Illegal move {text}\n")
+                return
+            self.board.make_move(move)
+            self.moves.append(text)
+
+    def setoption(self, tokens: List[str]):
+        """
+        setoption name <id> [value <x>], option names are case insensitive
+        """
+        value_index = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[1:value_index]).lower()
+        value = " ".join(tokens[value_index + 1:])
+        if name == "debug log file":
+            start_log(value or None)
+            return
+        if name == "ponder":
+            self.ponder = value.lower() == "true"
+            return
+        if name == "book":
+            self.open_book(value)
+            return
+        if name == "best book move":
+            self.book_best = value.lower() == "true"
+            return
+        if name == "bitbases":
+            self.open_bitbases(value)
+            return
+        try:
+            if name == "hash":
+                self.hash_mb = min(MAX_HASH_MB, max(1, int(value)))
+            elif name == "threads":
+                self.threads = min(MAX_THREADS, max(1, int(value)))
+            elif name == "multipv":
+                self.multipv = min(MAX_MULTIPV, max(1, int(value)))
+                return
+            else:
+                log_error(f"Unknown option {name}\n")
+                return
+        except ValueError:
+            log_error(f"Invalid value {value} for option {name}\n")
+            return
+        close_search_state(self.search)
+        self.search = new_search_state(self.threads, self.hash_mb)
+
+    def go(self, tokens: List[str]):
+        """
+        Start searching in a worker thread, it answers with bestmove by itself.
+        go ponder searches the position after the expected reply without a clock until ponderhit or stop.
+        """
+        limits = parse_go(tokens)
+        pondering = "ponder" in tokens
+        self.limits = limits
+        self.root_color = self.board.to_move
+        if not pondering and not limits.infinite:
+            move = self.book_move()
+            if move is not None:
+                send_to_gui(f"bestmove {move_to_algebraic(move)}\n")
+                return
+        self.stop_event = threading.Event()
+        self.ponder_over = threading.Event()
+        self.search.stop_event = self.stop_event
+        self.search.multipv = self.multipv
+        self.search.pondering = pondering
+        self.search.bitbases = self.bitbases
+        # the helpers are forked here, the search thread would fork while this thread holds the stdin lock
+        helpers = None
+        if self.threads > 1 and isinstance(self.search.tt, SharedTranspositionTable):
+            # helpers have no ponderhit, they search until the main search stops them
+            helper_limits = limits._replace(infinite=True) if pondering else limits
+            helpers = start_smp_helpers(self.board, helper_limits, self.threads, self.search.tt, self.bitbases)
+        self.search_thread = threading.Thread(target=self.run_search, args=(limits, helpers), daemon=True)
+        self.search_thread.start()
+
+    def run_search(self, limits: SearchLimits, helpers: SmpHelpers | None = None):
+        """
+        The search thread. It always answers with a bestmove, after an error in the search with the best move of the
+        last completed iteration or else the first legal move, so the GUI isn't left waiting.
+        """
+        board = self.board
+        search = self.search
+        start = time.monotonic()
+        legal_moves = generate_legal_moves(board)
+        found = [legal_moves[0] if legal_moves else None]
+
+        def report(depth, score, nodes, seconds, move):
+            found[0] = move
+            elapsed = time.monotonic() - start
+            for index, (line_move, line_score) in enumerate(search.lines, 1):
+                pv = " ".join(move_to_algebraic(m) for m in principal_variation(board, line_move, search, depth))
+                send_to_gui(f"info depth {depth} multipv {index} score {uci_score(line_score, depth, board.to_move)} "
+                            f"nodes {nodes} nps {int(nodes / max(elapsed, 1e-9))} time {int(elapsed * 1000)} pv {pv}\n")
+
+        failed = False
+        try:
+            move, _ = lazy_smp_search(board, limits, self.threads, search, report, helpers)
+        except Exception:
+            log_error(f"Search failed:\n{traceback.format_exc()}")
+            failed = True
+            move = found[0]
+            if helpers is not None:
+                helpers.stop_event.set()
+                for process in helpers.processes:
+                    process.join()
+            # moves of the search may still be on the board, the next position command sets it up again
+            self.fen = ""
+        # neither an infinite nor a ponder search may answer before it is told to, even when it ran out of depth
+        if limits.infinite:
+            self.stop_event.wait()
+        elif search.pondering:
+            self.ponder_over.wait()
+        if move is None:
+            send_to_gui("bestmove 0000\n")
+            return
+        # the expected reply, to ponder on while the opponent thinks
+        pv = []
+        if not failed:
+            try:
+                pv = principal_variation(board, move, search, 2)
+            except Exception:
+                log_error(f"Ponder move failed:\n{traceback.format_exc()}")
+        send_to_gui(f"bestmove {move_to_algebraic(move)}{f' ponder {move_to_algebraic(pv[1])}' if len(pv) > 1 else ''}\n")
+
+    def open_book(self, filename: str):
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if filename and filename != "<empty>":
+            try:
+                self.book = PolyglotBook(filename)
+            except OSError as e:
+                log_error(f"Could not open book {filename}: {e}\n")
+
+    def open_bitbases(self, directory: str):
+        if self.bitbases is not None:
+            self.bitbases.close()
+            self.bitbases = None
+        if directory and directory != "<empty>":
+            try:
+                self.bitbases = Bitbases(directory)
+            except (OSError, ValueError) as e:
+                log_error(f"Could not open bitbases {directory}: {e}\n")
+
+    def book_move(self) -> Move | None:
+        if self.book is None:
+            return None
+        text = choose_book_move(self.board, self.book, self.book_best)
+        # a corrupt or foreign book could hold anything, only legal moves are played
+        return parse_move(self.board, text) if text is not None else None
+
+    def ponderhit(self):
+        """
+        The opponent played the move pondered on, the search carries on with its transposition table and
+        iterations and from now on keeps to the time limits of the go ponder command.
+        A ponder miss is a stop followed by a new position and go, the table is kept then as well.
+        """
+        if self.search_thread is None:
+            return
+        self.search.ponderhit(self.limits, self.root_color)
+        self.ponder_over.set()
+
+    def stop(self):
+        """
+        Stop a running search, the search checks for it every TIME_CHECK_INTERVAL nodes
+        """
+        self.stop_event.set()
+        self.ponder_over.set()
+        self.wait()
+
+    def wait(self):
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+    def close(self):
+        self.stop()
+        close_search_state(self.search)
+        self.open_book("")
+        self.open_bitbases("")
+
+
+def play_game_uci():
+    engine = UciEngine()
+    try:
+        while engine.handle(read_from_gui()):
+            pass
+    finally:
+        engine.close()
+
+
+class LogWriter:
+    """
+    Writes log lines from a background thread, so talking to the GUI never waits for the disk.
+    The file stays open and is flushed whenever the queue runs empty.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.lines: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, line: str):
+        self.lines.put(line)
+
+    def run(self):
+        with open(self.filename, "a", encoding="utf-8") as f:
+            while True:
+                line = self.lines.get()
+                while line is not None:
+                    f.write(line)
+                    try:
+                        line = self.lines.get_nowait()
+                    except queue.Empty:
+                        break
+                f.flush()
+                if line is None:
+                    return
+
+    def close(self):
+        self.lines.put(None)
+        self.thread.join()
+
+
+# the protocol log, off unless the Debug Log File option or --log names a file
+log_writer: LogWriter | None = None
+# the search thread and the main thread both talk to the GUI
+output_lock = threading.Lock()
+
+
+def start_log(filename: str | None):
+    global log_writer
+    if log_writer is not None:
+        log_writer.close()
+    log_writer = LogWriter(filename) if filename else None
 
 
 def send_to_gui(message: str):
-    print(f"{message}", end="")
-    with open("log.txt", "a", encoding="utf-8") as f:
-        f.write(f"ENGINE >> {message}")
+    with output_lock:
+        print(f"{message}", end="", flush=True)
+    if log_writer is not None:
+        log_writer.write(f"ENGINE >> {message}")
 
 
 def log_error(message: str):
-    with open("log.txt", "a", encoding="utf-8") as f:
-        f.write(f"<ERROR> {message}")
+    if log_writer is not None:
+        log_writer.write(f"<ERROR> {message}")
 
 
 def read_from_gui() -> str:
-    buffer = input("ENGINE << ")
-    with open("log.txt", "a", encoding="utf-8") as f:
-        f.write(f"ENGINE << {buffer}")
+    try:
+        buffer = input()
+    except EOFError:
+        # the GUI went away without sending quit
+        buffer = "quit"
+    if log_writer is not None:
+        log_writer.write(f"ENGINE << {buffer}\n")
 
     return buffer.strip()
 
 
 if __name__ == '__main__':
-    # chess = Chess('settings.json')
-    play_game_uci()
+    # chess = Chess()
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else BENCH_DEPTH,
+              int(sys.argv[3]) if len(sys.argv) > 3 else BENCH_PERFT_DEPTH,
+              sys.argv[4] if len(sys.argv) > 4 else BENCH_FILE)
+    else:
+        if "--log" in sys.argv:
+            start_log(sys.argv[sys.argv.index("--log") + 1])
+        play_game_uci()
+        start_log(None)
     """
     while True:
         board.print_board()
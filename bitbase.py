@@ -0,0 +1,163 @@
+import mmap
+import os
+from typing import Dict, List, Tuple
+from defs import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, COLOR_MASK, PIECE_MASK, BOARD_START, BOARD_END, BOARD_WIDTH, piece_from_code
+
+"""
+    Endgame bitbases: the win, draw or loss of every position of a small material configuration.
+    A configuration is named by the pieces of both sides, the stronger side first, like KQvK, KPvK or KRvKP,
+    and is stored in <directory>/<name>.bin.
+    A position is indexed by the side to move and the square of every piece in the order of the name, a1 = 0 ... h8 = 63:
+        index = side * 64^n + square(piece 0) * 64^(n-1) + ... + square(piece n-1)
+    with side 0 when the first side of the name is to move. Each index holds 2 bits, four positions to the byte,
+    lowest bits first. Positions where the stronger side is black are looked up with the board mirrored.
+    Castling rights and en passant are not part of the index, positions with castling rights or an en passant capture are not probed.
+    Files are made by retrograde.py and memory mapped, a probe reads one byte.
+"""
+
+BITBASE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+
+BITBASE_DRAW = 0
+# won or lost for the side to move
+BITBASE_WIN = 1
+BITBASE_LOSS = 2
+# two pieces on one square, a pawn on the first or last rank or the side not to move in check
+BITBASE_INVALID = 3
+
+MAX_PIECES = 4
+
+PIECE_LETTERS = {KING: "K", QUEEN: "Q", ROOK: "R", BISHOP: "B", KNIGHT: "N", PAWN: "P"}
+LETTER_PIECES = {letter: piece for piece, letter in PIECE_LETTERS.items()}
+# the order of the pieces of one side in a name
+LETTER_ORDER = "KQRBNP"
+
+# the mailbox square index of every bitbase square and back, -1 outside the board
+MAILBOX_SQUARES = [(BOARD_END - 1 - square // 8) * BOARD_WIDTH + BOARD_START + square % 8 for square in range(64)]
+BITBASE_SQUARES = [-1] * (BOARD_WIDTH * BOARD_WIDTH)
+for bitbase_square, mailbox_square in enumerate(MAILBOX_SQUARES):
+    BITBASE_SQUARES[mailbox_square] = bitbase_square
+
+
+def side_name(letters: str) -> str:
+    return "".join(sorted(letters, key=LETTER_ORDER.index))
+
+
+def side_strength(letters: str) -> Tuple[int, Tuple[int, ...]]:
+    # more pieces first, then the most valuable piece
+    return len(letters), tuple(-LETTER_ORDER.index(letter) for letter in letters)
+
+
+def material_name(white: str, black: str) -> Tuple[str, bool]:
+    """
+    The name of the configuration with white and black pieces, and whether black is its first side
+    """
+    white, black = side_name(white), side_name(black)
+    if side_strength(black) > side_strength(white):
+        return f"{black}v{white}", True
+    return f"{white}v{black}", False
+
+
+def material_pieces(name: str) -> List[int]:
+    """
+    The pieces of a configuration in index order, the first side white
+    """
+    white, black = name.split("v")
+    return [WHITE | LETTER_PIECES[letter] for letter in white] + [BLACK | LETTER_PIECES[letter] for letter in black]
+
+
+def table_size(pieces: int) -> int:
+    return 2 * 64 ** pieces
+
+
+class Bitbase:
+    """
+    One configuration, memory mapped
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.name = os.path.splitext(os.path.basename(filename))[0]
+        self.pieces = material_pieces(self.name)
+        self.positions = 64 ** len(self.pieces)
+        self.file = open(filename, "rb")
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        if size != table_size(len(self.pieces)) // 4:
+            self.file.close()
+            raise ValueError(f"{filename} has {size} bytes, {self.name} needs {table_size(len(self.pieces)) // 4}")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, index: int) -> int:
+        return (self.data[index >> 2] >> ((index & 3) * 2)) & 3
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+class Bitbases:
+    """
+    Every bitbase file of a directory, probed with a board
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.tables: Dict[str, Bitbase] = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".bin") and "v" in filename:
+                table = Bitbase(os.path.join(directory, filename))
+                self.tables[table.name] = table
+        self.max_pieces = max((len(table.pieces) for table in self.tables.values()), default=0)
+
+    def probe(self, board) -> int | None:
+        """
+        BITBASE_WIN, BITBASE_DRAW or BITBASE_LOSS for the side to move of board, None when it is not in a bitbase.
+        Bare kings are a draw without a table.
+        """
+        piece_squares = board.piece_squares
+        if sum(map(len, piece_squares)) > self.max_pieces:
+            return None
+        if (board.white_king_side_castle or board.white_queen_side_castle
+                or board.black_king_side_castle or board.black_queen_side_castle):
+            return None
+        if board.pawn_double_move is not None:
+            # only a pawn of the side to move next to the pawn that moved two squares makes en passant matter
+            row, col = board.pawn_double_move
+            pawn_row = row + 1 if board.to_move == WHITE else row - 1
+            pawn = board.to_move | PAWN
+            if board.state[pawn_row][col - 1] == pawn or board.state[pawn_row][col + 1] == pawn:
+                return None
+        squares: Dict[int, List[int]] = {}
+        white = black = ""
+        for code, indexes in enumerate(piece_squares):
+            if indexes:
+                piece = piece_from_code(code)
+                squares[piece] = [BITBASE_SQUARES[index] for index in indexes]
+                if piece & COLOR_MASK == WHITE:
+                    white += PIECE_LETTERS[piece & PIECE_MASK] * len(indexes)
+                else:
+                    black += PIECE_LETTERS[piece & PIECE_MASK] * len(indexes)
+        if white == "K" and black == "K":
+            return BITBASE_DRAW
+        name, mirrored = material_name(white, black)
+        table = self.tables.get(name)
+        if table is None:
+            return None
+
+        side = 0 if board.to_move == WHITE else 1
+        if mirrored:
+            # swap the colors and flip the board, ranks count from the other side
+            squares = {piece ^ WHITE: [square ^ 56 for square in piece_list] for piece, piece_list in squares.items()}
+            side ^= 1
+        index = side
+        used: Dict[int, int] = {}
+        for piece in table.pieces:
+            n = used.get(piece, 0)
+            index = index * 64 + squares[piece][n]
+            used[piece] = n + 1
+        value = table.get(index)
+        return value if value != BITBASE_INVALID else None
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+        self.max_pieces = 0
@@ -0,0 +1,453 @@
+from array import array
+from typing import List, Tuple
+import app
+from defs import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, EMPTY, COLOR_MASK, PIECE_MASK, BOARD_START, BOARD_END, BOARD_WIDTH, DEFAULT_POSITION, CastlingType, Move
+from defs import SQUARE_MASK, MOVE_TO_SHIFT, MOVE_PIECE_SHIFT, MOVE_CAPTURED_SHIFT, MOVE_PROMOTION_SHIFT, MOVE_CASTLE, MOVE_EN_PASSANT, MOVE_DOUBLE_PUSH, PIECE_CODE_MASK, piece_code
+
+"""
+    Bitboard backend, an alternative to the 12x12 mailbox of app.Chess.
+    Every piece code has a 64 bit Python int with a bit set for each square it occupies.
+    Square 0 is a1, square 7 is h1 and square 63 is h8.
+    Moves use the same packed encoding as the mailbox, with mailbox square indexes, so both backends can be compared move for move.
+    The module mirrors the mailbox entry points (board_from_fen, generate_pseudo_legal_moves, generate_legal_moves,
+    generate_moves, generate_moves_test, is_check) so either module can be handed to code that runs perft.
+"""
+
+FULL_BOARD = (1 << 64) - 1
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+RANK_1 = 0xFF
+RANK_3 = RANK_1 << 16
+RANK_6 = RANK_1 << 40
+RANK_8 = RANK_1 << 56
+
+# mailbox square index of every bitboard square and back, rank 1 is the last mailbox row
+MAILBOX_SQUARES = [(BOARD_END - 1 - sq // 8) * BOARD_WIDTH + BOARD_START + sq % 8 for sq in range(64)]
+BITBOARD_SQUARES = [-1] * (BOARD_WIDTH * BOARD_WIDTH)
+for _sq, _index in enumerate(MAILBOX_SQUARES):
+    BITBOARD_SQUARES[_index] = _sq
+
+WHITE_KING_SIDE = CastlingType.WHITE_KING_SIDE.value
+WHITE_QUEEN_SIDE = CastlingType.WHITE_QUEEN_SIDE.value
+BLACK_KING_SIDE = CastlingType.BLACK_KING_SIDE.value
+BLACK_QUEEN_SIDE = CastlingType.BLACK_QUEEN_SIDE.value
+
+# castling rights kept after a move from or to a square, only the king and rook starting squares take any away
+CASTLING_MASKS = [WHITE_KING_SIDE | WHITE_QUEEN_SIDE | BLACK_KING_SIDE | BLACK_QUEEN_SIDE] * 64
+CASTLING_MASKS[4] &= ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+CASTLING_MASKS[7] &= ~WHITE_KING_SIDE
+CASTLING_MASKS[0] &= ~WHITE_QUEEN_SIDE
+CASTLING_MASKS[60] &= ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+CASTLING_MASKS[63] &= ~BLACK_KING_SIDE
+CASTLING_MASKS[56] &= ~BLACK_QUEEN_SIDE
+
+
+def step_attacks(sq: int, offsets: List[Tuple[int, int]]) -> int:
+    rank, file = divmod(sq, 8)
+    attacks = 0
+    for rank_step, file_step in offsets:
+        to_rank, to_file = rank + rank_step, file + file_step
+        if 0 <= to_rank < 8 and 0 <= to_file < 8:
+            attacks |= 1 << (to_rank * 8 + to_file)
+    return attacks
+
+
+KNIGHT_ATTACKS = [step_attacks(sq, [(1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1)]) for sq in range(64)]
+KING_ATTACKS = [step_attacks(sq, [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)]) for sq in range(64)]
+# squares a pawn of the given color on sq attacks
+PAWN_ATTACKS = {
+    WHITE: [step_attacks(sq, [(1, -1), (1, 1)]) for sq in range(64)],
+    BLACK: [step_attacks(sq, [(-1, -1), (-1, 1)]) for sq in range(64)],
+}
+
+"""
+    Sliding attacks are looked up kindergarten style, one line at a time.
+    For every square and each of its four lines (rank, file, diagonal, anti-diagonal) the attack set is precomputed
+    for every occupancy of the inner squares of the line, the end squares never block anything past them.
+    The table is keyed by the masked occupancy itself: a dict lookup stands in for the magic multiply and shift,
+    costs the same in Python and needs no magic numbers.
+"""
+LINE_DIRECTIONS = [((0, 1), (0, -1)), ((1, 0), (-1, 0)), ((1, 1), (-1, -1)), ((1, -1), (-1, 1))]
+ROOK_LINES = (0, 1)
+BISHOP_LINES = (2, 3)
+
+
+def ray(sq: int, direction: Tuple[int, int]) -> List[int]:
+    rank, file = divmod(sq, 8)
+    squares = []
+    rank, file = rank + direction[0], file + direction[1]
+    while 0 <= rank < 8 and 0 <= file < 8:
+        squares.append(rank * 8 + file)
+        rank, file = rank + direction[0], file + direction[1]
+    return squares
+
+
+def build_line_attacks(sq: int, directions: Tuple[Tuple[int, int], Tuple[int, int]]) -> Tuple[int, dict]:
+    rays = [ray(sq, direction) for direction in directions]
+    mask = 0
+    for squares in rays:
+        for to_sq in squares[:-1]:
+            mask |= 1 << to_sq
+
+    attacks = {}
+    # walk every subset of the mask with the carry-rippler trick
+    occupancy = 0
+    while True:
+        line_attacks = 0
+        for squares in rays:
+            for to_sq in squares:
+                line_attacks |= 1 << to_sq
+                if occupancy & (1 << to_sq):
+                    break
+        attacks[occupancy] = line_attacks
+        occupancy = (occupancy - mask) & mask
+        if occupancy == 0:
+            break
+    return mask, attacks
+
+
+LINE_MASKS: List[List[int]] = [[0] * 64 for _ in LINE_DIRECTIONS]
+LINE_ATTACKS: List[List[dict]] = [[{} for _ in range(64)] for _ in LINE_DIRECTIONS]
+for _line, _directions in enumerate(LINE_DIRECTIONS):
+    for _sq in range(64):
+        LINE_MASKS[_line][_sq], LINE_ATTACKS[_line][_sq] = build_line_attacks(_sq, _directions)
+
+RANK_MASKS, FILE_MASKS, DIAGONAL_MASKS, ANTI_DIAGONAL_MASKS = LINE_MASKS
+RANK_ATTACKS, FILE_ATTACKS, DIAGONAL_ATTACKS, ANTI_DIAGONAL_ATTACKS = LINE_ATTACKS
+
+
+def rook_attacks(sq: int, occupied: int) -> int:
+    return RANK_ATTACKS[sq][occupied & RANK_MASKS[sq]] | FILE_ATTACKS[sq][occupied & FILE_MASKS[sq]]
+
+
+def bishop_attacks(sq: int, occupied: int) -> int:
+    return DIAGONAL_ATTACKS[sq][occupied & DIAGONAL_MASKS[sq]] | ANTI_DIAGONAL_ATTACKS[sq][occupied & ANTI_DIAGONAL_MASKS[sq]]
+
+
+def queen_attacks(sq: int, occupied: int) -> int:
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN, WHITE_KING = [piece_code(WHITE | piece) for piece in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)]
+BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN, BLACK_KING = [piece_code(BLACK | piece) for piece in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)]
+
+
+def color_index(color: int) -> int:
+    return 1 if color == WHITE else 0
+
+
+class BitboardPosition:
+    """
+    A position held as bitboards.
+    pieces is indexed by piece code, occupancy by color_index, squares holds the piece on every square for capture lookups.
+    castling is a bitmask of CastlingType values, en_passant the square behind a pawn that just moved two squares or -1.
+    """
+    __slots__ = ("pieces", "occupancy", "squares", "to_move", "castling", "en_passant", "half_move_clock", "full_move_clock")
+
+    def __init__(self):
+        self.pieces = [0] * (PIECE_CODE_MASK + 1)
+        self.occupancy = [0, 0]
+        self.squares = bytearray(64)
+        self.to_move = WHITE
+        self.castling = 0
+        self.en_passant = -1
+        self.half_move_clock = 0
+        self.full_move_clock = 1
+
+    def copy(self) -> 'BitboardPosition':
+        position = BitboardPosition()
+        position.pieces = self.pieces[:]
+        position.occupancy = self.occupancy[:]
+        position.squares = self.squares[:]
+        position.to_move = self.to_move
+        position.castling = self.castling
+        position.en_passant = self.en_passant
+        position.half_move_clock = self.half_move_clock
+        position.full_move_clock = self.full_move_clock
+        return position
+
+    def put_piece(self, sq: int, piece: int):
+        self.pieces[piece_code(piece)] |= 1 << sq
+        self.occupancy[color_index(piece & COLOR_MASK)] |= 1 << sq
+        self.squares[sq] = piece
+
+    def make_move(self, move: Move) -> tuple:
+        """
+        Apply a pseudo-legal move in place, returns the record unmake_move needs.
+        The bitboards are small enough that the record is simply a copy of them.
+        """
+        undo = (self.pieces[:], self.occupancy[:], self.squares[:], self.castling, self.en_passant, self.half_move_clock, self.full_move_clock)
+        pieces = self.pieces
+        occupancy = self.occupancy
+        squares = self.squares
+        from_sq = BITBOARD_SQUARES[move & SQUARE_MASK]
+        to_sq = BITBOARD_SQUARES[(move >> MOVE_TO_SHIFT) & SQUARE_MASK]
+        from_bit = 1 << from_sq
+        to_bit = 1 << to_sq
+        piece = squares[from_sq]
+        color = piece & COLOR_MASK
+        us = color_index(color)
+        them = 1 - us
+
+        captured = squares[to_sq]
+        if captured != EMPTY:
+            pieces[piece_code(captured)] ^= to_bit
+            occupancy[them] ^= to_bit
+        elif move & MOVE_EN_PASSANT:
+            captured_sq = to_sq - 8 if color == WHITE else to_sq + 8
+            pieces[piece_code(squares[captured_sq])] ^= 1 << captured_sq
+            occupancy[them] ^= 1 << captured_sq
+            squares[captured_sq] = EMPTY
+
+        pieces[piece_code(piece)] ^= from_bit
+        occupancy[us] ^= from_bit | to_bit
+        squares[from_sq] = EMPTY
+        promotion = (move >> MOVE_PROMOTION_SHIFT) & PIECE_MASK
+        if promotion != EMPTY:
+            piece = color | promotion
+        pieces[piece_code(piece)] ^= to_bit
+        squares[to_sq] = piece
+
+        if move & MOVE_CASTLE:
+            if to_sq > from_sq:
+                rook_from, rook_to = to_sq + 1, to_sq - 1
+            else:
+                rook_from, rook_to = to_sq - 2, to_sq + 1
+            rook_bits = (1 << rook_from) | (1 << rook_to)
+            pieces[piece_code(color | ROOK)] ^= rook_bits
+            occupancy[us] ^= rook_bits
+            squares[rook_to] = squares[rook_from]
+            squares[rook_from] = EMPTY
+
+        self.castling &= CASTLING_MASKS[from_sq] & CASTLING_MASKS[to_sq]
+        self.en_passant = (from_sq + to_sq) // 2 if move & MOVE_DOUBLE_PUSH else -1
+        if piece & PIECE_MASK == PAWN or captured != EMPTY:
+            self.half_move_clock = 0
+        else:
+            self.half_move_clock += 1
+        if color == BLACK:
+            self.full_move_clock += 1
+        self.to_move = BLACK if color == WHITE else WHITE
+        return undo
+
+    def unmake_move(self, undo: tuple):
+        (self.pieces, self.occupancy, self.squares, self.castling, self.en_passant,
+         self.half_move_clock, self.full_move_clock) = undo
+        self.to_move = BLACK if self.to_move == WHITE else WHITE
+
+
+def position_from_chess(board: app.Chess) -> BitboardPosition:
+    position = BitboardPosition()
+    for sq in range(64):
+        row, col = divmod(MAILBOX_SQUARES[sq], BOARD_WIDTH)
+        piece = board.state[row][col]
+        if piece != EMPTY:
+            position.put_piece(sq, piece)
+    position.to_move = board.to_move
+    position.castling = ((WHITE_KING_SIDE if board.white_king_side_castle else 0)
+                         | (WHITE_QUEEN_SIDE if board.white_queen_side_castle else 0)
+                         | (BLACK_KING_SIDE if board.black_king_side_castle else 0)
+                         | (BLACK_QUEEN_SIDE if board.black_queen_side_castle else 0))
+    if board.pawn_double_move is not None:
+        row, col = board.pawn_double_move
+        position.en_passant = BITBOARD_SQUARES[row * BOARD_WIDTH + col]
+    position.half_move_clock = board.half_move_clock
+    position.full_move_clock = board.full_move_clock
+    return position
+
+
+def board_from_fen(fen: str = DEFAULT_POSITION) -> BitboardPosition:
+    """
+    Parse fen with the mailbox parser, so both backends accept and reject exactly the same strings
+    """
+    return position_from_chess(app.board_from_fen(fen))
+
+
+def is_square_attacked(position: BitboardPosition, sq: int, by_color: int) -> bool:
+    pieces = position.pieces
+    if by_color == WHITE:
+        pawns, knights, bishops, rooks, queens, king = WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN, WHITE_KING
+    else:
+        pawns, knights, bishops, rooks, queens, king = BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN, BLACK_KING
+    # a pawn of the other color on sq would attack exactly the squares pawns attacking sq stand on
+    if PAWN_ATTACKS[BLACK if by_color == WHITE else WHITE][sq] & pieces[pawns]:
+        return True
+    if KNIGHT_ATTACKS[sq] & pieces[knights] or KING_ATTACKS[sq] & pieces[king]:
+        return True
+    occupied = position.occupancy[0] | position.occupancy[1]
+    if bishop_attacks(sq, occupied) & (pieces[bishops] | pieces[queens]):
+        return True
+    return rook_attacks(sq, occupied) & (pieces[rooks] | pieces[queens]) != 0
+
+
+def is_check(position: BitboardPosition, color: int) -> bool:
+    king = position.pieces[piece_code(color | KING)]
+    if king == 0:
+        return False
+    return is_square_attacked(position, king.bit_length() - 1, BLACK if color == WHITE else WHITE)
+
+
+def add_targets(position: BitboardPosition, from_bits: int, targets: int, moves: array, n: int) -> int:
+    squares = position.squares
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        to_sq = bit.bit_length() - 1
+        captured = squares[to_sq]
+        moves[n] = from_bits | MAILBOX_SQUARES[to_sq] << MOVE_TO_SHIFT | (piece_code(captured) << MOVE_CAPTURED_SHIFT if captured != EMPTY else 0)
+        n += 1
+    return n
+
+
+def add_pawn_move(move: int, promotes: bool, moves: array, n: int) -> int:
+    if promotes:
+        return app.promote_pawn(move, moves, n)
+    moves[n] = move
+    return n + 1
+
+
+def add_pawn_moves(position: BitboardPosition, color: int, moves: array, n: int) -> int:
+    squares = position.squares
+    occupied = position.occupancy[0] | position.occupancy[1]
+    enemies = position.occupancy[1 - color_index(color)]
+    pawn_code = piece_code(color | PAWN)
+    push = 8 if color == WHITE else -8
+    last_rank = RANK_8 if color == WHITE else RANK_1
+    double_rank = RANK_3 if color == WHITE else RANK_6
+    en_passant_bit = 1 << position.en_passant if position.en_passant >= 0 else 0
+    attacks = PAWN_ATTACKS[color]
+
+    pawns = position.pieces[pawn_code]
+    while pawns:
+        bit = pawns & -pawns
+        pawns ^= bit
+        from_sq = bit.bit_length() - 1
+        from_bits = MAILBOX_SQUARES[from_sq] | pawn_code << MOVE_PIECE_SHIFT
+
+        targets = attacks[from_sq] & enemies
+        while targets:
+            to_bit = targets & -targets
+            targets ^= to_bit
+            to_sq = to_bit.bit_length() - 1
+            move = from_bits | MAILBOX_SQUARES[to_sq] << MOVE_TO_SHIFT | piece_code(squares[to_sq]) << MOVE_CAPTURED_SHIFT
+            n = add_pawn_move(move, to_bit & last_rank != 0, moves, n)
+
+        to_sq = from_sq + push
+        to_bit = 1 << to_sq
+        if not occupied & to_bit:
+            n = add_pawn_move(from_bits | MAILBOX_SQUARES[to_sq] << MOVE_TO_SHIFT, to_bit & last_rank != 0, moves, n)
+            if to_bit & double_rank and not occupied & (1 << (to_sq + push)):
+                moves[n] = from_bits | MAILBOX_SQUARES[to_sq + push] << MOVE_TO_SHIFT | MOVE_DOUBLE_PUSH
+                n += 1
+
+        if attacks[from_sq] & en_passant_bit:
+            captured = squares[position.en_passant - push]
+            if captured == (BLACK if color == WHITE else WHITE) | PAWN:
+                moves[n] = (from_bits | MAILBOX_SQUARES[position.en_passant] << MOVE_TO_SHIFT
+                            | piece_code(captured) << MOVE_CAPTURED_SHIFT | MOVE_EN_PASSANT)
+                n += 1
+    return n
+
+
+def add_castling_moves(position: BitboardPosition, color: int, moves: array, n: int) -> int:
+    if color == WHITE:
+        king_sq, king_side, queen_side = 4, WHITE_KING_SIDE, WHITE_QUEEN_SIDE
+    else:
+        king_sq, king_side, queen_side = 60, BLACK_KING_SIDE, BLACK_QUEEN_SIDE
+    if position.squares[king_sq] != color | KING or not position.castling & (king_side | queen_side):
+        return n
+
+    enemy = BLACK if color == WHITE else WHITE
+    occupied = position.occupancy[0] | position.occupancy[1]
+    from_bits = MAILBOX_SQUARES[king_sq] | piece_code(color | KING) << MOVE_PIECE_SHIFT | MOVE_CASTLE
+    if is_square_attacked(position, king_sq, enemy):
+        return n
+    if (position.castling & king_side and position.squares[king_sq + 3] == color | ROOK
+            and not occupied & (0b11 << (king_sq + 1))
+            and not is_square_attacked(position, king_sq + 1, enemy) and not is_square_attacked(position, king_sq + 2, enemy)):
+        moves[n] = from_bits | MAILBOX_SQUARES[king_sq + 2] << MOVE_TO_SHIFT
+        n += 1
+    if (position.castling & queen_side and position.squares[king_sq - 4] == color | ROOK
+            and not occupied & (0b111 << (king_sq - 3))
+            and not is_square_attacked(position, king_sq - 1, enemy) and not is_square_attacked(position, king_sq - 2, enemy)):
+        moves[n] = from_bits | MAILBOX_SQUARES[king_sq - 2] << MOVE_TO_SHIFT
+        n += 1
+    return n
+
+
+def generate_pseudo_legal_moves(position: BitboardPosition, buffer: app.MoveBuffer) -> int:
+    """
+    Write every pseudo-legal move of the side to move into buffer, returns the number of moves
+    """
+    moves = buffer.moves
+    pieces = position.pieces
+    color = position.to_move
+    us = position.occupancy[color_index(color)]
+    occupied = position.occupancy[0] | position.occupancy[1]
+    n = add_pawn_moves(position, color, moves, 0)
+
+    for piece_type in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+        code = piece_code(color | piece_type)
+        bitboard = pieces[code]
+        while bitboard:
+            bit = bitboard & -bitboard
+            bitboard ^= bit
+            from_sq = bit.bit_length() - 1
+            if piece_type == KNIGHT:
+                targets = KNIGHT_ATTACKS[from_sq]
+            elif piece_type == BISHOP:
+                targets = bishop_attacks(from_sq, occupied)
+            elif piece_type == ROOK:
+                targets = rook_attacks(from_sq, occupied)
+            elif piece_type == QUEEN:
+                targets = queen_attacks(from_sq, occupied)
+            else:
+                targets = KING_ATTACKS[from_sq]
+            n = add_targets(position, MAILBOX_SQUARES[from_sq] | code << MOVE_PIECE_SHIFT, targets & ~us, moves, n)
+
+    n = add_castling_moves(position, color, moves, n)
+    buffer.count = n
+    return n
+
+
+def generate_legal_moves(position: BitboardPosition) -> List[Move]:
+    buffer = app.MoveBuffer()
+    n = generate_pseudo_legal_moves(position, buffer)
+    legal_moves: List[Move] = []
+    color = position.to_move
+    for move in buffer.moves[:n]:
+        undo = position.make_move(move)
+        if not is_check(position, color):
+            legal_moves.append(move)
+        position.unmake_move(undo)
+    return legal_moves
+
+
+def generate_moves(position: BitboardPosition) -> List[BitboardPosition]:
+    new_positions = []
+    for move in generate_legal_moves(position):
+        new_position = position.copy()
+        new_position.make_move(move)
+        new_positions.append(new_position)
+    return new_positions
+
+
+def generate_moves_test(position: BitboardPosition, cur_depth: int, depth: int, move_counts: List[int], buffers: List[app.MoveBuffer] | None = None):
+    """
+    Count the legal moves at every depth into move_counts, like app.generate_moves_test
+    """
+    if cur_depth == depth:
+        return
+    if buffers is None:
+        buffers = app.new_move_buffers()
+
+    buffer = buffers[cur_depth]
+    n = generate_pseudo_legal_moves(position, buffer)
+    moves = buffer.moves
+    color = position.to_move
+    for i in range(n):
+        undo = position.make_move(moves[i])
+        if not is_check(position, color):
+            move_counts[cur_depth] += 1
+            generate_moves_test(position, cur_depth + 1, depth, move_counts, buffers)
+        position.unmake_move(undo)
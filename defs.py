@@ -2,6 +2,7 @@ from enum import Enum
 from typing import Tuple
 
 Point = Tuple[int, int]
+Move = int
 
 """
     Example Piece: 0b11000101
@@ -87,6 +88,79 @@ def pawn_did_double_move(pawn: int) -> bool:
     return pawn & EN_PASSANT != 0
 
 
+"""
+    Moves are packed into a single int, squares are indexes into the 12x12 board (row * 12 + col)
+    0-7 bit: From square
+    8-15 bit: To square
+    16-19 bit: Moved piece code
+    20-23 bit: Captured piece code, 0 if nothing is captured
+    24-26 bit: Promotion piece identifier, 0 if no promotion
+    27-29 bit: Flags, castle / en passant / pawn double push
+    Piece codes are the piece identifier with the 4th bit set for white pieces
+"""
+
+BOARD_WIDTH = 12
+# (row, col) of every square index, shared so moves don't allocate new tuples
+SQUARE_CORDS = [divmod(i, BOARD_WIDTH) for i in range(BOARD_WIDTH * BOARD_WIDTH)]
+
+MOVE_TO_SHIFT = 8
+MOVE_PIECE_SHIFT = 16
+MOVE_CAPTURED_SHIFT = 20
+MOVE_PROMOTION_SHIFT = 24
+
+SQUARE_MASK = 0xFF
+PIECE_CODE_MASK = 0x0F
+MOVE_CAPTURED_MASK = PIECE_CODE_MASK << MOVE_CAPTURED_SHIFT
+MOVE_PROMOTION_MASK = PIECE_MASK << MOVE_PROMOTION_SHIFT
+
+MOVE_CASTLE = 1 << 27
+MOVE_EN_PASSANT = 1 << 28
+MOVE_DOUBLE_PUSH = 1 << 29
+
+NULL_MOVE = 0
+
+
+def square_index(row: int, col: int) -> int:
+    return row * BOARD_WIDTH + col
+
+
+def piece_code(piece: int) -> int:
+    return (piece & PIECE_MASK) | ((piece & COLOR_MASK) >> 4)
+
+
+def piece_from_code(code: int) -> int:
+    return (code & PIECE_MASK) | ((code & 0b1000) << 4)
+
+
+def encode_move(from_cords: Point, to_cords: Point, piece: int, captured: int = EMPTY, promotion: int = EMPTY, flags: int = 0) -> Move:
+    return (square_index(from_cords[0], from_cords[1])
+            | square_index(to_cords[0], to_cords[1]) << MOVE_TO_SHIFT
+            | piece_code(piece) << MOVE_PIECE_SHIFT
+            | piece_code(captured) << MOVE_CAPTURED_SHIFT
+            | promotion << MOVE_PROMOTION_SHIFT
+            | flags)
+
+
+def move_from(move: Move) -> Point:
+    return divmod(move & SQUARE_MASK, BOARD_WIDTH)
+
+
+def move_to(move: Move) -> Point:
+    return divmod((move >> MOVE_TO_SHIFT) & SQUARE_MASK, BOARD_WIDTH)
+
+
+def move_piece(move: Move) -> int:
+    return piece_from_code((move >> MOVE_PIECE_SHIFT) & PIECE_CODE_MASK)
+
+
+def move_captured(move: Move) -> int:
+    return piece_from_code((move >> MOVE_CAPTURED_SHIFT) & PIECE_CODE_MASK)
+
+
+def move_promotion(move: Move) -> int:
+    return (move >> MOVE_PROMOTION_SHIFT) & PIECE_MASK
+
+
 class CastlingType(Enum):
     WHITE_KING_SIDE = 1
     WHITE_QUEEN_SIDE = 2
@@ -178,3 +252,12 @@ def board_position_to_algebraic_pair(pair: Point) -> str:
         col = "h"
 
     return f"{col}{row}"
+
+
+PROMOTION_CHARACTERS = {KNIGHT: "n", BISHOP: "b", ROOK: "r", QUEEN: "q"}
+
+
+def move_to_algebraic(move: Move) -> str:
+    promotion = move_promotion(move)
+    suffix = PROMOTION_CHARACTERS[promotion] if promotion != EMPTY else ""
+    return f"{board_position_to_algebraic_pair(move_from(move))}{board_position_to_algebraic_pair(move_to(move))}{suffix}"
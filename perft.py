@@ -0,0 +1,255 @@
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from app import Chess, MoveBuffer, board_from_fen, board_to_fen, generate_checked_legal_moves, new_move_buffers
+from defs import DEFAULT_POSITION, Move, move_to_algebraic
+from transposition import DEFAULT_HASH_MB
+
+"""
+    Perft: count the leaves of the legal move tree to a fixed depth, the standard check of a move generator.
+    usage:
+        python perft.py perft <depth> [fen]
+        python perft.py divide <depth> [fen]
+        python perft.py suite [max depth] [epd file]
+        python perft.py speedup <depth> [fen]
+    perft, divide and speedup take --workers <n> to spread the tree over n processes (default 1, 0 for one per core)
+    and --split <1|2> to hand out the subtrees below the root moves or below every reply to them.
+    Leaves are counted in bulk, the last ply adds the number of legal moves without playing them.
+    Subtree counts are cached by (zobrist key, depth), transpositions are counted once.
+"""
+
+PERFT_SUITE = "perftsuite.epd"
+
+# bytes per slot: key (8), count (8) and depth (1)
+PERFT_ENTRY_SIZE = 17
+
+
+class PerftCache:
+    """
+    Subtree counts in flat arrays, one slot per (key, depth) hash, always replaced
+    """
+    def __init__(self, size_mb: int = DEFAULT_HASH_MB):
+        entries = max(1, size_mb * 1024 * 1024 // PERFT_ENTRY_SIZE)
+        self.entries = 1 << (entries.bit_length() - 1)
+        self.mask = self.entries - 1
+        self.keys = array('Q', [0]) * self.entries
+        self.counts = array('Q', [0]) * self.entries
+        self.depths = array('B', [0]) * self.entries
+        self.hits = 0
+
+    def slot(self, key: int, depth: int) -> int:
+        # spread the depths of one position over different slots
+        return (key ^ (depth * 0x9E3779B97F4A7C15)) & self.mask
+
+    def get(self, key: int, depth: int) -> int | None:
+        slot = self.slot(key, depth)
+        if self.keys[slot] == key and self.depths[slot] == depth:
+            self.hits += 1
+            return self.counts[slot]
+        return None
+
+    def store(self, key: int, depth: int, count: int):
+        slot = self.slot(key, depth)
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.counts[slot] = count
+
+
+def perft(board: Chess, depth: int, cache: PerftCache | None = None, buffers: List[MoveBuffer] | None = None, ply: int = 0) -> int:
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = new_move_buffers()
+    if cache is not None and depth > 1:
+        count = cache.get(board.zobrist_key, depth)
+        if count is not None:
+            return count
+
+    buffer = buffers[ply]
+    n = generate_checked_legal_moves(board, buffer)
+    if depth == 1:
+        return n
+
+    count = 0
+    moves = buffer.moves
+    for i in range(n):
+        undo = board.make_move(moves[i])
+        count += perft(board, depth - 1, cache, buffers, ply + 1)
+        board.unmake_move(undo)
+
+    if cache is not None:
+        cache.store(board.zobrist_key, depth, count)
+    return count
+
+
+def divide(board: Chess, depth: int, cache: PerftCache | None = None) -> List[Tuple[Move, int]]:
+    """
+    The perft count below every root move, to find which move a generator gets wrong
+    """
+    buffers = new_move_buffers()
+    n = generate_checked_legal_moves(board, buffers[0])
+    counts = []
+    for move in buffers[0].moves[:n]:
+        undo = board.make_move(move)
+        counts.append((move, perft(board, depth - 1, cache, buffers, 1)))
+        board.unmake_move(undo)
+    return counts
+
+
+# the cache of the worker process, it is kept between the subtrees one worker counts
+worker_cache: PerftCache | None = None
+
+
+def init_worker(cache_mb: int):
+    global worker_cache
+    worker_cache = PerftCache(cache_mb) if cache_mb > 0 else None
+
+
+def perft_fen(task: Tuple[str, int]) -> int:
+    """
+    Count one subtree in a worker process, the position travels as a fen rather than a pickled Chess
+    """
+    fen, depth = task
+    return perft(board_from_fen(fen), depth, worker_cache)
+
+
+def parallel_divide(board: Chess, depth: int, workers: int, split_depth: int = 1, cache_mb: int = DEFAULT_HASH_MB) -> List[Tuple[Move, int]]:
+    """
+    divide with the subtrees counted by a pool of worker processes.
+    With split_depth 2 every reply to a root move is its own task, more and smaller tasks keep the workers evenly busy.
+    """
+    buffers = new_move_buffers()
+    n = generate_checked_legal_moves(board, buffers[0])
+    root_moves = list(buffers[0].moves[:n])
+    split_depth = max(1, min(split_depth, depth - 1))
+
+    # (index of the root move, fen) for every position split_depth plies down
+    tasks: List[Tuple[int, str]] = []
+    for i, move in enumerate(root_moves):
+        undo = board.make_move(move)
+        if split_depth == 1:
+            tasks.append((i, board_to_fen(board)))
+        else:
+            replies = generate_checked_legal_moves(board, buffers[1])
+            for reply in buffers[1].moves[:replies]:
+                reply_undo = board.make_move(reply)
+                tasks.append((i, board_to_fen(board)))
+                board.unmake_move(reply_undo)
+        board.unmake_move(undo)
+
+    counts = [0] * len(root_moves)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_mb // workers,)) as pool:
+        results = pool.map(perft_fen, [(fen, depth - split_depth) for _, fen in tasks], chunksize=1)
+        for (i, _), count in zip(tasks, results):
+            counts[i] += count
+    return list(zip(root_moves, counts))
+
+
+def read_epd(filename: str) -> List[Tuple[str, List[int]]]:
+    """
+    Read a perft suite, one position per line: '<fen> ;D1 <count> ;D2 <count> ...'
+    A fen without move counters gets '0 1'.
+    """
+    positions = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(';')
+            fen = fields[0].strip()
+            if len(fen.split()) == 4:
+                fen += " 0 1"
+            counts = [int(field.split()[1]) for field in fields[1:]]
+            positions.append((fen, counts))
+    return positions
+
+
+def run_suite(filename: str = PERFT_SUITE, max_depth: int = 4, cache_mb: int = DEFAULT_HASH_MB) -> bool:
+    """
+    Run every position of the suite up to max_depth, printing counts, time and nodes per second.
+    Returns True if every count matched.
+    """
+    passed = True
+    total_nodes = 0
+    start = time.monotonic()
+    for fen, counts in read_epd(filename):
+        for depth, expected in enumerate(counts[:max_depth], 1):
+            cache = PerftCache(cache_mb) if cache_mb > 0 else None
+            board = board_from_fen(fen)
+            position_start = time.monotonic()
+            nodes = perft(board, depth, cache)
+            seconds = time.monotonic() - position_start
+            total_nodes += nodes
+            ok = nodes == expected
+            passed = passed and ok
+            print(f"{fen:<80} {depth:>2} {nodes:>12} {'ok' if ok else f'FAIL {expected}':>6} {seconds:>8.2f}s {nodes / max(seconds, 1e-9):>10.0f} nps")
+    seconds = time.monotonic() - start
+    print(f"total {total_nodes} nodes in {seconds:.2f}s, {total_nodes / max(seconds, 1e-9):.0f} nps, {'passed' if passed else 'FAILED'}")
+    return passed
+
+
+def count_nodes(fen: str, depth: int, workers: int, split_depth: int) -> Tuple[List[Tuple[Move, int]], float]:
+    """
+    Run divide serially or over workers processes, returns the counts and the seconds they took
+    """
+    board = board_from_fen(fen)
+    start = time.monotonic()
+    if workers > 1 and depth > 1:
+        counts = parallel_divide(board, depth, workers, split_depth)
+    else:
+        counts = divide(board, depth, PerftCache())
+    return counts, time.monotonic() - start
+
+
+def print_perft(fen: str, depth: int, split: bool, workers: int, split_depth: int):
+    counts, seconds = count_nodes(fen, depth, workers, split_depth)
+    if split:
+        for move, count in counts:
+            print(f"{move_to_algebraic(move)}: {count}")
+        print(f"\nmoves {len(counts)}")
+    nodes = sum(count for _, count in counts)
+    print(f"nodes {nodes}")
+    print(f"time {seconds:.2f}s, {nodes / max(seconds, 1e-9):.0f} nps, {workers} worker{'s' if workers > 1 else ''}")
+
+
+def print_speedup(fen: str, depth: int, workers: int, split_depth: int):
+    serial_counts, serial_seconds = count_nodes(fen, depth, 1, split_depth)
+    parallel_counts, parallel_seconds = count_nodes(fen, depth, workers, split_depth)
+    nodes = sum(count for _, count in serial_counts)
+    print(f"serial    {nodes:>12} nodes {serial_seconds:>8.2f}s")
+    print(f"{workers:>2} workers {sum(count for _, count in parallel_counts):>12} nodes {parallel_seconds:>8.2f}s")
+    print(f"speedup {serial_seconds / max(parallel_seconds, 1e-9):.2f}x on {os.cpu_count()} cores"
+          f"{'' if serial_counts == parallel_counts else ', COUNTS DIFFER'}")
+
+
+def pop_option(args: List[str], name: str, default: int) -> int:
+    if name in args:
+        i = args.index(name)
+        value = int(args[i + 1])
+        del args[i:i + 2]
+        return value
+    return default
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers = pop_option(args, "--workers", 1) or os.cpu_count()
+    split_depth = pop_option(args, "--split", 1)
+    command = args[0] if args else "perft"
+    if command in ("perft", "divide", "speedup"):
+        depth = int(args[1]) if len(args) > 1 else 4
+        fen = " ".join(args[2:]) or DEFAULT_POSITION
+        if command == "speedup":
+            print_speedup(fen, depth, workers, split_depth)
+        else:
+            print_perft(fen, depth, command == "divide", workers, split_depth)
+    elif command == "suite":
+        max_depth = int(args[1]) if len(args) > 1 else 4
+        sys.exit(0 if run_suite(args[2] if len(args) > 2 else PERFT_SUITE, max_depth) else 1)
+    else:
+        print(f"unknown command {command}, expected perft, divide, suite or speedup")
+        sys.exit(1)
@@ -1,8 +1,93 @@
 import cProfile
-from app import board_from_fen, generate_moves_test
+import os
+import sys
+import time
+import app
+import bitboard
+from app import board_from_fen, generate_moves_test, iterative_deepening_search, lazy_smp_search, new_search_state, close_search_state, SearchLimits, SearchState
+from defs import DEFAULT_POSITION, KIWI_PETE, POSITION_3, move_to_algebraic
+from transposition import TranspositionTable
+
+# the positions of test_perft.py
+PERFT_POSITIONS = [
+    DEFAULT_POSITION,
+    KIWI_PETE,
+    POSITION_3,
+    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+]
+
+
+def move_ordering_report(depth: int):
+    """
+    Print the nodes needed to reach depth with and without move ordering, and how often the first move cut off.
+    The quiescence search is left out, unordered it explodes and would hide the main search numbers.
+    """
+    print(f"{'position':<72} {'ordering':>8} {'nodes':>9} {'first cut %':>11} {'seconds':>8}")
+    for fen in PERFT_POSITIONS:
+        for order_moves in (False, True):
+            board = board_from_fen(fen)
+            search = SearchState(TranspositionTable(), order_moves, quiescence=False)
+            start = time.monotonic()
+            iterative_deepening_search(board, SearchLimits(depth=depth), search)
+            seconds = time.monotonic() - start
+            first_cut = 100 * search.first_move_cutoffs / max(1, search.beta_cutoffs)
+            print(f"{fen:<72} {'on' if order_moves else 'off':>8} {search.nodes:>9} {first_cut:>11.1f} {seconds:>8.2f}")
+
+
+# move generation backends, each module has board_from_fen and generate_moves_test
+BACKENDS = {
+    "mailbox": app,
+    "bitboard": bitboard,
+}
 
-if __name__ == "__main__":
-    move_states = [0] * 5
-    b = board_from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
-    cProfile.run("generate_moves_test(b, 0, 3, move_states)")
 
+def backend_report(depth: int, backends: list):
+    """
+    Print the perft count and speed of every backend on the perft positions, the counts have to agree
+    """
+    print(f"{'position':<72} {'backend':>8} {'nodes':>9} {'nps':>9} {'seconds':>8}")
+    for fen in PERFT_POSITIONS:
+        for name in backends:
+            backend = BACKENDS[name]
+            move_counts = [0] * (depth + 1)
+            board = backend.board_from_fen(fen)
+            start = time.monotonic()
+            backend.generate_moves_test(board, 0, depth, move_counts)
+            seconds = time.monotonic() - start
+            nodes = sum(move_counts)
+            print(f"{fen:<72} {name:>8} {move_counts[depth - 1]:>9} {nodes / max(seconds, 1e-9):>9.0f} {seconds:>8.2f}")
+
+
+def smp_report(depth: int, thread_counts: list):
+    """
+    Print the time to depth of the Lazy SMP search for every thread count, each run starts from an empty table
+    """
+    print(f"{os.cpu_count()} cores")
+    print(f"{'position':<72} {'threads':>7} {'move':>6} {'score':>7} {'seconds':>8} {'speedup':>7}")
+    for fen in PERFT_POSITIONS:
+        base = None
+        for threads in thread_counts:
+            board = board_from_fen(fen)
+            search = new_search_state(threads)
+            start = time.monotonic()
+            move, score = lazy_smp_search(board, SearchLimits(depth=depth), threads, search)
+            seconds = time.monotonic() - start
+            close_search_state(search)
+            base = base or seconds
+            print(f"{fen:<72} {threads:>7} {move_to_algebraic(move):>6} {score:>7} {seconds:>8.2f} {base / max(seconds, 1e-9):>6.2f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "ordering":
+        move_ordering_report(int(sys.argv[2]) if len(sys.argv) > 2 else 4)
+    elif len(sys.argv) > 1 and sys.argv[1] == "backends":
+        backend_report(int(sys.argv[2]) if len(sys.argv) > 2 else 3, sys.argv[3:] or list(BACKENDS))
+    elif len(sys.argv) > 1 and sys.argv[1] == "smp":
+        smp_report(int(sys.argv[2]) if len(sys.argv) > 2 else 4, [int(n) for n in sys.argv[3:]] or [1, 2, 4, 8])
+    else:
+        move_states = [0] * 5
+        b = board_from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+        cProfile.run("generate_moves_test(b, 0, 3, move_states)")
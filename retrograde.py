@@ -0,0 +1,247 @@
+import os
+import sys
+import time
+from array import array
+from itertools import product
+from typing import Callable, List
+from app import Chess, MoveBuffer, board_from_fen, generate_checked_legal_moves, generate_move_for_piece, is_check
+from bitbase import BITBASE_DIRECTORY, BITBASE_DRAW, BITBASE_WIN, BITBASE_LOSS, BITBASE_INVALID, MAX_PIECES, MAILBOX_SQUARES, BITBASE_SQUARES, PIECE_LETTERS, \
+    Bitbases, material_name, material_pieces, table_size
+from defs import WHITE, BLACK, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, COLOR_MASK, PIECE_MASK, SQUARE_CORDS, SQUARE_MASK, \
+    MOVE_TO_SHIFT, MOVE_CAPTURED_MASK, MOVE_PROMOTION_MASK, piece_code
+
+"""
+    Generate endgame bitbases by retrograde analysis with the engine's own move generator.
+    usage:
+        python retrograde.py [directory] [configuration...]
+    with the configurations named like KQvK, KRvK or KPvK, by default every configuration of three pieces.
+    The configurations a capture or a promotion leads to are generated first, they are looked up rather than searched.
+
+    1. Every position is set up on one board and its legal moves generated. Mates are lost, stalemates drawn,
+       a capture or promotion into a won, drawn or lost configuration is looked up, the other moves are counted.
+    2. From every lost position the positions it is reached from are won, from every won position their count of
+       unresolved moves drops and a position whose moves all reach won positions is lost. The moves a position
+       is reached from are the moves of the same pieces on the reached board, a piece moves back along the lines
+       it moves forward on, a pawn steps back.
+    3. What is left is a draw.
+    En passant is not tracked: with pawns on both sides a double push next to an enemy pawn is scored as if it
+    could not be taken. Every position is stored, symmetries are not used.
+
+    A configuration of three pieces takes 15 to 30 seconds on one core and 128KB, one of four pieces has 64 times
+    the positions, takes about as many times longer and 8MB.
+"""
+
+THREE_PIECES = ["KQvK", "KRvK", "KBvK", "KNvK", "KPvK"]
+
+# generation only states of a position, a position with a drawn or unknown move can't be lost
+UNKNOWN = 4
+CANT_LOSE = 5
+
+PROMOTION_LETTERS = [PIECE_LETTERS[piece] for piece in (QUEEN, ROOK, BISHOP, KNIGHT)]
+
+
+def dependencies(name: str) -> List[str]:
+    """
+    The configurations one capture or promotion away from name, bare kings left out
+    """
+    white, black = name.split("v")
+    names = set()
+    for side, other, swap in ((white, black, False), (black, white, True)):
+        for i, letter in enumerate(side):
+            if letter == "K":
+                continue
+            rest = side[:i] + side[i + 1:]
+            changed = [rest] + ([rest + promotion for promotion in PROMOTION_LETTERS] if letter == "P" else [])
+            # a capture of this piece by the other side
+            names.add(material_name(other, rest) if swap else material_name(rest, other))
+            for side_after in changed[1:]:
+                names.add(material_name(other, side_after) if swap else material_name(side_after, other))
+    return sorted(child for child, _ in names if child != "KvK")
+
+
+def clear_board() -> Chess:
+    board = board_from_fen("8/8/8/8/8/8/8/8 w - - 0 1")
+    board.white_king_side_castle = board.white_queen_side_castle = False
+    board.black_king_side_castle = board.black_queen_side_castle = False
+    board.pawn_double_move = None
+    return board
+
+
+def place(board: Chess, pieces: List[int], squares, to_move: int):
+    """
+    Take the pieces of the previous position off board and put pieces on squares
+    """
+    state = board.state
+    piece_squares = board.piece_squares
+    # only pieces of the configuration are ever on the board
+    for piece in pieces:
+        indexes = piece_squares[piece_code(piece)]
+        for index in indexes:
+            row, col = SQUARE_CORDS[index]
+            state[row][col] = EMPTY
+        indexes.clear()
+    for piece, square in zip(pieces, squares):
+        index = MAILBOX_SQUARES[square]
+        row, col = SQUARE_CORDS[index]
+        state[row][col] = piece
+        piece_squares[piece_code(piece)].add(index)
+        if piece == WHITE | KING:
+            board.white_king_location = (row, col)
+        elif piece == BLACK | KING:
+            board.black_king_location = (row, col)
+    board.to_move = to_move
+
+
+def is_empty_square(board: Chess, square: int) -> bool:
+    row, col = SQUARE_CORDS[MAILBOX_SQUARES[square]]
+    return board.state[row][col] == EMPTY
+
+
+def pawn_retractions(board: Chess, piece: int, square: int) -> List[int]:
+    """
+    The squares a pawn on square came from with a push
+    """
+    step = -8 if piece & COLOR_MASK == WHITE else 8
+    double_rank = 3 if piece & COLOR_MASK == WHITE else 4
+    behind = square + step
+    if not 8 <= behind < 56 or not is_empty_square(board, behind):
+        return []
+    if square // 8 == double_rank and is_empty_square(board, behind + step):
+        return [behind, behind + step]
+    return [behind]
+
+
+def generate(name: str, directory: str = BITBASE_DIRECTORY, out: Callable[[str], None] = print) -> str:
+    """
+    Write the bitbase of configuration name to directory, after the configurations it depends on. Returns the file name.
+    """
+    pieces = material_pieces(name)
+    if material_name(name.split("v")[0], name.split("v")[1])[0] != name or len(pieces) > MAX_PIECES:
+        raise ValueError(f"{name} is not a configuration of at most {MAX_PIECES} pieces, strongest side first")
+    filename = os.path.join(directory, f"{name}.bin")
+    if os.path.exists(filename):
+        return filename
+    os.makedirs(directory, exist_ok=True)
+    for child in dependencies(name):
+        generate(child, directory, out)
+    bitbases = Bitbases(directory)
+    start = time.monotonic()
+
+    n = len(pieces)
+    positions = 64 ** n
+    size = table_size(n)
+    values = bytearray([UNKNOWN]) * size
+    remaining = bytearray(size)
+    resolved = array('I')
+    board = clear_board()
+    buffer = MoveBuffer()
+    moves = buffer.moves
+    no_pawn_rank = [square < 8 or square >= 56 for square in range(64)]
+    pawn_slots = [i for i, piece in enumerate(pieces) if piece & PIECE_MASK == PAWN]
+    powers = [64 ** (n - 1 - i) for i in range(n)]
+
+    # 1. every position forward once
+    for side, to_move in enumerate((WHITE, BLACK)):
+        other = BLACK if to_move == WHITE else WHITE
+        index = side * positions - 1
+        for squares in product(range(64), repeat=n):
+            index += 1
+            if len(set(squares)) < n or any(no_pawn_rank[squares[i]] for i in pawn_slots):
+                values[index] = BITBASE_INVALID
+                continue
+            place(board, pieces, squares, to_move)
+            if is_check(board, other):
+                values[index] = BITBASE_INVALID
+                continue
+            count = generate_checked_legal_moves(board, buffer)
+            if count == 0:
+                values[index] = BITBASE_LOSS if is_check(board, to_move) else BITBASE_DRAW
+                if values[index] == BITBASE_LOSS:
+                    resolved.append(index)
+                continue
+            unresolved = 0
+            value = UNKNOWN
+            for i in range(count):
+                move = moves[i]
+                if move & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK):
+                    undo = board.make_move(move)
+                    result = bitbases.probe(board)
+                    board.unmake_move(undo)
+                    if result == BITBASE_LOSS:
+                        value = BITBASE_WIN
+                        break
+                    if result != BITBASE_WIN:
+                        value = CANT_LOSE
+                else:
+                    unresolved += 1
+            if value == BITBASE_WIN:
+                values[index] = BITBASE_WIN
+                resolved.append(index)
+            elif unresolved == 0:
+                values[index] = BITBASE_DRAW if value == CANT_LOSE else BITBASE_LOSS
+                if values[index] == BITBASE_LOSS:
+                    resolved.append(index)
+            else:
+                values[index] = value
+                remaining[index] = unresolved
+
+    # 2. back from every won or lost position to the positions that reach it
+    while resolved:
+        index = resolved.pop()
+        value = values[index]
+        side, rest = divmod(index, positions)
+        squares = []
+        for power in powers:
+            square, rest = divmod(rest, power)
+            squares.append(square)
+        mover = BLACK if side == 0 else WHITE
+        mover_side = side ^ 1
+        place(board, pieces, squares, mover)
+        for slot, piece in enumerate(pieces):
+            if piece & COLOR_MASK != mover:
+                continue
+            square = squares[slot]
+            if piece & PIECE_MASK == PAWN:
+                origins = pawn_retractions(board, piece, square)
+            else:
+                row, col = SQUARE_CORDS[MAILBOX_SQUARES[square]]
+                count = generate_move_for_piece(board, row, col, piece, moves, 0)
+                origins = [BITBASE_SQUARES[(moves[i] >> MOVE_TO_SHIFT) & SQUARE_MASK] for i in range(count) if not moves[i] & MOVE_CAPTURED_MASK]
+            base = mover_side * positions + sum(s * p for s, p in zip(squares, powers)) - square * powers[slot]
+            for origin in origins:
+                previous = base + origin * powers[slot]
+                state = values[previous]
+                if state != UNKNOWN and state != CANT_LOSE:
+                    continue
+                if value == BITBASE_LOSS:
+                    values[previous] = BITBASE_WIN
+                    resolved.append(previous)
+                else:
+                    remaining[previous] -= 1
+                    if remaining[previous] == 0:
+                        values[previous] = BITBASE_DRAW if state == CANT_LOSE else BITBASE_LOSS
+                        if state != CANT_LOSE:
+                            resolved.append(previous)
+
+    # 3. the rest is drawn, four positions to the byte
+    data = bytearray(size // 4)
+    counts = [0] * 4
+    for index in range(size):
+        value = values[index]
+        if value == UNKNOWN or value == CANT_LOSE:
+            value = BITBASE_DRAW
+        counts[value] += 1
+        data[index >> 2] |= value << ((index & 3) * 2)
+    with open(filename + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(filename + ".tmp", filename)
+    bitbases.close()
+    out(f"{name}: {counts[BITBASE_WIN]} won, {counts[BITBASE_DRAW]} drawn, {counts[BITBASE_LOSS]} lost, "
+        f"{counts[BITBASE_INVALID]} invalid in {time.monotonic() - start:.1f}s")
+    return filename
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else BITBASE_DIRECTORY
+    for name in sys.argv[2:] or THREE_PIECES:
+        generate(name, directory)
@@ -1,6 +1,12 @@
+import copy
+import json
+import os
+import tempfile
 import unittest
-from app import Chess, board_from_fen
-from defs import is_white, is_black, WHITE, BLACK, KNIGHT, BISHOP, ROOK, QUEEN, KING, PAWN, is_pawn, is_knight, is_bishop, is_rook, is_queen, is_king, is_empty, is_outside_board, EMPTY, SENTINEL, has_moved, MOVED_MASK, pawn_did_double_move, EN_PASSANT, algebraic_pairs_to_board_position, BOARD_START, BOARD_END, board_position_to_algebraic_pair
+from unittest import mock
+from app import Chess, board_from_fen, board_to_fen, generate_legal_moves, compute_piece_squares, bench, BENCH_POSITIONS, SETTINGS
+from defs import is_white, is_black, WHITE, BLACK, KNIGHT, BISHOP, ROOK, QUEEN, KING, PAWN, is_pawn, is_knight, is_bishop, is_rook, is_queen, is_king, is_empty, is_outside_board, EMPTY, SENTINEL, has_moved, MOVED_MASK, pawn_did_double_move, EN_PASSANT, algebraic_pairs_to_board_position, BOARD_START, BOARD_END, board_position_to_algebraic_pair, KIWI_PETE
+from defs import encode_move, move_from, move_to, move_piece, move_captured, move_promotion, move_to_algebraic, MOVE_CASTLE, MOVE_EN_PASSANT, MOVE_DOUBLE_PUSH
 
 
 class TestChessClass(unittest.TestCase):
@@ -146,6 +152,17 @@ class TestChessClass(unittest.TestCase):
         self.assertEqual(b.state[9][6], WHITE | KNIGHT)
         self.assertEqual(b.state[9][8], BLACK | BISHOP)
 
+    def test_fen_round_trip(self):
+        for fen in ["rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                    "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1"]:
+            self.assertEqual(board_to_fen(board_from_fen(fen)), fen)
+
+        b = board_from_fen("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+        b.make_move([m for m in generate_legal_moves(b) if move_to_algebraic(m) == "e2e4"][0])
+        self.assertEqual(board_to_fen(b), "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1")
+
     def test_bad_fen_string(self):
         with self.assertRaises(ValueError):
             b = board_from_fen('this is bad string')
@@ -206,6 +223,151 @@ class TestChessClass(unittest.TestCase):
         self.assertTrue(has_moved(WHITE | PAWN | MOVED_MASK))
         self.assertTrue(not has_moved(WHITE | PAWN))
 
+    def test_move_encoding_round_trip(self):
+        move = encode_move((3, 4), (2, 5), WHITE | PAWN, BLACK | ROOK, QUEEN)
+        self.assertEqual(move_from(move), (3, 4))
+        self.assertEqual(move_to(move), (2, 5))
+        self.assertEqual(move_piece(move), WHITE | PAWN)
+        self.assertEqual(move_captured(move), BLACK | ROOK)
+        self.assertEqual(move_promotion(move), QUEEN)
+        self.assertEqual(move_to_algebraic(move), "c7d8q")
+        self.assertLess(move, 1 << 32)
+
+        move = encode_move((2, 6), (2, 8), BLACK | KING, flags=MOVE_CASTLE)
+        self.assertEqual(move_piece(move), BLACK | KING)
+        self.assertEqual(move_captured(move), EMPTY)
+        self.assertTrue(move & MOVE_CASTLE)
+        self.assertFalse(move & MOVE_EN_PASSANT)
+        self.assertEqual(move_to_algebraic(move), "e8g8")
+
+    def test_make_unmake_restores_position(self):
+        b = board_from_fen(
+            "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1")
+        before = dict(b.__dict__)
+        before_state = [row[:] for row in b.state]
+        for move in generate_legal_moves(b):
+            undo = b.make_move(move)
+            for reply in generate_legal_moves(b):
+                b.unmake_move(b.make_move(reply))
+            b.unmake_move(undo)
+            self.assertEqual(b.state, before_state)
+            for key in ["to_move", "white_king_location", "black_king_location", "white_king_side_castle", "white_queen_side_castle", "black_king_side_castle", "black_queen_side_castle", "pawn_double_move", "half_move_clock", "full_move_clock", "white_total_piece_value", "black_total_piece_value"]:
+                self.assertEqual(b.__dict__[key], before[key])
+
+    def test_piece_lists_follow_moves(self):
+        # castling, en passant and promotions with and without captures all move pieces between lists
+        for fen in ["r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                    "7k/8/8/3pP3/8/8/8/7K w - d6 0 1"]:
+            b = board_from_fen(fen)
+            before = compute_piece_squares(b)
+            for move in generate_legal_moves(b):
+                undo = b.make_move(move)
+                self.assertEqual(b.piece_squares, compute_piece_squares(b))
+                for reply in generate_legal_moves(b):
+                    reply_undo = b.make_move(reply)
+                    self.assertEqual(b.piece_squares, compute_piece_squares(b))
+                    b.unmake_move(reply_undo)
+                b.unmake_move(undo)
+                self.assertEqual(b.piece_squares, before)
+
+    def test_zobrist_key_transpositions(self):
+        b = board_from_fen()
+        start_key = b.zobrist_key
+        b.make_move(encode_move((9, 3), (7, 4), WHITE | KNIGHT))
+        b.make_move(encode_move((2, 3), (4, 4), BLACK | KNIGHT))
+        b.make_move(encode_move((7, 4), (9, 3), WHITE | KNIGHT))
+        b.make_move(encode_move((4, 4), (2, 3), BLACK | KNIGHT))
+        self.assertEqual(b.zobrist_key, start_key)
+
+        b = board_from_fen()
+        b.make_move(encode_move((8, 6), (6, 6), WHITE | PAWN, flags=MOVE_DOUBLE_PUSH))
+        self.assertEqual(b.zobrist_key, board_from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1").zobrist_key)
+        self.assertNotEqual(b.zobrist_key, board_from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1").zobrist_key)
+        self.assertNotEqual(b.zobrist_key, board_from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 1").zobrist_key)
+        self.assertNotEqual(b.zobrist_key, board_from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b Kkq e3 0 1").zobrist_key)
+
+    def test_make_move_castling(self):
+        b = board_from_fen(
+            "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+        b.make_move(encode_move((9, 6), (9, 8), WHITE | KING, flags=MOVE_CASTLE))
+        self.assertEqual(b.state[9][8], WHITE | KING)
+        self.assertEqual(b.state[9][7], WHITE | ROOK)
+        self.assertEqual(b.state[9][9], EMPTY)
+        self.assertEqual(b.white_king_location, (9, 8))
+        self.assertTrue(not b.white_king_side_castle)
+        self.assertTrue(not b.white_queen_side_castle)
+        self.assertTrue(b.black_king_side_castle)
+        self.assertEqual(b.to_move, BLACK)
+
+    def test_make_move_en_passant(self):
+        b = board_from_fen("7k/8/8/3pP3/8/8/8/7K w - d6 0 1")
+        undo = b.make_move(encode_move((5, 6), (4, 5), WHITE | PAWN, BLACK | PAWN, flags=MOVE_EN_PASSANT))
+        self.assertEqual(b.state[4][5], WHITE | PAWN)
+        self.assertEqual(b.state[5][5], EMPTY)
+        self.assertEqual(b.black_total_piece_value, 20000)
+        b.unmake_move(undo)
+        self.assertEqual(b.state[5][5], BLACK | PAWN)
+        self.assertEqual(b.state[5][6], WHITE | PAWN)
+        self.assertEqual(b.pawn_double_move, (4, 5))
+
+    def test_make_move_double_push_sets_en_passant(self):
+        b = board_from_fen()
+        b.make_move(encode_move((8, 6), (6, 6), WHITE | PAWN, flags=MOVE_DOUBLE_PUSH))
+        self.assertEqual(b.pawn_double_move, (7, 6))
+        b.make_move(encode_move((2, 3), (4, 4), BLACK | KNIGHT))
+        self.assertIsNone(b.pawn_double_move)
+        self.assertEqual(b.full_move_clock, 2)
+        self.assertEqual(b.half_move_clock, 1)
+
+    def test_make_move_promotion(self):
+        b = board_from_fen("7k/P7/8/8/8/8/8/7K w - - 0 1")
+        undo = b.make_move(encode_move((3, 2), (2, 2), WHITE | PAWN, promotion=KNIGHT))
+        self.assertEqual(b.state[2][2], WHITE | KNIGHT)
+        self.assertEqual(b.white_total_piece_value, 20320)
+        b.unmake_move(undo)
+        self.assertEqual(b.state[3][2], WHITE | PAWN)
+        self.assertEqual(b.white_total_piece_value, 20100)
+
+
+
+class TestSettings(unittest.TestCase):
+    def test_positions_share_the_settings(self):
+        with mock.patch("builtins.open", side_effect=AssertionError("settings read again")):
+            b = board_from_fen(KIWI_PETE)
+            self.assertIs(b.settings, SETTINGS)
+            self.assertIs(copy.deepcopy(b).settings, SETTINGS)
+            self.assertIs(Chess().settings, SETTINGS)
+        self.assertNotIn("directions", vars(b))
+
+    def test_settings_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            SETTINGS.fen = ""
+        with self.assertRaises(TypeError):
+            SETTINGS.directions["P"] = ()
+        with self.assertRaises(TypeError):
+            SETTINGS.pst[0] = 0
+
+    def test_string_board_is_built_from_the_settings(self):
+        b = Chess()
+        self.assertEqual(b.side, 0)
+        self.assertEqual(b.board.count("P"), 8)
+        self.assertEqual(b.evaluate(), 0)
+
+
+class TestBench(unittest.TestCase):
+    def test_bench_is_repeatable(self):
+        with tempfile.TemporaryDirectory() as directory:
+            json_file = os.path.join(directory, "bench.json")
+            report = bench(1, 1, json_file, out=lambda line: None)
+            with open(json_file, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), json.loads(json.dumps(report)))
+
+        self.assertEqual(len(report["positions"]), len(BENCH_POSITIONS))
+        self.assertEqual(report["positions"][0]["perft_nodes"], 20)
+        self.assertEqual(report["perft"]["nodes"], sum(len(generate_legal_moves(board_from_fen(fen))) for fen in BENCH_POSITIONS))
+        self.assertEqual(bench(1, 1, None, out=lambda line: None)["signature"], report["signature"])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from app import board_from_fen, get_evaluation, LATE_GAME_MOVE
+from batcheval import np, board_codes, boards_to_batch, evaluate_batch, random_positions, SCORE_TABLE, LATE_GAME_SCORE_TABLE
+from defs import DEFAULT_POSITION, KIWI_PETE
+
+
+class TestBatchEval(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.boards = random_positions(500)
+
+    def test_board_codes(self):
+        codes = board_codes(board_from_fen(DEFAULT_POSITION))
+        self.assertEqual(list(codes[:8]), [4, 2, 3, 5, 6, 3, 2, 4])
+        self.assertEqual(list(codes[8:16]), [1] * 8)
+        self.assertEqual(list(codes[16:48]), [0] * 32)
+        self.assertEqual(list(codes[48:56]), [9] * 8)
+        self.assertEqual(list(codes[56:]), [12, 10, 11, 13, 14, 11, 10, 12])
+
+    def test_tables_match_get_evaluation(self):
+        # without numpy: the sum over the table rows is the scalar evaluation
+        self.assertTrue(any(board.full_move_clock > LATE_GAME_MOVE for board in self.boards))
+        for board in self.boards + [board_from_fen(DEFAULT_POSITION), board_from_fen(KIWI_PETE)]:
+            table = LATE_GAME_SCORE_TABLE if board.full_move_clock > LATE_GAME_MOVE else SCORE_TABLE
+            score = sum(table[code][square] for square, code in enumerate(board_codes(board)))
+            self.assertEqual(score, get_evaluation(board))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_evaluate_batch(self):
+        pieces, full_move_clocks = boards_to_batch(self.boards)
+        self.assertEqual(pieces.shape, (len(self.boards), 64))
+        self.assertEqual(evaluate_batch(pieces, full_move_clocks).tolist(), [get_evaluation(board) for board in self.boards])
+
+        # more rows than one chunk and one move number for every row
+        tiled = np.tile(pieces, (40, 1))
+        early = evaluate_batch(tiled, 1)
+        late = evaluate_batch(tiled, LATE_GAME_MOVE + 1)
+        self.assertEqual(len(early), 40 * len(self.boards))
+        self.assertEqual(early[:len(self.boards)].tolist(), early[-len(self.boards):].tolist())
+        board = board_from_fen(KIWI_PETE)
+        board.full_move_clock = LATE_GAME_MOVE + 1
+        self.assertEqual(evaluate_batch(boards_to_batch([board])[0], LATE_GAME_MOVE + 1).tolist(), [get_evaluation(board)])
+        self.assertNotEqual(early.tolist(), late.tolist())
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_bad_batches(self):
+        self.assertEqual(evaluate_batch(np.zeros((0, 64), dtype=np.int8), 1).tolist(), [])
+        with self.assertRaises(ValueError):
+            evaluate_batch(np.zeros((2, 63), dtype=np.int8), 1)
+        with self.assertRaises(ValueError):
+            evaluate_batch(np.zeros(64, dtype=np.int8), 1)
+        with self.assertRaises(ValueError):
+            evaluate_batch(np.full((1, 64), 16, dtype=np.int8), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import sys
+import random
+import tempfile
+import unittest
+from unittest import mock
+from app import UciEngine, board_from_fen, generate_legal_moves, iterative_deepening_search, is_check, SearchLimits, SearchState, BITBASE_SCORE
+from bitbase import Bitbase, Bitbases, BITBASE_DRAW, BITBASE_WIN, BITBASE_LOSS, BITBASE_INVALID, material_name
+from defs import WHITE, BLACK, DEFAULT_POSITION, move_to_algebraic
+from retrograde import generate, dependencies, clear_board, place
+from transposition import TranspositionTable
+
+
+class TestBitbase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for name in ["KQvK", "KRvK"]:
+            generate(name, cls.directory.name, out=lambda line: None)
+        cls.bitbases = Bitbases(cls.directory.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.bitbases.close()
+        cls.directory.cleanup()
+
+    def probe(self, fen):
+        return self.bitbases.probe(board_from_fen(fen))
+
+    def test_names(self):
+        self.assertEqual(material_name("K", "KQ"), ("KQvK", True))
+        self.assertEqual(material_name("KPR", "KN"), ("KRPvKN", False))
+        self.assertEqual(material_name("KB", "KR"), ("KRvKB", True))
+        self.assertEqual(dependencies("KPvK"), ["KBvK", "KNvK", "KQvK", "KRvK"])
+        self.assertEqual(dependencies("KRvKP"), ["KPvK", "KQvKR", "KRvK", "KRvKB", "KRvKN", "KRvKR"])
+        with self.assertRaises(ValueError):
+            generate("KvKQ", self.directory.name)
+
+    def test_known_positions(self):
+        # mate, stalemate, a queen the king can take and an ordinary win
+        self.assertEqual(self.probe("k7/1Q6/1K6/8/8/8/8/8 b - - 0 1"), BITBASE_LOSS)
+        self.assertEqual(self.probe("k7/8/1QK5/8/8/8/8/8 b - - 0 1"), BITBASE_DRAW)
+        self.assertEqual(self.probe("8/8/8/8/8/8/1Qk5/7K b - - 0 1"), BITBASE_DRAW)
+        self.assertEqual(self.probe("8/8/8/4k3/8/8/8/KQ6 w - - 0 1"), BITBASE_WIN)
+        self.assertEqual(self.probe("8/8/8/4k3/8/8/8/KQ6 b - - 0 1"), BITBASE_LOSS)
+        # black in check with white to move can't happen
+        self.assertIsNone(self.probe("8/8/8/8/8/8/1Qk5/7K w - - 0 1"))
+        # black has the queen, the board is mirrored
+        self.assertEqual(self.probe("7k/1qK5/8/8/8/8/8/8 w - - 0 1"), BITBASE_DRAW)
+        self.assertEqual(self.probe("8/8/8/8/8/8/1q6/K1k5 w - - 0 1"), BITBASE_LOSS)
+        self.assertEqual(self.probe("kq6/8/8/8/4K3/8/8/8 w - - 0 1"), BITBASE_LOSS)
+        self.assertEqual(self.probe("8/8/8/8/3K4/8/8/kq6 b - - 0 1"), BITBASE_WIN)
+
+    def test_not_in_the_bitbases(self):
+        self.assertIsNone(self.probe(DEFAULT_POSITION))
+        self.assertIsNone(self.probe("8/8/8/4k3/8/8/8/KB6 w - - 0 1"))
+        self.assertIsNone(self.probe("4k3/8/8/8/8/8/8/R3K3 w Q - 0 1"))
+        self.assertEqual(self.probe("4k3/8/8/8/8/8/8/4K3 w - - 0 1"), BITBASE_DRAW)
+
+    def test_every_position_agrees_with_its_moves(self):
+        table = self.bitbases.tables["KQvK"]
+        rng = random.Random(1)
+        checked = 0
+        while checked < 2000:
+            index = rng.randrange(2 * table.positions)
+            value = table.get(index)
+            if value == BITBASE_INVALID:
+                continue
+            side, rest = divmod(index, table.positions)
+            squares = [rest // 4096, rest // 64 % 64, rest % 64]
+            board = clear_board()
+            place(board, table.pieces, squares, WHITE if side == 0 else BLACK)
+            results = []
+            for move in generate_legal_moves(board):
+                undo = board.make_move(move)
+                results.append(self.bitbases.probe(board))
+                board.unmake_move(undo)
+            if not results:
+                expected = BITBASE_LOSS if is_check(board, board.to_move) else BITBASE_DRAW
+            elif BITBASE_LOSS in results:
+                expected = BITBASE_WIN
+            elif all(result == BITBASE_WIN for result in results):
+                expected = BITBASE_LOSS
+            else:
+                expected = BITBASE_DRAW
+            self.assertEqual(value, expected, index)
+            checked += 1
+
+    def test_truncated_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "KRvK.bin")
+            with open(filename, "wb") as f:
+                f.write(bytes(100))
+            with self.assertRaises(ValueError):
+                Bitbase(filename)
+
+    def test_search_probes(self):
+        fen = "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+        search = SearchState(TranspositionTable(1))
+        search.bitbases = self.bitbases
+        move, score = iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=2), search)
+        self.assertGreater(search.bitbase_hits, 0)
+        self.assertGreater(score, BITBASE_SCORE - 100000)
+        self.assertIn(move, generate_legal_moves(board_from_fen(fen)))
+        with_bitbases = search.nodes
+
+        search = SearchState(TranspositionTable(1))
+        iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=2), search)
+        self.assertLess(with_bitbases, search.nodes)
+
+        # Qb6 stalemates, one ply is enough to see it
+        search = SearchState(TranspositionTable(1))
+        search.bitbases = self.bitbases
+        move, score = iterative_deepening_search(board_from_fen("k7/8/2K5/1Q6/8/8/8/8 w - - 0 1"), SearchLimits(depth=1), search)
+        self.assertNotEqual(move_to_algebraic(move), "b5b6")
+        self.assertGreater(score, BITBASE_SCORE - 100000)
+
+        search = SearchState(TranspositionTable(1))
+        search.bitbases = self.bitbases
+        move, score = iterative_deepening_search(board_from_fen("7K/8/8/8/8/8/1qk5/8 w - - 0 1"), SearchLimits(depth=1), search)
+        self.assertLess(score, -BITBASE_SCORE + 100000)
+
+    def test_mate_is_a_mate(self):
+        search = SearchState(TranspositionTable(1))
+        search.bitbases = self.bitbases
+        for depth in range(1, 5):
+            move, score = iterative_deepening_search(board_from_fen("k7/8/1K6/8/8/8/7Q/8 w - - 0 1"), SearchLimits(depth=depth), search)
+            self.assertEqual((move_to_algebraic(move), score), ("h2h8", sys.maxsize))
+
+    def test_delivers_mate(self):
+        # one search state for the whole game, the transposition table carries over from move to move like in a UCI game
+        for fen in ["8/8/8/4k3/8/8/8/KQ6 w - - 0 1", "8/8/8/4k3/8/8/8/KR6 w - - 0 1", "3k4/r7/8/8/8/8/8/4K3 b - - 0 1"]:
+            board = board_from_fen(fen)
+            search = SearchState(TranspositionTable(1))
+            search.bitbases = self.bitbases
+            for _ in range(100):
+                if not generate_legal_moves(board):
+                    break
+                move, _ = iterative_deepening_search(board, SearchLimits(depth=3), search)
+                board.make_move(move)
+            self.assertEqual(generate_legal_moves(board), [], fen)
+            self.assertTrue(is_check(board, board.to_move), fen)
+            self.assertEqual(board.to_move, BLACK if fen.endswith("w - - 0 1") else WHITE, fen)
+
+    def test_uci_option(self):
+        output = []
+        with mock.patch("app.send_to_gui", side_effect=output.append), mock.patch("app.log_error"):
+            engine = UciEngine()
+            try:
+                for command in [f"setoption name Bitbases value {self.directory.name}", "position fen 8/8/8/4k3/8/8/8/KQ6 w - - 0 1", "go depth 2"]:
+                    engine.handle(command)
+                engine.wait()
+                self.assertEqual(engine.search.bitbases, engine.bitbases)
+                self.assertIn("KQvK", engine.bitbases.tables)
+                scores = [int(line.split("score cp ")[1].split()[0]) for line in output if line.startswith("info")]
+                self.assertGreater(scores[-1], BITBASE_SCORE - 100000)
+                engine.handle("setoption name Bitbases value <empty>")
+                self.assertIsNone(engine.bitbases)
+            finally:
+                engine.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
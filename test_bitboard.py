@@ -0,0 +1,65 @@
+import unittest
+import app
+import bitboard
+from bitboard import rook_attacks, bishop_attacks, KNIGHT_ATTACKS, PAWN_ATTACKS, MAILBOX_SQUARES, BITBOARD_SQUARES, is_check
+from defs import WHITE, BLACK, DEFAULT_POSITION, KIWI_PETE, POSITION_3
+
+POSITIONS = [
+    DEFAULT_POSITION,
+    KIWI_PETE,
+    POSITION_3,
+    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+]
+
+
+class TestBitboard(unittest.TestCase):
+    def test_square_mapping(self):
+        # a1 is the first square of the bitboard and the bottom left of the mailbox
+        self.assertEqual(MAILBOX_SQUARES[0], 9 * 12 + 2)
+        self.assertEqual(MAILBOX_SQUARES[63], 2 * 12 + 9)
+        for sq in range(64):
+            self.assertEqual(BITBOARD_SQUARES[MAILBOX_SQUARES[sq]], sq)
+
+    def test_attack_tables(self):
+        self.assertEqual(KNIGHT_ATTACKS[0], (1 << 10) | (1 << 17))
+        self.assertEqual(PAWN_ATTACKS[WHITE][8], 1 << 17)
+        self.assertEqual(PAWN_ATTACKS[BLACK][15], 1 << 6)
+        # rook on d4 blocked on d6 and f4, the blockers are attacked
+        occupied = (1 << 43) | (1 << 29)
+        expected = sum(1 << sq for sq in [24, 25, 26, 28, 29, 3, 11, 19, 35, 43])
+        self.assertEqual(rook_attacks(27, occupied), expected)
+        self.assertEqual(bishop_attacks(0, 1 << 18), (1 << 9) | (1 << 18))
+
+    def test_same_moves_as_mailbox(self):
+        for fen in POSITIONS + ["7k/8/8/3pP3/8/8/8/7K w - d6 0 1"]:
+            board = app.board_from_fen(fen)
+            position = bitboard.board_from_fen(fen)
+            self.assertEqual(sorted(bitboard.generate_legal_moves(position)), sorted(app.generate_legal_moves(board)))
+            self.assertEqual(is_check(position, position.to_move), app.is_check(board, board.to_move))
+
+    def test_perft_matches_mailbox(self):
+        for fen in POSITIONS:
+            expected = [0] * 5
+            app.generate_moves_test(app.board_from_fen(fen), 0, 2, expected)
+            move_counts = [0] * 5
+            bitboard.generate_moves_test(bitboard.board_from_fen(fen), 0, 2, move_counts)
+            self.assertEqual(move_counts, expected)
+
+        move_counts = [0] * 5
+        bitboard.generate_moves_test(bitboard.board_from_fen(KIWI_PETE), 0, 3, move_counts)
+        self.assertEqual(move_counts[:3], [48, 2039, 97862])
+
+    def test_generate_moves_leaves_position_alone(self):
+        position = bitboard.board_from_fen(KIWI_PETE)
+        pieces = position.pieces[:]
+        children = bitboard.generate_moves(position)
+        self.assertEqual(len(children), 48)
+        self.assertEqual(position.pieces, pieces)
+        self.assertTrue(all(child.to_move == BLACK for child in children))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import bookbuilder
+from app import board_from_fen, parse_move
+from bookbuilder import build_book, movetext_moves, read_games, parse_san
+from defs import KIWI_PETE, move_to_algebraic
+from polyglot import PolyglotBook, polyglot_key, polyglot_move, decode_move, choose_book_move
+
+PGN = """[Event "one"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 {a comment
+over two lines} (2. f4 exf4 (2... d5) 3. Nf3) Nc6 3. Bb5 a6 $1 4. Ba4 Nf6 5. O-O Be7 1-0
+
+[Event "two"]
+[Result "1/2-1/2"]
+
+1.e4 c5 2.Nf3 d6 3.d4 cxd4 4.Nxd4 Nf6 5.Nc3 a6 1/2-1/2
+
+[Event "three"]
+[Result "0-1"]
+1. d4 d5 ; a rest of line comment
+2. c4 e6 0-1
+
+[Event "four"]
+[Result "1-0"]
+
+1. e4 c5 2. Nf3 1-0
+
+[Event "unfinished"]
+[Result "*"]
+
+1. a4 *
+
+[Event "setup"]
+[SetUp "1"]
+[FEN "r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1"]
+[Result "0-1"]
+
+1... O-O-O 2. Ke2 Rh2+ 0-1
+"""
+
+
+class TestBookBuilder(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.pgn = os.path.join(self.directory, "games.pgn")
+        with open(self.pgn, "w") as f:
+            f.write(PGN)
+
+    def build(self, name, **options):
+        filename = os.path.join(self.directory, name)
+        return filename, build_book([self.pgn], filename, **options)
+
+    def moves(self, book, board):
+        return {decode_move(board, entry.move): entry.weight for entry in book.find(polyglot_key(board))}
+
+    def test_movetext(self):
+        self.assertEqual(movetext_moves("1. e4 {x (y)} e5 (1... c5 (1... e6) 2. Nf3) 2.Nf3 $2 Nc6?! ; z\n3. Bb5 1-0"),
+                         ["e4", "e5", "Nf3", "Nc6?!", "Bb5"])
+        games = list(read_games(PGN.splitlines()))
+        self.assertEqual([game.headers["Event"] for game in games], ["one", "two", "three", "four", "unfinished", "setup"])
+        self.assertEqual(games[2].moves, ["d4", "d5", "c4", "e6"])
+
+    def test_parse_san(self):
+        b = board_from_fen(KIWI_PETE)
+        for san, expected in [("O-O", "e1g1"), ("O-O-O", "e1c1"), ("Qxf6", "f3f6"), ("Bxa6", "e2a6"), ("dxe6", "d5e6"),
+                              ("Nxf7", "e5f7"), ("Nb1", "c3b1"), ("Rb1", "a1b1"), ("a4", "a2a4"), ("Qh3+", "f3h3")]:
+            self.assertEqual(move_to_algebraic(parse_san(b, san)), expected, san)
+        for san in ["Nd2", "Ke3", "e5", "Qh7"]:
+            self.assertIsNone(parse_san(b, san), san)
+
+        b = board_from_fen("1n2k3/P7/8/8/8/8/7K/R6R w - - 0 1")
+        self.assertEqual(move_to_algebraic(parse_san(b, "axb8=N")), "a7b8n")
+        self.assertEqual(move_to_algebraic(parse_san(b, "a8Q")), "a7a8q")
+        self.assertEqual(move_to_algebraic(parse_san(b, "Rad1")), "a1d1")
+        self.assertIsNone(parse_san(b, "Rd1"))
+
+    def test_weights(self):
+        filename, stats = self.build("book.bin")
+        self.assertEqual((stats.games, stats.skipped), (5, 1))
+        with PolyglotBook(filename) as book:
+            start = board_from_fen()
+            # e4 won twice and drew once, d4 lost
+            self.assertEqual(self.moves(book, start), {"e2e4": 5})
+            b = board_from_fen()
+            b.make_move(parse_move(b, "e2e4"))
+            # e5 only lost, c5 drew once
+            self.assertEqual(self.moves(book, b), {"c7c5": 1})
+            b.make_move(parse_move(b, "c7c5"))
+            self.assertEqual(self.moves(book, b), {"g1f3": 3})
+            b = board_from_fen()
+            for move in ["d2d4", "d7d5", "c2c4"]:
+                b.make_move(parse_move(b, move))
+            self.assertEqual(self.moves(book, b), {"e7e6": 2})
+            # castling is stored as the king taking its rook and read back as the king move
+            b = board_from_fen("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1")
+            entry = book.find(polyglot_key(b))[0]
+            self.assertEqual(entry.move, polyglot_move(parse_move(b, "e8c8")))
+            self.assertEqual(choose_book_move(b, book), "e8c8")
+
+    def test_spilled_runs_give_the_same_book(self):
+        filename, stats = self.build("book.bin")
+        spilled, spilled_stats = self.build("spilled.bin", max_entries=3)
+        self.assertEqual(stats.runs, 1)
+        self.assertGreater(spilled_stats.runs, 5)
+        self.assertEqual(stats.entries, spilled_stats.entries)
+        with open(filename, "rb") as f, open(spilled, "rb") as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_merge_in_passes(self):
+        filename, stats = self.build("book.bin")
+        opened = []
+        merge = bookbuilder.merge_runs
+
+        def counting_merge(filenames):
+            opened.append(len(filenames))
+            return merge(filenames)
+
+        with mock.patch("bookbuilder.merge_runs", side_effect=counting_merge):
+            passes, passes_stats = self.build("passes.bin", max_entries=3, max_merge_runs=2)
+        self.assertGreater(passes_stats.runs, 5)
+        self.assertGreater(len(opened), 1)
+        self.assertLessEqual(max(opened), 2)
+        with open(filename, "rb") as f, open(passes, "rb") as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(sorted(os.listdir(self.directory)), ["book.bin", "games.pgn", "passes.bin"])
+
+    def test_max_ply_and_min_games(self):
+        filename, stats = self.build("book.bin", max_ply=1)
+        self.assertEqual(stats.positions, 5)
+        with PolyglotBook(filename) as book:
+            self.assertEqual(book.entries, 2)
+
+        filename, stats = self.build("common.bin", min_games=2)
+        with PolyglotBook(filename) as book:
+            moves = {decode_move(board_from_fen(), book.entry(i).move) for i in range(book.entries)}
+            self.assertEqual(moves, {"e2e4", "c7c5", "g1f3"})
+
+    def test_bad_fen_is_skipped(self):
+        with open(self.pgn, "a") as f:
+            f.write('\n[Event "bad"]\n[SetUp "1"]\n[FEN "r3k2r/8/8 b KQkq - 0 1"]\n[Result "1-0"]\n\n1... O-O-O 1-0\n'
+                    '\n[Event "worse"]\n[FEN "not a fen"]\n[Result "0-1"]\n\n1. e4 0-1\n')
+        filename, stats = self.build("book.bin")
+        self.assertEqual((stats.games, stats.skipped), (5, 3))
+        with PolyglotBook(filename) as book:
+            self.assertEqual(self.moves(book, board_from_fen()), {"e2e4": 5})
+
+    def test_empty_archive(self):
+        with open(self.pgn, "w"):
+            pass
+        filename, stats = self.build("book.bin")
+        self.assertEqual(stats, (0, 0, 0, 1, 0))
+        with PolyglotBook(filename) as book:
+            self.assertEqual(book.entries, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
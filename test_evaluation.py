@@ -1,6 +1,6 @@
 import unittest
-from app import PIECE_VALUES
-from defs import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from app import PIECE_VALUES, board_from_fen, generate_legal_moves, get_evaluation, get_evaluation_from_scratch, compute_positional_score
+from defs import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, DEFAULT_POSITION, KIWI_PETE
 
 
 class TestEvaluation(unittest.TestCase):
@@ -12,6 +12,30 @@ class TestEvaluation(unittest.TestCase):
         self.assertEqual(PIECE_VALUES[QUEEN], 900)
         self.assertEqual(PIECE_VALUES[KING], 20000)
 
+    def test_start_position_is_balanced(self):
+        b = board_from_fen(DEFAULT_POSITION)
+        self.assertEqual(b.positional_score, 0)
+        self.assertEqual(get_evaluation(b), 0)
+
+    def assert_incremental_matches_scan(self, b, depth):
+        self.assertEqual(b.positional_score, compute_positional_score(b))
+        self.assertEqual(get_evaluation(b), get_evaluation_from_scratch(b))
+        if depth == 0:
+            return
+        for move in generate_legal_moves(b):
+            undo = b.make_move(move)
+            self.assert_incremental_matches_scan(b, depth - 1)
+            b.unmake_move(undo)
+
+    def test_incremental_evaluation_matches_scan(self):
+        # captures, promotions, castling, en passant and the late game king table
+        for fen, depth in [(KIWI_PETE, 2),
+                           ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", 2),
+                           ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", 2),
+                           ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 40", 3),
+                           ("7k/8/8/3pP3/8/8/8/7K w - d6 0 1", 2)]:
+            self.assert_incremental_matches_scan(board_from_fen(fen), depth)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,10 @@
 import unittest
 
 from app import Chess, board_from_fen, generate_moves_test, generate_moves
-from app import knight_moves, pawn_moves, king_moves, rook_moves, bishop_moves, queen_moves, get_moves, is_check, can_castle, pawn_moves_en_passant
-from defs import WHITE, KNIGHT, PAWN, BLACK, KING, ROOK, BISHOP, QUEEN, BOARD_START, BOARD_END, is_white, CastlingType
+from app import knight_moves, pawn_moves, king_moves, rook_moves, bishop_moves, queen_moves, get_moves, is_check, can_castle, pawn_moves_en_passant, is_check_cords
+from app import generate_legal_moves, generate_pseudo_legal_moves, find_checkers_and_pins, MoveBuffer
+from defs import WHITE, KNIGHT, PAWN, BLACK, KING, ROOK, BISHOP, QUEEN, BOARD_START, BOARD_END, is_white, CastlingType, KIWI_PETE, POSITION_3, move_to_algebraic
+import bitboard
 
 
 class TestMoveGen(unittest.TestCase):
@@ -125,6 +127,75 @@ class TestMoveGen(unittest.TestCase):
         b = board_from_fen("8/8/8/8/8/6PN/5P1P/4K1PR w KQkq - 0 1")
         self.assertTrue(not can_castle(b, CastlingType.WHITE_KING_SIDE))
 
+    def test_attacked_squares_match_bitboard(self):
+        for fen in [KIWI_PETE, POSITION_3,
+                    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8"]:
+            b = board_from_fen(fen)
+            position = bitboard.board_from_fen(fen)
+            for sq in range(64):
+                cords = divmod(bitboard.MAILBOX_SQUARES[sq], 12)
+                self.assertEqual(is_check_cords(b, WHITE, cords), bitboard.is_square_attacked(position, sq, BLACK))
+                self.assertEqual(is_check_cords(b, BLACK, cords), bitboard.is_square_attacked(position, sq, WHITE))
+
+    def legal_by_trial(self, b):
+        buffer = MoveBuffer()
+        n = generate_pseudo_legal_moves(b, buffer)
+        color = b.to_move
+        legal = []
+        for move in buffer.moves[:n]:
+            undo = b.make_move(move)
+            if not is_check(b, color):
+                legal.append(move)
+            b.unmake_move(undo)
+        return sorted(legal)
+
+    def test_legal_generator_matches_trial_and_error(self):
+        for fen in [KIWI_PETE, POSITION_3,
+                    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8"]:
+            b = board_from_fen(fen)
+            for move in generate_legal_moves(b):
+                undo = b.make_move(move)
+                self.assertEqual(sorted(generate_legal_moves(b)), self.legal_by_trial(b))
+                b.unmake_move(undo)
+
+    def test_en_passant_trial_leaves_piece_lists_alone(self):
+        # trying en passant on the board used to reorder the pawn list while it was walked
+        b = board_from_fen(POSITION_3)
+        for move in generate_legal_moves(b):
+            undo = b.make_move(move)
+            moves = generate_legal_moves(b)
+            self.assertEqual(len(moves), len(set(moves)))
+            b.unmake_move(undo)
+
+    def test_checkers_and_pins(self):
+        b = board_from_fen("4k3/8/8/8/1b6/8/3P4/4K2r w - - 0 1")
+        checkers, evasions, pins = find_checkers_and_pins(b, WHITE)
+        self.assertEqual(checkers, 1)
+        self.assertEqual(len(evasions), 3)
+        self.assertEqual(len(pins), 1)
+        # the pinned pawn can't move and only the king gets out of check
+        self.assertEqual(sorted(move_to_algebraic(m) for m in generate_legal_moves(b)), ["e1e2", "e1f2"])
+
+    def test_pinned_piece_moves_along_ray(self):
+        b = board_from_fen("4k3/4r3/8/8/8/8/4R3/4K3 w - - 0 1")
+        rook_moves = sorted(move_to_algebraic(m) for m in generate_legal_moves(b) if move_to_algebraic(m).startswith("e2"))
+        self.assertEqual(rook_moves, ["e2e3", "e2e4", "e2e5", "e2e6", "e2e7"])
+
+    def test_en_passant_edge_cases(self):
+        # both pawns leave the row and uncover the rook
+        b = board_from_fen("8/8/8/KPp4r/8/8/8/7k w - c6 0 1")
+        self.assertNotIn("b5c6", [move_to_algebraic(m) for m in generate_legal_moves(b)])
+        # capturing the pawn that gives check
+        b = board_from_fen("8/8/8/2k5/3pP3/8/8/4K3 b - e3 0 1")
+        self.assertIn("d4e3", [move_to_algebraic(m) for m in generate_legal_moves(b)])
+        # the capturing pawn is pinned diagonally, it may only take en passant along the pin
+        b = board_from_fen("8/7k/8/8/4pP2/8/8/1B2K3 b - f3 0 1")
+        self.assertNotIn("e4f3", [move_to_algebraic(m) for m in generate_legal_moves(b)])
+        b = board_from_fen("8/7k/8/8/3Pp3/8/8/1B2K3 b - d3 0 1")
+        self.assertIn("e4d3", [move_to_algebraic(m) for m in generate_legal_moves(b)])
+
     def test_queen_checks(self):
         b = board_from_fen("8/8/8/8/3k1Q2/8/8/8 w - - 0 1")
         self.assertTrue(is_check(b, BLACK))
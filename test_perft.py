@@ -1,5 +1,7 @@
 import unittest
 from app import generate_moves_test, board_from_fen
+from defs import DEFAULT_POSITION, KIWI_PETE, POSITION_3, move_to_algebraic
+from perft import perft, divide, parallel_divide, read_epd, PerftCache, PERFT_SUITE
 
 
 class TestPerft(unittest.TestCase):
@@ -10,7 +12,7 @@ class TestPerft(unittest.TestCase):
         generate_moves_test(b, 0, 2, move_states)
         self.assertEqual(move_states[0], 46)
         self.assertEqual(move_states[1], 2079)
-        # self.assertEqual(move_states[2], 89890) == SLOW
+        self.assertEqual(perft(b, 3, PerftCache(1)), 89890)
 
     def test_peft_position_5(self):
         move_states = [0] * 5
@@ -59,7 +61,52 @@ class TestPerft(unittest.TestCase):
         self.assertEqual(move_states[0], 20)
         self.assertEqual(move_states[1], 400)
         self.assertEqual(move_states[2], 8902)
-        # self.assertEqual(move_states[3], 197281)
+        self.assertEqual(perft(b, 4, PerftCache(1)), 197281)
+
+    def test_perft_zobrist_incremental_matches_recompute(self):
+        for fen, depth in [("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 2),
+                           ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 3),
+                           ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", 2)]:
+            move_states = [0] * 5
+            b = board_from_fen(fen)
+            generate_moves_test(b, 0, depth, move_states, verify_hash=True)
+
+
+
+class TestPerftTool(unittest.TestCase):
+    def test_bulk_count_matches_move_counts(self):
+        for fen, depth in [(KIWI_PETE, 2), (POSITION_3, 3)]:
+            move_states = [0] * 5
+            generate_moves_test(board_from_fen(fen), 0, depth, move_states)
+            self.assertEqual(perft(board_from_fen(fen), depth), move_states[depth - 1])
+
+    def test_cache_gives_same_counts(self):
+        cache = PerftCache(1)
+        self.assertEqual(perft(board_from_fen(KIWI_PETE), 3, cache), 97862)
+        # transpositions need two moves of each side, the second run is answered from the cache at the root
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(perft(board_from_fen(KIWI_PETE), 3, cache), 97862)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(perft(board_from_fen(POSITION_3), 5, PerftCache(1)), 674624)
+
+    def test_divide(self):
+        counts = divide(board_from_fen(DEFAULT_POSITION), 3)
+        self.assertEqual(len(counts), 20)
+        self.assertEqual(sum(count for _, count in counts), 8902)
+        self.assertIn(("e2e4", 600), [(move_to_algebraic(move), count) for move, count in counts])
+
+    def test_parallel_divide_matches_serial(self):
+        b = board_from_fen(KIWI_PETE)
+        expected = sorted(divide(b, 3))
+        self.assertEqual(sorted(parallel_divide(b, 3, 2)), expected)
+        self.assertEqual(sorted(parallel_divide(b, 3, 2, split_depth=2)), expected)
+
+    def test_suite_shallow(self):
+        positions = read_epd(PERFT_SUITE)
+        self.assertGreater(len(positions), 20)
+        for fen, counts in positions:
+            self.assertEqual(perft(board_from_fen(fen), 2), counts[1])
+
 
 if __name__ == "__main__":
     unittest.main()
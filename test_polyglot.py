@@ -0,0 +1,133 @@
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+import app
+from app import UciEngine, board_from_fen, parse_move
+from polyglot import PolyglotBook, BookEntry, ENTRY, polyglot_key, decode_move, encode_move, choose_book_move
+from defs import DEFAULT_POSITION, KIWI_PETE
+
+
+def play(board, moves):
+    for text in moves.split():
+        board.make_move(parse_move(board, text))
+    return board
+
+
+def write_book(filename, entries):
+    with open(filename, "wb") as f:
+        for entry in sorted(entries):
+            f.write(ENTRY.pack(*entry))
+
+
+class TestPolyglot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "book.bin")
+        start = polyglot_key(board_from_fen())
+        after_e4 = polyglot_key(play(board_from_fen(), "e2e4"))
+        write_book(self.filename, [
+            (start, encode_move("e2e4"), 30, 0),
+            (start, encode_move("d2d4"), 10, 0),
+            (start, encode_move("a2a3"), 0, 0),
+            (after_e4, encode_move("c7c5"), 5, 0),
+            (1, encode_move("a2a3"), 1, 0),
+            ((1 << 64) - 1, encode_move("a2a3"), 1, 0),
+        ])
+
+    def test_keys(self):
+        # the examples of the Polyglot book format description
+        for moves, key in [("", 0x463b96181691fc9c),
+                           ("e2e4", 0x823c9b50fd114196),
+                           ("e2e4 d7d5", 0x0756b94461c50fb0),
+                           ("e2e4 d7d5 e4e5", 0x662fafb965db29d4),
+                           ("e2e4 d7d5 e4e5 f7f5", 0x22a48b5a8e47ff78),
+                           ("e2e4 d7d5 e4e5 f7f5 e1e2", 0x652a607ca3f242c1),
+                           ("e2e4 d7d5 e4e5 f7f5 e1e2 e8f7", 0x00fdd303c946bdd9),
+                           ("a2a4 b7b5 h2h4 b5b4 c2c4", 0x3c8123ea7b067637),
+                           ("a2a4 b7b5 h2h4 b5b4 c2c4 b4c3 a1a3", 0x5c3f9b829b279560)]:
+            self.assertEqual(polyglot_key(play(board_from_fen(), moves)), key, moves)
+
+    def test_find(self):
+        with PolyglotBook(self.filename) as book:
+            self.assertEqual(book.entries, 6)
+            entries = book.find(polyglot_key(board_from_fen()))
+            self.assertEqual(sorted(decode_move(board_from_fen(), entry.move) for entry in entries), ["a2a3", "d2d4", "e2e4"])
+            self.assertEqual(book.find(1), [BookEntry(1, encode_move("a2a3"), 1, 0)])
+            self.assertEqual(len(book.find((1 << 64) - 1)), 1)
+            self.assertEqual(book.find(2), [])
+
+    def test_empty_book(self):
+        write_book(self.filename, [])
+        with PolyglotBook(self.filename) as book:
+            self.assertEqual(book.find(polyglot_key(board_from_fen())), [])
+
+    def test_choose_move(self):
+        with PolyglotBook(self.filename) as book:
+            board = board_from_fen()
+            self.assertEqual(choose_book_move(board, book, best=True), "e2e4")
+            rng = random.Random(7)
+            counts = {}
+            for _ in range(400):
+                move = choose_book_move(board, book, rng=rng)
+                counts[move] = counts.get(move, 0) + 1
+            self.assertEqual(set(counts), {"e2e4", "d2d4"})
+            self.assertGreater(counts["e2e4"], 2 * counts["d2d4"])
+            self.assertEqual(choose_book_move(play(board, "e2e4"), book), "c7c5")
+            self.assertIsNone(choose_book_move(board_from_fen(KIWI_PETE), book))
+
+    def test_moves(self):
+        board = board_from_fen(KIWI_PETE)
+        self.assertEqual(decode_move(board, encode_move("e1h1")), "e1g1")
+        self.assertEqual(decode_move(board, encode_move("e1a1")), "e1c1")
+        self.assertEqual(decode_move(board, encode_move("e2a6")), "e2a6")
+        board = board_from_fen("7k/P7/8/8/8/8/8/K7 w - - 0 1")
+        self.assertEqual(decode_move(board, encode_move("a7a8n")), "a7a8n")
+
+    def test_corrupt_entry(self):
+        # promotion bits 5 to 7 are no piece
+        start = polyglot_key(board_from_fen())
+        write_book(self.filename, [(start, encode_move("e2e4") | (7 << 12), 100, 0), (start, encode_move("d2d4"), 1, 0)])
+        self.assertIsNone(decode_move(board_from_fen(), encode_move("e2e4") | (5 << 12)))
+        with PolyglotBook(self.filename) as book:
+            self.assertEqual(choose_book_move(board_from_fen(), book, best=True), "d2d4")
+            self.assertEqual(choose_book_move(board_from_fen(), book, rng=random.Random(1)), "d2d4")
+
+        write_book(self.filename, [(start, encode_move("e2e4") | (6 << 12), 100, 0)])
+        output = []
+        with mock.patch("app.send_to_gui", side_effect=output.append), mock.patch("app.log_error"):
+            engine = UciEngine()
+            engine.handle(f"setoption name Book value {self.filename}")
+            engine.handle("position startpos")
+            engine.handle("go depth 1")
+            engine.wait()
+            engine.close()
+        # out of the book the engine searches
+        self.assertTrue(output[-1].startswith("bestmove"))
+        self.assertTrue(any(line.startswith("info") for line in output))
+
+    def test_uci_book_option(self):
+        output = []
+        with mock.patch("app.send_to_gui", side_effect=output.append), mock.patch("app.log_error"):
+            engine = UciEngine()
+            engine.handle(f"setoption name Book value {self.filename}")
+            engine.handle("setoption name Best Book Move value true")
+            engine.handle("position startpos")
+            engine.handle("go wtime 1000 btime 1000")
+            engine.wait()
+            self.assertEqual(output, ["bestmove e2e4\n"])
+            # out of the book the engine searches
+            engine.handle("position startpos moves g1f3")
+            engine.handle("go depth 1")
+            engine.wait()
+            self.assertTrue(output[-1].startswith("bestmove"))
+            self.assertTrue(any(line.startswith("info") for line in output))
+            engine.handle("setoption name Book value /nonexistent/book.bin")
+            self.assertIsNone(engine.book)
+            engine.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
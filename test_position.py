@@ -0,0 +1,56 @@
+import unittest
+import app
+import position
+from position import Position, position_from_chess, position_to_chess, position_to_fen, position_size, chess_size, NO_SQUARE, WHITE_KING_SIDE, BLACK_QUEEN_SIDE
+from defs import WHITE, BLACK, KING, PAWN, SENTINEL, DEFAULT_POSITION, KIWI_PETE, POSITION_3
+from test_bitboard import POSITIONS
+
+
+class TestPosition(unittest.TestCase):
+    def test_fen_round_trip(self):
+        for fen in POSITIONS + ["7k/8/8/3pP3/8/8/8/7K w - d6 0 1", "r3k3/8/8/8/8/8/8/4K2R b Kq - 3 40"]:
+            p = position.board_from_fen(fen)
+            self.assertEqual(position_to_fen(p), fen)
+            self.assertEqual(position_from_chess(position_to_chess(p)), p)
+
+    def test_flat_board(self):
+        p = position.board_from_fen(DEFAULT_POSITION)
+        self.assertEqual(len(p.squares), 144)
+        self.assertEqual(p.squares[0], SENTINEL)
+        self.assertEqual(p.squares[9 * 12 + 6], WHITE | KING)
+        self.assertEqual(p.squares[3 * 12 + 2], BLACK | PAWN)
+        self.assertEqual(p.white_king, 9 * 12 + 6)
+        self.assertEqual(p.black_king, 2 * 12 + 6)
+        self.assertEqual(p.castling, 15)
+        self.assertEqual(p.en_passant, NO_SQUARE)
+
+        p = position.board_from_fen("r3k3/8/8/3pP3/8/8/8/4K2R w Kq d6 0 1")
+        self.assertEqual(p.castling, WHITE_KING_SIDE | BLACK_QUEEN_SIDE)
+        self.assertEqual(p.en_passant, 4 * 12 + 5)
+
+    def test_expanded_board_matches_parsed_board(self):
+        for fen in POSITIONS:
+            board = app.board_from_fen(fen)
+            expanded = position_to_chess(position.board_from_fen(fen))
+            self.assertEqual(expanded.zobrist_key, board.zobrist_key)
+            self.assertEqual(app.get_evaluation(expanded), app.get_evaluation(board))
+            self.assertEqual(sorted(app.generate_legal_moves(expanded)), sorted(app.generate_legal_moves(board)))
+
+    def test_copy_is_independent(self):
+        p = position.board_from_fen(KIWI_PETE)
+        q = p.copy()
+        self.assertEqual(q, p)
+        q.squares[9 * 12 + 6] = 0
+        q.castling = 0
+        self.assertNotEqual(q, p)
+        self.assertEqual(p.squares[9 * 12 + 6], WHITE | KING)
+
+    def test_smaller_than_chess(self):
+        for fen in [DEFAULT_POSITION, POSITION_3]:
+            self.assertLess(position_size(position.board_from_fen(fen)) * 10, chess_size(app.board_from_fen(fen)))
+        with self.assertRaises(AttributeError):
+            Position().extra = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
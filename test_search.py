@@ -0,0 +1,211 @@
+import sys
+import time
+import unittest
+from unittest import mock
+from app import board_from_fen, parse_move, is_repetition, iterative_deepening_search, lazy_smp_search, lazy_smp_worker, parse_go, allocate_time, SearchLimits, SearchState, generate_legal_moves, generate_pseudo_legal_moves, score_moves, pick_next_move, update_quiet_cutoff, generate_captures, quiescence_search, MoveBuffer, get_evaluation
+from defs import WHITE, BLACK, KIWI_PETE, POSITION_3, MOVE_CAPTURED_MASK, MOVE_PROMOTION_MASK, MOVE_EN_PASSANT, move_to_algebraic
+from transposition import TranspositionTable, SharedTranspositionTable
+
+
+class TestIterativeDeepening(unittest.TestCase):
+    def test_depth_limit(self):
+        b = board_from_fen(KIWI_PETE)
+        depths = []
+        move, _ = iterative_deepening_search(b, SearchLimits(depth=2), on_iteration=lambda depth, *_: depths.append(depth))
+        self.assertEqual(depths, [1, 2])
+        self.assertIn(move, generate_legal_moves(b))
+
+    def test_node_limit(self):
+        b = board_from_fen(KIWI_PETE)
+        search = SearchState(TranspositionTable(1))
+        move, _ = iterative_deepening_search(b, SearchLimits(nodes=2000), search)
+        self.assertLessEqual(search.nodes, 2000)
+        self.assertIn(move, generate_legal_moves(b))
+
+    def test_movetime(self):
+        b = board_from_fen(KIWI_PETE)
+        start = time.monotonic()
+        move, _ = iterative_deepening_search(b, SearchLimits(movetime=300))
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertIn(move, generate_legal_moves(b))
+
+    def test_always_has_a_move(self):
+        b = board_from_fen(KIWI_PETE)
+        move, _ = iterative_deepening_search(b, SearchLimits(nodes=1))
+        self.assertIn(move, generate_legal_moves(b))
+
+    def test_finds_mate_in_one(self):
+        b = board_from_fen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+        move, score = iterative_deepening_search(b, SearchLimits(depth=3))
+        self.assertEqual(move_to_algebraic(move), "a1a8")
+        self.assertEqual(score, sys.maxsize)
+
+    def test_repetition(self):
+        b = board_from_fen()
+        undos = [b.make_move(parse_move(b, move)) for move in ["g1f3", "g8f6", "f3g1"]]
+        self.assertFalse(is_repetition(b))
+        undos.append(b.make_move(parse_move(b, "f6g8")))
+        self.assertTrue(is_repetition(b))
+        for undo in reversed(undos):
+            b.unmake_move(undo)
+        self.assertEqual(b.key_history, [])
+        # the half move clock of a fen counts moves the board has no keys of
+        self.assertFalse(is_repetition(board_from_fen("7k/8/8/8/8/8/8/K7 w - - 40 60")))
+
+    def test_no_moves(self):
+        b = board_from_fen("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1")
+        self.assertEqual(iterative_deepening_search(b, SearchLimits(depth=2)), (None, 0))
+
+    def test_allocate_time(self):
+        self.assertEqual(allocate_time(SearchLimits(), WHITE), (None, None))
+        self.assertEqual(allocate_time(SearchLimits(infinite=True, wtime=1000), WHITE), (None, None))
+
+        soft, hard = allocate_time(SearchLimits(movetime=1000), BLACK)
+        self.assertIsNone(soft)
+        self.assertLess(hard, 1.0)
+
+        soft, hard = allocate_time(SearchLimits(wtime=60000, btime=1000, winc=1000, binc=0), WHITE)
+        self.assertAlmostEqual(soft, 60 / 30 + 0.75)
+        self.assertAlmostEqual(hard, 60 / 8)
+
+        # the hard limit is a few times the soft limit, not a quarter of the clock
+        soft, hard = allocate_time(SearchLimits(wtime=60000, btime=60000, movestogo=40), WHITE)
+        self.assertAlmostEqual(soft, 1.5)
+        self.assertAlmostEqual(hard, 6.0)
+
+        # the last move before the time control may use everything but the overhead
+        soft, hard = allocate_time(SearchLimits(wtime=1000, btime=1000, movestogo=1), WHITE)
+        self.assertAlmostEqual(soft, 0.95)
+        self.assertAlmostEqual(hard, 0.95)
+
+        soft, hard = allocate_time(SearchLimits(wtime=60000, btime=1000, winc=1000, binc=0), BLACK)
+        self.assertLess(hard, 1.0)
+
+
+class TestLazySmp(unittest.TestCase):
+    def test_helpers_share_the_table(self):
+        b = board_from_fen(KIWI_PETE)
+        search = SearchState(SharedTranspositionTable(4))
+        depths = []
+        move, _ = lazy_smp_search(b, SearchLimits(depth=2), 3, search, lambda depth, *_: depths.append(depth))
+        search.tt.close()
+        self.assertEqual(depths, [1, 2])
+        self.assertIn(move, generate_legal_moves(b))
+
+    def test_helpers_differ_without_a_depth_limit(self):
+        tt = SharedTranspositionTable(1)
+        searches = {}
+
+        def capture(board, limits, search, on_iteration):
+            searches[len(searches) + 1] = (limits, search.start_depth, search.history)
+
+        with mock.patch("app.iterative_deepening_search", side_effect=capture):
+            for index in (1, 2, 3):
+                lazy_smp_worker(KIWI_PETE, SearchLimits(movetime=100), tt.name, tt.size_mb, 0, index, [0] * 12, None)
+        tt.close()
+        self.assertEqual([searches[i][0] for i in (1, 2, 3)], [SearchLimits(movetime=100)] * 3)
+        self.assertEqual([searches[i][1] for i in (1, 2, 3)], [2, 1, 2])
+        histories = [searches[i][2] for i in (1, 2, 3)]
+        self.assertNotEqual(histories[0], histories[1])
+        self.assertNotEqual(histories[0], histories[2])
+        self.assertTrue(all(any(history) for history in histories))
+
+    def test_start_depth(self):
+        search = SearchState(TranspositionTable(1))
+        search.start_depth = 2
+        depths = []
+        iterative_deepening_search(board_from_fen(KIWI_PETE), SearchLimits(depth=3), search, lambda depth, *_: depths.append(depth))
+        self.assertEqual(depths, [2, 3])
+
+    def test_single_thread_is_plain_iterative_deepening(self):
+        b = board_from_fen(POSITION_3)
+        self.assertEqual(lazy_smp_search(b, SearchLimits(depth=3), 1), iterative_deepening_search(b, SearchLimits(depth=3)))
+
+    def test_finds_mate_with_helpers(self):
+        b = board_from_fen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+        move, score = lazy_smp_search(b, SearchLimits(depth=3), 2)
+        self.assertEqual(move_to_algebraic(move), "a1a8")
+        self.assertEqual(score, sys.maxsize)
+
+    def test_parse_go(self):
+        self.assertEqual(parse_go("depth 5".split()), SearchLimits(depth=5))
+        self.assertEqual(parse_go("wtime 1000 btime 2000 winc 10 binc 20 movestogo 5".split()),
+                         SearchLimits(wtime=1000, btime=2000, winc=10, binc=20, movestogo=5))
+        self.assertEqual(parse_go(["infinite"]), SearchLimits(infinite=True))
+        with mock.patch("app.log_error") as log_error:
+            self.assertEqual(parse_go("depth x movetime 100".split()), SearchLimits(movetime=100))
+        log_error.assert_called_once()
+
+
+class TestMoveOrdering(unittest.TestCase):
+    def ordered_moves(self, b, search, hash_move=0, ply=0):
+        buffer = search.buffers[ply]
+        n = generate_pseudo_legal_moves(b, buffer)
+        score_moves(search, buffer, n, hash_move, ply)
+        return [move_to_algebraic(pick_next_move(buffer, i, n)) for i in range(n)]
+
+    def test_mvv_lva(self):
+        b = board_from_fen("4k3/8/8/3q4/2P1p3/3Q4/8/4K3 w - - 0 1")
+        moves = self.ordered_moves(b, SearchState())
+        self.assertEqual(moves[:3], ["c4d5", "d3d5", "d3e4"])
+
+    def find_move(self, b, name):
+        return [m for m in generate_legal_moves(b) if move_to_algebraic(m) == name][0]
+
+    def test_hash_move_then_killers_then_history(self):
+        b = board_from_fen("4k3/8/8/3q4/2P5/8/8/4K3 w - - 0 1")
+        search = SearchState()
+        hash_move = self.find_move(b, "e1f1")
+        killer = self.find_move(b, "e1e2")
+        quiet = self.find_move(b, "e1f2")
+        update_quiet_cutoff(search, quiet, 1, 3)
+        update_quiet_cutoff(search, killer, 2, 0)
+        moves = self.ordered_moves(b, search, hash_move)
+        self.assertEqual(moves[:4], ["e1f1", "c4d5", "e1e2", "e1f2"])
+
+    def test_fewer_nodes_to_depth(self):
+        for fen in [KIWI_PETE, POSITION_3, "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"]:
+            unordered = SearchState(TranspositionTable(1), order_moves=False, quiescence=False)
+            ordered = SearchState(TranspositionTable(1), quiescence=False)
+            expected = iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=3), unordered)
+            res = iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=3), ordered)
+            self.assertEqual(res[1], expected[1])
+            self.assertLess(ordered.nodes, unordered.nodes)
+
+
+class TestQuiescence(unittest.TestCase):
+    def test_capture_generator_matches_full_generator(self):
+        for fen in [KIWI_PETE, POSITION_3,
+                    "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                    "7k/8/8/3pP3/8/8/8/7K w - d6 0 1"]:
+            b = board_from_fen(fen)
+            buffer = MoveBuffer()
+            n = generate_pseudo_legal_moves(b, buffer)
+            expected = sorted(m for m in buffer.moves[:n] if m & (MOVE_CAPTURED_MASK | MOVE_PROMOTION_MASK))
+            n = generate_captures(b, buffer)
+            self.assertEqual(sorted(buffer.moves[:n]), expected)
+
+        b = board_from_fen("7k/8/8/3pP3/8/8/8/7K w - d6 0 1")
+        n = generate_captures(b, buffer)
+        self.assertTrue(any(m & MOVE_EN_PASSANT for m in buffer.moves[:n]))
+
+    def test_stand_pat_in_quiet_position(self):
+        b = board_from_fen("4k3/8/8/8/8/8/8/3QK3 w - - 0 1")
+        search = SearchState()
+        self.assertEqual(quiescence_search(b, -sys.maxsize, sys.maxsize, WHITE, 0, search), get_evaluation(b))
+        self.assertEqual(search.qnodes, 1)
+
+    def test_avoids_horizon_blunder(self):
+        fen = "4k3/8/4p3/3p4/8/8/8/3QK3 w - - 0 1"
+        move, _ = iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=1), SearchState(quiescence=False))
+        self.assertEqual(move_to_algebraic(move), "d1d5")
+
+        search = SearchState()
+        move, _ = iterative_deepening_search(board_from_fen(fen), SearchLimits(depth=1), search)
+        self.assertNotEqual(move_to_algebraic(move), "d1d5")
+        self.assertGreater(search.qnodes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import sys
+import unittest
+from app import board_from_fen, alpha_beta_search, SearchState
+from defs import POSITION_3
+from transposition import TranspositionTable, SharedTranspositionTable, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER, ENTRY_SIZE, SHARED_ENTRY_WORDS
+
+
+class TestTranspositionTable(unittest.TestCase):
+    def test_size_from_memory_budget(self):
+        tt = TranspositionTable(1)
+        self.assertLessEqual(tt.entries * ENTRY_SIZE, 1024 * 1024)
+        self.assertGreater(tt.entries * ENTRY_SIZE, 512 * 1024)
+        self.assertEqual(len(tt.keys), tt.entries)
+
+    def test_store_and_get(self):
+        tt = TranspositionTable(1)
+        self.assertIsNone(tt.get(12345))
+        tt.store(12345, 3, -40, BOUND_LOWER, 777)
+        self.assertEqual(tt.get(12345), (3, -40, BOUND_LOWER, 777))
+
+    def test_depth_preferred_and_always_replace(self):
+        tt = TranspositionTable(1)
+        buckets = tt.bucket_mask + 1
+        deep, shallow, other = 5, 5 + buckets, 5 + 2 * buckets
+        tt.store(deep, 6, 10, BOUND_EXACT, 1)
+        tt.store(shallow, 2, 20, BOUND_EXACT, 2)
+        self.assertEqual(tt.get(deep)[1], 10)
+        self.assertEqual(tt.get(shallow)[1], 20)
+
+        # another shallow entry replaces the always-replace slot, the deep one survives
+        tt.store(other, 1, 30, BOUND_UPPER, 3)
+        self.assertEqual(tt.get(deep)[1], 10)
+        self.assertIsNone(tt.get(shallow))
+        self.assertEqual(tt.get(other)[1], 30)
+
+    def test_old_entries_are_evicted(self):
+        tt = TranspositionTable(1)
+        buckets = tt.bucket_mask + 1
+        tt.store(5, 10, 10, BOUND_EXACT, 1)
+        tt.new_search()
+        tt.store(5 + buckets, 1, 20, BOUND_EXACT, 2)
+        self.assertIsNone(tt.get(5))
+        self.assertEqual(tt.get(5 + buckets)[1], 20)
+
+    def test_keeps_best_move_of_same_position(self):
+        tt = TranspositionTable(1)
+        tt.store(99, 2, 10, BOUND_EXACT, 42)
+        tt.store(99, 3, 5, BOUND_UPPER, 0)
+        self.assertEqual(tt.get(99), (3, 5, BOUND_UPPER, 42))
+
+    def test_search_with_table(self):
+        b = board_from_fen(POSITION_3)
+        plain = SearchState()
+        expected = alpha_beta_search(b, 4, -sys.maxsize, sys.maxsize, b.to_move, search=plain)
+
+        hashed = SearchState(TranspositionTable(1))
+        res = alpha_beta_search(b, 4, -sys.maxsize, sys.maxsize, b.to_move, search=hashed)
+        self.assertEqual(res[1], expected[1])
+        self.assertLess(hashed.nodes, plain.nodes)
+        self.assertGreater(hashed.tt.hashfull(), 0)
+
+
+
+class TestSharedTranspositionTable(unittest.TestCase):
+    def setUp(self):
+        self.tt = SharedTranspositionTable(1)
+
+    def tearDown(self):
+        self.tt.close()
+
+    def test_store_and_get(self):
+        self.assertIsNone(self.tt.get(12345))
+        self.tt.store(12345, 3, -40, BOUND_LOWER, 777)
+        self.assertEqual(self.tt.get(12345), (3, -40, BOUND_LOWER, 777))
+        self.tt.store(99, 2, sys.maxsize, BOUND_EXACT, 0)
+        self.assertEqual(self.tt.get(99), (2, sys.maxsize, BOUND_EXACT, 0))
+
+    def test_attached_table_sees_the_same_entries(self):
+        other = SharedTranspositionTable(1, self.tt.name, self.tt.age)
+        self.tt.store(12345, 3, -40, BOUND_LOWER, 777)
+        self.assertEqual(other.get(12345), (3, -40, BOUND_LOWER, 777))
+        other.store(54321, 1, 10, BOUND_EXACT, 5)
+        self.assertEqual(self.tt.get(54321), (1, 10, BOUND_EXACT, 5))
+        other.close()
+
+    def test_torn_entry_is_ignored(self):
+        self.tt.store(12345, 3, -40, BOUND_LOWER, 777)
+        slot = self.tt.bucket_mask & 12345
+        # another writer replaced the score but not the rest of the slot
+        self.tt.words[slot * 2 * SHARED_ENTRY_WORDS + 2] = 55
+        self.assertIsNone(self.tt.get(12345))
+
+    def test_search_with_shared_table(self):
+        b = board_from_fen(POSITION_3)
+        expected = alpha_beta_search(b, 3, -sys.maxsize, sys.maxsize, b.to_move, search=SearchState())
+        res = alpha_beta_search(b, 3, -sys.maxsize, sys.maxsize, b.to_move, search=SearchState(self.tt))
+        self.assertEqual(res[1], expected[1])
+        self.assertGreater(self.tt.hashfull(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import app
+from app import UciEngine, LogWriter, start_log, board_from_fen, board_to_fen, parse_move, uci_score
+from defs import WHITE, BLACK, DEFAULT_POSITION, KIWI_PETE
+
+
+class UciTestCase(unittest.TestCase):
+    def setUp(self):
+        self.output = []
+        patches = [mock.patch("app.send_to_gui", side_effect=self.output.append), mock.patch("app.log_error")]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.engine = UciEngine()
+        self.addCleanup(self.engine.close)
+
+    def send(self, *commands):
+        for command in commands:
+            self.assertTrue(self.engine.handle(command))
+        # a go command searches in its own thread
+        self.engine.wait()
+
+    def bestmove(self):
+        lines = [line for line in self.output if line.startswith("bestmove")]
+        self.assertEqual(len(lines), 1)
+        return lines[0].split()[1]
+
+
+class TestUci(UciTestCase):
+    def test_commands_in_any_order(self):
+        self.send("isready", "position startpos moves e2e4", "uci", "isready")
+        self.assertEqual(self.output[0], "readyok\n")
+        self.assertIn("uciok\n", self.output)
+        self.assertEqual(self.output[-1], "readyok\n")
+        for name in ("Hash", "Threads", "MultiPV", "Ponder"):
+            self.assertTrue(any(line.startswith(f"option name {name} ") for line in self.output))
+        self.assertFalse(self.engine.handle("quit"))
+
+    def test_position_moves(self):
+        self.send("position startpos moves e2e4 e7e5 g1f3")
+        self.assertEqual(board_to_fen(self.engine.board), "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2")
+        self.send(f"position fen {KIWI_PETE} moves e1g1")
+        self.assertEqual(self.engine.board.to_move, BLACK)
+        self.send("position fen 8/8/8/8/8/8/8/K6k w - -")
+        self.assertEqual(board_to_fen(self.engine.board), "8/8/8/8/8/8/8/K6k w - - 0 1")
+
+    def test_position_applies_only_new_moves(self):
+        self.send("position startpos moves e2e4 e7e5")
+        board = self.engine.board
+        with mock.patch("app.board_from_fen", side_effect=AssertionError("position rebuilt")):
+            self.send("position startpos moves e2e4 e7e5 g1f3 b8c6")
+        self.assertIs(self.engine.board, board)
+        self.assertEqual(self.engine.moves, ["e2e4", "e7e5", "g1f3", "b8c6"])
+
+        # a different game starts over
+        self.send("position startpos moves d2d4")
+        self.assertIsNot(self.engine.board, board)
+        self.assertEqual(self.engine.moves, ["d2d4"])
+
+    def test_illegal_move_stops_the_move_list(self):
+        self.send("position startpos moves e2e4 e2e4 e7e5")
+        self.assertEqual(self.engine.moves, ["e2e4"])
+
+    def test_go(self):
+        self.send("position startpos moves e2e4", "go depth 2")
+        self.assertIn(self.bestmove(), ["g8f6", "b8c6", "d7d5", "e7e5", "d7d6"])
+        info = [line for line in self.output if line.startswith("info depth 2 ")]
+        self.assertEqual(len(info), 1)
+        self.assertIn(" pv ", info[0])
+
+    def test_go_finds_mate(self):
+        self.send("position fen 6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1", "go wtime 10000 btime 10000 winc 100 binc 100 movestogo 20")
+        self.assertEqual(self.bestmove(), "a1a8")
+        self.assertTrue(any("score mate 1 " in line for line in self.output))
+
+    def test_go_without_moves(self):
+        self.send("position fen 7k/5Q2/6K1/8/8/8/8/8 b - - 0 1", "go nodes 100")
+        self.assertEqual(self.bestmove(), "0000")
+
+    def test_multipv(self):
+        self.send("setoption name MultiPV value 3", "position startpos", "go depth 2")
+        info = [line.split() for line in self.output if line.startswith("info depth 2 ")]
+        self.assertEqual([line[4] for line in info], ["1", "2", "3"])
+        moves = [line[line.index("pv") + 1] for line in info]
+        self.assertEqual(len(set(moves)), 3)
+        self.assertEqual(moves[0], self.bestmove())
+
+    def test_setoption(self):
+        self.send("setoption name Hash value 2", "setoption name threads value 2")
+        self.assertEqual(self.engine.search.tt.size_mb, 2)
+        self.assertEqual(self.engine.threads, 2)
+        self.send("setoption name Hash value lots", "setoption name Ponies value 1", "go depth 1")
+        self.assertEqual(self.engine.search.tt.size_mb, 2)
+        self.bestmove()
+
+    def test_bench(self):
+        with mock.patch("app.bench") as bench:
+            self.send("bench 2", "bench x", "bench", "isready")
+        self.assertEqual([call.args[0] for call in bench.call_args_list], [2, app.BENCH_DEPTH])
+        # nothing is written next to the engine
+        self.assertTrue(all(call.kwargs["json_file"] is None for call in bench.call_args_list))
+        app.log_error.assert_called_once()
+        self.assertEqual(self.output[-1], "readyok\n")
+
+    def test_malformed_go(self):
+        self.send("position startpos", "go depth x movetime 200")
+        self.assertIn(parse_move(board_from_fen(), self.bestmove()), app.generate_legal_moves(board_from_fen()))
+        self.send("isready")
+        self.assertEqual(self.output[-1], "readyok\n")
+
+    def test_stop_infinite_search(self):
+        self.assertTrue(self.engine.handle("position fen " + KIWI_PETE))
+        self.assertTrue(self.engine.handle("go infinite"))
+        time.sleep(0.2)
+        # the main thread still answers while the search runs
+        self.assertTrue(self.engine.handle("isready"))
+        self.assertEqual(self.output[-1], "readyok\n")
+        self.assertFalse(any(line.startswith("bestmove") for line in self.output))
+        start = time.monotonic()
+        self.assertTrue(self.engine.handle("stop"))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.bestmove()
+
+    def test_infinite_search_waits_for_stop(self):
+        self.assertTrue(self.engine.handle("position fen 6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"))
+        self.assertTrue(self.engine.handle("go infinite"))
+        time.sleep(0.2)
+        self.assertFalse(any(line.startswith("bestmove") for line in self.output))
+        self.send("stop")
+        self.assertEqual(self.bestmove(), "a1a8")
+
+    def test_position_waits_for_the_search(self):
+        self.assertTrue(self.engine.handle("position startpos"))
+        self.assertTrue(self.engine.handle("go depth 3"))
+        self.send("position startpos moves e2e4")
+        self.bestmove()
+        self.assertEqual(self.engine.moves, ["e2e4"])
+
+    def test_stop_search_with_helpers(self):
+        self.send("setoption name Threads value 2", "position fen " + KIWI_PETE)
+        self.assertTrue(self.engine.handle("go infinite"))
+        time.sleep(0.3)
+        self.send("stop")
+        self.bestmove()
+
+    def test_failed_search_still_answers(self):
+        with mock.patch("app.lazy_smp_search", side_effect=RuntimeError("boom")):
+            self.send("position startpos", "go depth 3")
+        app.log_error.assert_called_once()
+        self.assertIn(parse_move(board_from_fen(), self.bestmove()), app.generate_legal_moves(board_from_fen()))
+
+        def fail_after_one_iteration(board, limits, threads, search, on_iteration, helpers):
+            search.lines = [(parse_move(board, "d2d4"), 0)]
+            on_iteration(1, 0, 1, 0.0, parse_move(board, "d2d4"))
+            board.make_move(parse_move(board, "g1f3"))
+            raise RuntimeError("boom")
+
+        self.output.clear()
+        with mock.patch("app.lazy_smp_search", side_effect=fail_after_one_iteration):
+            self.send("position startpos", "go depth 3")
+        self.assertEqual(self.bestmove(), "d2d4")
+        # the move left on the board by the failed search is gone with the next position command
+        self.send("position startpos moves e2e4")
+        expected = board_from_fen()
+        expected.make_move(parse_move(expected, "e2e4"))
+        self.assertEqual(board_to_fen(self.engine.board), board_to_fen(expected))
+
+    def test_quit_stops_the_search(self):
+        self.assertTrue(self.engine.handle("go infinite"))
+        self.assertFalse(self.engine.handle("quit"))
+        self.bestmove()
+
+
+class TestPonder(UciTestCase):
+    def go_ponder(self, command):
+        self.send("setoption name Ponder value true", "position startpos moves e2e4 e7e5")
+        self.assertTrue(self.engine.handle(command))
+        time.sleep(0.3)
+        self.assertFalse(any(line.startswith("bestmove") for line in self.output))
+
+    def test_bestmove_has_ponder_move(self):
+        self.send("position startpos", "go depth 3")
+        tokens = [line for line in self.output if line.startswith("bestmove")][0].split()
+        self.assertEqual(tokens[2], "ponder")
+        board = board_from_fen(DEFAULT_POSITION)
+        board.make_move(parse_move(board, tokens[1]))
+        self.assertIsNotNone(parse_move(board, tokens[3]))
+
+    def test_ponderhit_keeps_searching_with_the_clock(self):
+        self.go_ponder("go ponder wtime 2000 btime 2000")
+        lines = len(self.output)
+        start = time.monotonic()
+        self.assertTrue(self.engine.handle("ponderhit"))
+        self.engine.wait()
+        # the budget of a 2 second clock, not 2 seconds plus the time spent pondering
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertGreater(len(self.output), lines)
+        self.bestmove()
+        self.assertFalse(self.engine.search.pondering)
+
+    def test_ponderhit_uses_the_clock_of_the_root(self):
+        self.go_ponder("go ponder wtime 300 btime 600000")
+        # the search thread makes and unmakes moves on the board, ponderhit must not read the side to move from it
+        self.engine.board = board_from_fen("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+        start = time.monotonic()
+        self.assertTrue(self.engine.handle("ponderhit"))
+        self.engine.wait()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.bestmove()
+
+    def test_ponder_search_waits_for_ponderhit(self):
+        # the ponder search runs out of moves to search at once, the answer still waits
+        self.send("setoption name Ponder value true", "position fen 6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")
+        self.assertTrue(self.engine.handle("go ponder wtime 1000 btime 1000"))
+        time.sleep(0.2)
+        self.assertFalse(any(line.startswith("bestmove") for line in self.output))
+        self.send("ponderhit")
+        self.assertEqual(self.bestmove(), "a1a8")
+
+    def test_ponder_miss_keeps_the_table(self):
+        self.go_ponder("go ponder movetime 100")
+        self.send("stop")
+        self.bestmove()
+        tt = self.engine.search.tt
+        key = self.engine.board.zobrist_key
+        self.assertIsNotNone(tt.get(key))
+        self.send("position startpos moves e2e4 d7d5", "go depth 1")
+        self.assertIs(self.engine.search.tt, tt)
+        self.assertIsNotNone(tt.get(key))
+
+
+class TestLog(unittest.TestCase):
+    def test_log_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "log.txt")
+            log = LogWriter(filename)
+            for i in range(1000):
+                log.write(f"line {i}\n")
+            log.close()
+            with open(filename, encoding="utf-8") as f:
+                self.assertEqual(f.read().splitlines(), [f"line {i}" for i in range(1000)])
+
+    def test_protocol_log_is_optional(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "log.txt")
+            with mock.patch("builtins.print"):
+                app.send_to_gui("readyok\n")
+                self.assertFalse(os.path.exists(filename))
+                engine = UciEngine()
+                engine.handle(f"setoption name Debug Log File value {filename}")
+                app.send_to_gui("readyok\n")
+                app.log_error("oops\n")
+                engine.close()
+            start_log(None)
+            with open(filename, encoding="utf-8") as f:
+                self.assertEqual(f.read(), "ENGINE >> readyok\n<ERROR> oops\n")
+
+
+class TestUciHelpers(unittest.TestCase):
+    def test_parse_move(self):
+        board = board_from_fen("7k/P7/8/8/8/8/8/K7 w - - 0 1")
+        self.assertIsNotNone(parse_move(board, "a7a8n"))
+        self.assertIsNone(parse_move(board, "a7a8"))
+        self.assertIsNone(parse_move(board_from_fen(DEFAULT_POSITION), "e2e5"))
+
+    def test_uci_score(self):
+        self.assertEqual(uci_score(30, 4, WHITE), "cp 30")
+        self.assertEqual(uci_score(30, 4, BLACK), "cp -30")
+        self.assertEqual(uci_score(-app.sys.maxsize, 4, BLACK), "mate 2")
+        self.assertEqual(uci_score(-app.sys.maxsize, 3, WHITE), "mate -2")
+
+
+if __name__ == '__main__':
+    unittest.main()
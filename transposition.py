@@ -0,0 +1,199 @@
+from array import array
+from multiprocessing import shared_memory
+from typing import Tuple
+from defs import Move, NULL_MOVE
+
+"""
+    Transposition table kept in flat preallocated arrays, one slot per array index.
+    Slots are grouped in buckets of two:
+    - slot 0 is depth-preferred, it is only replaced by a search at least as deep, or once its entry is from an older search
+    - slot 1 is always replaced
+    Scores are stored the way alpha_beta_search returns them, from white's point of view.
+"""
+
+BOUND_NONE = 0
+BOUND_EXACT = 1
+BOUND_LOWER = 2
+BOUND_UPPER = 3
+
+DEFAULT_HASH_MB = 16
+
+# bytes per slot: key (8), score (8), move (4), depth, bound and age (1 each)
+ENTRY_SIZE = 23
+BUCKET_SIZE = 2
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: int = DEFAULT_HASH_MB):
+        self.resize(size_mb)
+
+    def resize(self, size_mb: int):
+        entries = max(BUCKET_SIZE, size_mb * 1024 * 1024 // ENTRY_SIZE)
+        # round the bucket count down to a power of two so a bucket can be found with a mask
+        buckets = 1 << ((entries // BUCKET_SIZE).bit_length() - 1)
+        self.size_mb = size_mb
+        self.bucket_mask = buckets - 1
+        self.entries = buckets * BUCKET_SIZE
+        self.keys = array('Q', [0]) * self.entries
+        self.scores = array('q', [0]) * self.entries
+        self.moves = array('I', [NULL_MOVE]) * self.entries
+        self.depths = array('B', [0]) * self.entries
+        self.bounds = array('B', [BOUND_NONE]) * self.entries
+        self.ages = array('B', [0]) * self.entries
+        self.age = 0
+
+    def clear(self):
+        self.resize(self.size_mb)
+
+    def new_search(self):
+        """
+        Start a new search generation, entries from older searches become free to replace
+        """
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key: int) -> int:
+        """
+        Returns the slot holding key, or -1 if it is not in the table
+        """
+        slot = (key & self.bucket_mask) * BUCKET_SIZE
+        if self.keys[slot] == key and self.bounds[slot] != BOUND_NONE:
+            return slot
+        slot += 1
+        if self.keys[slot] == key and self.bounds[slot] != BOUND_NONE:
+            return slot
+        return -1
+
+    def get(self, key: int) -> Tuple[int, int, int, Move] | None:
+        """
+        Returns (depth, score, bound, move) stored for key
+        """
+        slot = self.probe(key)
+        if slot < 0:
+            return None
+        return (self.depths[slot], self.scores[slot], self.bounds[slot], self.moves[slot])
+
+    def store(self, key: int, depth: int, score: int, bound: int, move: Move):
+        slot = (key & self.bucket_mask) * BUCKET_SIZE
+        if self.keys[slot + 1] == key:
+            slot += 1
+        elif not (self.keys[slot] == key or self.bounds[slot] == BOUND_NONE
+                  or self.ages[slot] != self.age or depth >= self.depths[slot]):
+            slot += 1
+
+        # keep the old best move when a shallower search of the same position did not find one
+        if move == NULL_MOVE and self.keys[slot] == key:
+            move = self.moves[slot]
+
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.scores[slot] = score
+        self.bounds[slot] = bound
+        self.moves[slot] = move
+        self.ages[slot] = self.age
+
+    def hashfull(self) -> int:
+        """
+        Permille of the first thousand slots used by the current search, as reported to UCI
+        """
+        sample = min(1000, self.entries)
+        used = sum(1 for i in range(sample) if self.bounds[i] != BOUND_NONE and self.ages[i] == self.age)
+        return used * 1000 // sample
+
+
+# 64 bit words per shared slot: check, data and score
+SHARED_ENTRY_WORDS = 3
+WORD_MASK = (1 << 64) - 1
+DATA_DEPTH_SHIFT = 32
+DATA_BOUND_SHIFT = 40
+DATA_AGE_SHIFT = 42
+
+
+class SharedTranspositionTable:
+    """
+    The transposition table of a Lazy SMP search, in shared memory so every worker process reads and writes the same slots.
+    Slots are written without locks as three 64 bit words:
+    - data packs the move, depth, bound and age
+    - score is the score as an unsigned word
+    - check is key ^ data ^ score
+    Two processes writing the same slot at once can leave a mix of both entries, that slot fails the check and reads as empty.
+    Pass the name of an existing table to attach to it, the process that created the table unlinks it.
+    """
+
+    def __init__(self, size_mb: int = DEFAULT_HASH_MB, name: str | None = None, age: int = 0):
+        entries = max(BUCKET_SIZE, size_mb * 1024 * 1024 // (SHARED_ENTRY_WORDS * 8))
+        buckets = 1 << ((entries // BUCKET_SIZE).bit_length() - 1)
+        self.size_mb = size_mb
+        self.bucket_mask = buckets - 1
+        self.entries = buckets * BUCKET_SIZE
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=self.entries * SHARED_ENTRY_WORDS * 8)
+        self.name = self.memory.name
+        self.words = self.memory.buf[:self.entries * SHARED_ENTRY_WORDS * 8].cast('Q')
+        self.age = age
+        if self.owner:
+            self.clear()
+
+    def clear(self):
+        self.memory.buf[:self.entries * SHARED_ENTRY_WORDS * 8] = bytes(self.entries * SHARED_ENTRY_WORDS * 8)
+
+    def close(self):
+        self.words.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def read(self, slot: int) -> Tuple[int, int, int]:
+        """
+        Returns (key, data, score) of slot, key is 0 for an empty or torn slot
+        """
+        words = self.words
+        i = slot * SHARED_ENTRY_WORDS
+        check, data, score = words[i], words[i + 1], words[i + 2]
+        if (data >> DATA_BOUND_SHIFT) & 3 == BOUND_NONE:
+            return (0, 0, 0)
+        return (check ^ data ^ score, data, score - (1 << 64) if score >> 63 else score)
+
+    def get(self, key: int) -> Tuple[int, int, int, Move] | None:
+        """
+        Returns (depth, score, bound, move) stored for key
+        """
+        slot = (key & self.bucket_mask) * BUCKET_SIZE
+        for slot in (slot, slot + 1):
+            slot_key, data, score = self.read(slot)
+            if slot_key == key:
+                return ((data >> DATA_DEPTH_SHIFT) & 0xFF, score, (data >> DATA_BOUND_SHIFT) & 3, data & 0xFFFFFFFF)
+        return None
+
+    def store(self, key: int, depth: int, score: int, bound: int, move: Move):
+        slot = (key & self.bucket_mask) * BUCKET_SIZE
+        # the same replacement scheme as TranspositionTable
+        first_key, first_data, _ = self.read(slot)
+        if self.read(slot + 1)[0] == key:
+            slot += 1
+        elif not (first_key == key or first_key == 0 or (first_data >> DATA_AGE_SHIFT) & 0xFF != self.age
+                  or depth >= (first_data >> DATA_DEPTH_SHIFT) & 0xFF):
+            slot += 1
+
+        if move == NULL_MOVE:
+            slot_key, data, _ = self.read(slot)
+            if slot_key == key:
+                move = data & 0xFFFFFFFF
+
+        data = move | min(depth, 0xFF) << DATA_DEPTH_SHIFT | bound << DATA_BOUND_SHIFT | self.age << DATA_AGE_SHIFT
+        score &= WORD_MASK
+        i = slot * SHARED_ENTRY_WORDS
+        self.words[i] = key ^ data ^ score
+        self.words[i + 1] = data
+        self.words[i + 2] = score
+
+    def hashfull(self) -> int:
+        sample = min(1000, self.entries)
+        used = 0
+        for slot in range(sample):
+            key, data, _ = self.read(slot)
+            if key != 0 and (data >> DATA_AGE_SHIFT) & 0xFF == self.age:
+                used += 1
+        return used * 1000 // sample
@@ -31,6 +31,11 @@ def get_piece_from_fen_string_char(piece: str) -> int | None:
             return None
 
 
+def get_fen_string_char(piece: int) -> str:
+    character = {PAWN: 'p', KNIGHT: 'n', BISHOP: 'b', ROOK: 'r', QUEEN: 'q', KING: 'k'}[piece & 7]
+    return character.upper() if piece & WHITE else character
+
+
 def get_piece_character(piece: int) -> str:
     if piece == WHITE | PAWN:
         return '♙'
@@ -0,0 +1,51 @@
+import random
+from defs import BOARD_START, BOARD_END, BOARD_WIDTH, EMPTY, WHITE, piece_code
+
+"""
+    Zobrist keys for the 12x12 board. A position key is the XOR of
+    - one key per (piece code, square index) for every piece on the board
+    - a side key when white is to move
+    - one key per castling privilege still held
+    - one key per column when a pawn just moved two squares
+    The keys are generated from a fixed seed so position keys are the same between runs.
+"""
+
+ZOBRIST_SEED = 0x5A0B215D
+random_keys = random.Random(ZOBRIST_SEED)
+
+
+def random_key() -> int:
+    return random_keys.getrandbits(64)
+
+
+ZOBRIST_PIECES = [[random_key() for _ in range(BOARD_WIDTH * BOARD_WIDTH)] for _ in range(16)]
+ZOBRIST_WHITE_TO_MOVE = random_key()
+# white king side, white queen side, black king side, black queen side
+ZOBRIST_CASTLING = [random_key() for _ in range(4)]
+ZOBRIST_EN_PASSANT = [random_key() for _ in range(BOARD_WIDTH)]
+
+
+def compute_zobrist_key(board) -> int:
+    """
+    Compute the key of board from scratch, make_move keeps it up to date incrementally
+    """
+    key = 0
+    for row in range(BOARD_START, BOARD_END):
+        for col in range(BOARD_START, BOARD_END):
+            piece = board.state[row][col]
+            if piece != EMPTY:
+                key ^= ZOBRIST_PIECES[piece_code(piece)][row * BOARD_WIDTH + col]
+
+    if board.to_move == WHITE:
+        key ^= ZOBRIST_WHITE_TO_MOVE
+    if board.white_king_side_castle:
+        key ^= ZOBRIST_CASTLING[0]
+    if board.white_queen_side_castle:
+        key ^= ZOBRIST_CASTLING[1]
+    if board.black_king_side_castle:
+        key ^= ZOBRIST_CASTLING[2]
+    if board.black_queen_side_castle:
+        key ^= ZOBRIST_CASTLING[3]
+    if board.pawn_double_move is not None:
+        key ^= ZOBRIST_EN_PASSANT[board.pawn_double_move[1]]
+    return key